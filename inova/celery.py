@@ -4,7 +4,9 @@ from __future__ import absolute_import, unicode_literals
 # ================================
 
 import os
+import logging
 from celery import Celery
+from celery.signals import worker_process_init
 
 # Establecer el módulo de configuración de Django
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'inova.settings')
@@ -28,6 +30,20 @@ app.conf.update(
 )
 
 
+@worker_process_init.connect
+def warm_signing_keys(**kwargs):
+    """Precargar en cada proceso del worker las claves de firma de las empresas con facturación"""
+    try:
+        from users.models import Company
+        from operations.services.billing_service import SigningKeyCache
+
+        companies = Company.objects.filter(is_billing=True).values_list('ruc', 'environment')
+        loaded = SigningKeyCache.warm(companies)
+        logging.getLogger('operations.tasks').info(f"Claves de firma precargadas: {loaded}")
+    except Exception as e:
+        logging.getLogger('operations.tasks').warning(f"No se pudieron precargar las claves de firma: {str(e)}")
+
+
 @app.task(bind=True)
 def debug_task(self):
     print(f'Request: {self.request!r}')
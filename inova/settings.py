@@ -418,6 +418,50 @@ BILLING_MAX_RETRIES = int(os.environ.get('BILLING_MAX_RETRIES', 5))
 BILLING_RETRY_INTERVAL_MINUTES = int(os.environ.get('BILLING_RETRY_INTERVAL_MINUTES', 30))
 BILLING_TASK_TIMEOUT_SECONDS = int(os.environ.get('BILLING_TASK_TIMEOUT_SECONDS', 300))
 
+# Generar, firmar, comprimir y enviar en memoria; los archivos (XML, FIRMA,
+# ZIP, CDR) se escriben al final del proceso o en segundo plano
+BILLING_IN_MEMORY_PIPELINE = os.environ.get('BILLING_IN_MEMORY_PIPELINE', 'True') == 'True'
+BILLING_ASYNC_ARTIFACTS = os.environ.get('BILLING_ASYNC_ARTIFACTS', 'False') == 'True'
+BILLING_ARTIFACT_WRITERS = int(os.environ.get('BILLING_ARTIFACT_WRITERS', 2))
+# Guardar en disco el ZIP enviado a SUNAT (se arma en memoria; el XML firmado siempre se guarda)
+BILLING_ARCHIVE_ZIP = os.environ.get('BILLING_ARCHIVE_ZIP', 'False') == 'True'
+
+# Validación previa de los XML contra los XSD de UBL 2.1 (carpeta xsd/ oficial)
+BILLING_XSD_VALIDATION = os.environ.get('BILLING_XSD_VALIDATION', 'False') == 'True'
+BILLING_UBL_XSD_ROOT = os.environ.get('BILLING_UBL_XSD_ROOT', os.path.join(BASE_DIR, 'sunat_xsd'))
+
+# Pool de procesos para firmar lotes (0 = un proceso por núcleo)
+BILLING_SIGNING_WORKERS = int(os.environ.get('BILLING_SIGNING_WORKERS', 0))
+BILLING_SIGNING_START_METHOD = os.environ.get('BILLING_SIGNING_START_METHOD', 'spawn')
+
+# Reintentos desde el último punto de control (XML generado/firmado sin cambios en los datos)
+BILLING_CHECKPOINTS = os.environ.get('BILLING_CHECKPOINTS', 'True') == 'True'
+
+# Historial de cambios de billing_status (BillingStatusTransition)
+BILLING_TRANSITION_LOG = os.environ.get('BILLING_TRANSITION_LOG', 'True') == 'True'
+
+# Reserva (lease) de una operación por el demonio o Celery; vencida, otro proceso la retoma
+BILLING_LEASE_SECONDS = int(os.environ.get('BILLING_LEASE_SECONDS', '600'))
+
+# Aviso al demonio (lista de Redis del caché 'billing') al crear o anular una operación
+BILLING_WAKEUP_ENABLED = os.environ.get('BILLING_WAKEUP_ENABLED', 'True') == 'True'
+BILLING_WAKEUP_KEY = os.environ.get('BILLING_WAKEUP_KEY', 'billing:wakeup')
+
+# Reintentos: Company.retry_interval_minutes (o BILLING_RETRY_INTERVAL_MINUTES) * 2^(intentos-1), hasta el máximo, +/- jitter
+BILLING_RETRY_MAX_MINUTES = int(os.environ.get('BILLING_RETRY_MAX_MINUTES', '1440'))
+BILLING_RETRY_JITTER = float(os.environ.get('BILLING_RETRY_JITTER', '0.2'))
+
+# Reparto entre empresas: prioridad por tipo de documento y tope de documentos en curso por empresa (0 = sin tope)
+BILLING_DOCUMENT_PRIORITY = {'01': 0, '07': 1, '08': 1, '03': 2}
+BILLING_COMPANY_IN_FLIGHT = int(os.environ.get('BILLING_COMPANY_IN_FLIGHT', '100'))
+BILLING_COMPANY_DEFER_SECONDS = int(os.environ.get('BILLING_COMPANY_DEFER_SECONDS', '30'))
+
+# Boletas por Resumen Diario (sendSummary) en lugar de sendBill, hasta 500 boletas por resumen
+BILLING_BOLETA_SUMMARY = os.environ.get('BILLING_BOLETA_SUMMARY', 'False') == 'True'
+BILLING_SUMMARY_MAX_LINES = int(os.environ.get('BILLING_SUMMARY_MAX_LINES', 500))
+BILLING_SUMMARY_POLL_ATTEMPTS = int(os.environ.get('BILLING_SUMMARY_POLL_ATTEMPTS', 5))
+BILLING_SUMMARY_POLL_DELAY = int(os.environ.get('BILLING_SUMMARY_POLL_DELAY', 5))
+
 # ================================
 # 📊 CONFIGURACIÓN DE LOGGING MEJORADA
 # ================================
@@ -599,6 +643,28 @@ SESSION_COOKIE_AGE = 86400  # 24 horas
 APIS_NET_PE_TOKEN = "Bearer apis-token-3244.1KWBKUSrgYq6HNht68arg8LNsId9vVLm"
 REQUESTS_TIMEOUT = int(os.environ.get('REQUESTS_TIMEOUT', 60))
 SUNAT_REQUEST_TIMEOUT = int(os.environ.get('SUNAT_REQUEST_TIMEOUT', 120))
+# Sesiones keep-alive con SUNAT (por proceso y ambiente)
+SUNAT_HTTP_POOL_SIZE = int(os.environ.get('SUNAT_HTTP_POOL_SIZE', 10))
+SUNAT_HTTP_CONNECT_RETRIES = int(os.environ.get('SUNAT_HTTP_CONNECT_RETRIES', 3))
+SUNAT_HTTP_RETRY_BACKOFF = float(os.environ.get('SUNAT_HTTP_RETRY_BACKOFF', 0.5))
+# URL de billService para todos los ambientes (vacío = SUNAT); p. ej. el servidor
+# local de pruebas: python manage.py sunat_stub_server
+SUNAT_SERVICE_URL = os.environ.get('SUNAT_SERVICE_URL', '')
+# Envíos simultáneos a SUNAT por lote (total y por RUC)
+SUNAT_DISPATCH_CONCURRENCY = int(os.environ.get('SUNAT_DISPATCH_CONCURRENCY', 10))
+SUNAT_DISPATCH_PER_COMPANY = int(os.environ.get('SUNAT_DISPATCH_PER_COMPANY', 2))
+# Circuito por ambiente (estado en el caché 'billing'): fallas seguidas para abrir y segundos abierto
+SUNAT_BREAKER_ENABLED = os.environ.get('SUNAT_BREAKER_ENABLED', 'True') == 'True'
+SUNAT_BREAKER_FAILURES = int(os.environ.get('SUNAT_BREAKER_FAILURES', 5))
+SUNAT_BREAKER_COOLDOWN = int(os.environ.get('SUNAT_BREAKER_COOLDOWN', 60))
+# Ritmo adaptativo (AIMD) de llamadas por segundo y proceso
+SUNAT_RATE_LIMIT_ENABLED = os.environ.get('SUNAT_RATE_LIMIT_ENABLED', 'True') == 'True'
+SUNAT_RATE_INITIAL = float(os.environ.get('SUNAT_RATE_INITIAL', 10))
+SUNAT_RATE_MIN = float(os.environ.get('SUNAT_RATE_MIN', 0.5))
+SUNAT_RATE_MAX = float(os.environ.get('SUNAT_RATE_MAX', 50))
+SUNAT_RATE_INCREASE = float(os.environ.get('SUNAT_RATE_INCREASE', 1))
+SUNAT_RATE_DECREASE = float(os.environ.get('SUNAT_RATE_DECREASE', 0.5))
+SUNAT_RATE_TARGET_LATENCY = float(os.environ.get('SUNAT_RATE_TARGET_LATENCY', 5))
 
 FILE_UPLOAD_MAX_MEMORY_SIZE = 5242880  # 5MB
 FILE_UPLOAD_PERMISSIONS = 0o644
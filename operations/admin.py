@@ -7,4 +7,6 @@ admin.site.register(Serial)
 admin.site.register(Document)
 admin.site.register(Operation)
 admin.site.register(OperationDetail)
-admin.site.register(Person)
\ No newline at end of file
+admin.site.register(Person)
+admin.site.register(BillingStatusTransition)
+admin.site.register(SummaryCorrelative)
@@ -15,11 +15,23 @@ import time
 import logging
 import signal
 import sys
+import threading
 import traceback
 from decimal import Decimal
 
+from operations.services.billing_lease import (
+    available, claim, lease_seconds, reclaim_expired, release, renew, worker_id
+)
+from operations.services.billing_state import StaleTransition, transition, transition_many
+from operations.services.billing_wakeup import is_enabled as wakeup_enabled
+from operations.services.fair_scheduler import FairScheduler, claim_fair, in_flight_cap, in_order
+from operations.services.retry_policy import due, due_after
+
 logger = logging.getLogger('operations.billing_daemon')
 
+# Estados de una anulación en curso (los que toma process_pending_cancellations)
+CANCELLATION_STATUSES = ('PROCESSING_CANCELLATION', 'CANCELLATION_ERROR', 'CANCELLATION_PENDING')
+
 
 class Command(BaseCommand):
     help = 'Demonio inteligente para procesamiento de facturación electrónica SUNAT'
@@ -33,8 +45,13 @@ class Command(BaseCommand):
             'failed': 0,
             'skipped': 0,
             'cancellations': 0,
+            'reconciled': 0,
+            'summaries': 0,
             'errors': []
         }
+        self.stats_lock = threading.Lock()
+        self.pool = None
+        self.queued_ids = set()
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -59,7 +76,7 @@ class Command(BaseCommand):
             '--retry-after',
             type=int,
             default=30,
-            help='Minutos a esperar antes de reintentar (default: 30)'
+            help='Minutos a esperar antes de reintentar los documentos sin próximo intento programado (default: 30)'
         )
         parser.add_argument(
             '--dry-run',
@@ -76,6 +93,42 @@ class Command(BaseCommand):
             action='store_true',
             help='Mostrar información detallada de cada proceso'
         )
+        parser.add_argument(
+            '--parallel-signing',
+            action='store_true',
+            help='Generar y firmar cada lote en paralelo con el pool de firma (útil para atrasos grandes)'
+        )
+        parser.add_argument(
+            '--reconcile',
+            action='store_true',
+            help='Consultar el CDR (getStatusCdr) de los documentos con error antes de reenviarlos'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=0,
+            help='Envíos simultáneos a SUNAT por lote (default: 0 = uno a la vez)'
+        )
+        parser.add_argument(
+            '--per-company',
+            type=int,
+            default=0,
+            help='Envíos simultáneos por RUC (default: SUNAT_DISPATCH_PER_COMPANY)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=0,
+            help='Hilos de trabajo: envíos, reintentos, anulaciones y tickets en paralelo, '
+                 'con una cola por fase (default: 0 = secuencial)'
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=0,
+            help='Tareas por segundo de cada fase (default: 0 = 1/s envíos y tickets, '
+                 '0.5/s reintentos y anulaciones, por cada hilo)'
+        )
 
     def handle(self, *args, **options):
         """Manejador principal del comando"""
@@ -86,6 +139,27 @@ class Command(BaseCommand):
         self.dry_run = options['dry_run']
         self.once = options['once']
         self.verbose = options['verbose']
+        self.parallel_signing = options['parallel_signing']
+        self.reconcile = options['reconcile']
+        self.concurrency = options['concurrency']
+        self.per_company = options['per_company']
+        self.workers = options['workers']
+        self.rate = options['rate']
+        # Reserva (lease) de las operaciones: varios demonios y Celery no toman la misma
+        self.owner = worker_id()
+        # Con firma en paralelo o envío concurrente el lote se procesa completo
+        self.batch_mode = self.parallel_signing or self.concurrency > 0
+
+        # Boletas por Resumen Diario en lugar de sendBill (BILLING_BOLETA_SUMMARY)
+        from operations.services.summary_service import BoletaSummaryService
+        self.boleta_summary = BoletaSummaryService.is_enabled()
+
+        # Ritmo por fase en lugar de pausas fijas; con --workers, un pool con una cola por fase
+        from operations.services.daemon_pool import PhaseRateLimiter, PhaseWorkerPool, phase_rates
+        rates = phase_rates(self.rate, self.workers)
+        self.limiters = {phase: PhaseRateLimiter(rate) for phase, rate in rates.items()}
+        if self.workers > 0:
+            self.pool = PhaseWorkerPool(self.workers, rates)
 
         # Configurar manejadores de señales
         signal.signal(signal.SIGINT, self.signal_handler)
@@ -109,6 +183,15 @@ class Command(BaseCommand):
 
                 # Resetear estadísticas del ciclo
                 self.reset_cycle_stats()
+                self.queued_ids = set()
+
+                # Devolver a la cola lo que otro proceso dejó a medias (reserva vencida)
+                if not self.dry_run:
+                    self.reclaim_expired_leases()
+
+                # 0. Conciliar con SUNAT los documentos con error (sin reenviarlos)
+                if self.reconcile:
+                    self.reconcile_error_documents()
 
                 # 1. Procesar documentos pendientes nuevos
                 self.process_pending_documents()
@@ -116,12 +199,20 @@ class Command(BaseCommand):
                 # 2. Reintentar documentos con error
                 self.retry_failed_documents()
 
+                # 2.1 Enviar boletas por Resumen Diario y verificar sus tickets
+                if self.boleta_summary:
+                    self.run_task('summary', self.process_boleta_summaries)
+
                 # 3. Procesar anulaciones pendientes
                 self.process_pending_cancellations()
 
                 # 4. Verificar tickets de anulación pendientes
                 self.check_cancellation_tickets()
 
+                # Con --workers las fases corren en paralelo: esperar a que terminen
+                if self.pool is not None:
+                    self.pool.join()
+
                 # 5. Limpiar y optimizar
                 self.cleanup_old_errors()
 
@@ -160,6 +251,9 @@ class Command(BaseCommand):
                 else:
                     raise
 
+        if self.pool is not None:
+            self.pool.close()
+
         # Mostrar resumen final
         self.print_final_summary()
 
@@ -171,15 +265,17 @@ class Command(BaseCommand):
             self.style.MIGRATE_LABEL('\n📋 PROCESANDO DOCUMENTOS PENDIENTES...')
         )
 
-        # Buscar documentos pendientes
+        # Buscar documentos pendientes (sin reintento programado para más adelante)
         pending_operations = Operation.objects.filter(
             Q(billing_status='PENDING') | Q(billing_status='ERROR'),
+            due(),
             operation_type='S',  # Solo ventas
             company__is_billing=True,  # Solo empresas con facturación activa
-            document__code__in=['01', '03', '07', '08']  # Facturas, Boletas, NC, ND
+            document__code__in=self.sendbill_document_codes()
         ).select_related(
             'document', 'company', 'person'
-        ).order_by('created_at')[:self.batch_size]
+        ).order_by('created_at')
+        pending_operations = self.claim(pending_operations, fair=True)
 
         if not pending_operations:
             self.stdout.write('  ℹ️ No hay documentos pendientes')
@@ -187,6 +283,7 @@ class Command(BaseCommand):
 
         self.stdout.write(f'  📦 Encontrados: {len(pending_operations)} documentos')
 
+        batch = []
         for operation in pending_operations:
             try:
                 doc_info = f"{operation.serial}-{operation.number}"
@@ -202,7 +299,7 @@ class Command(BaseCommand):
                     self.stdout.write(
                         self.style.WARNING(f'    ⏳ {doc_info} ya está siendo procesado')
                     )
-                    self.stats['skipped'] += 1
+                    self.count('skipped')
                     continue
 
                 # Verificar límite de reintentos
@@ -210,42 +307,72 @@ class Command(BaseCommand):
                     self.stdout.write(
                         self.style.ERROR(f'    ❌ {doc_info} superó el límite de reintentos ({self.max_retries})')
                     )
-                    self.stats['skipped'] += 1
+                    self.count('skipped')
+                    continue
+
+                # Con el circuito abierto no se envía (ni se consume un reintento)
+                if self.sunat_unavailable(operation, doc_info):
                     continue
 
                 if self.dry_run:
                     self.stdout.write(
                         self.style.SUCCESS(f'    ✓ [DRY RUN] {doc_info} sería procesado')
                     )
-                    self.stats['processed'] += 1
+                    self.count('processed')
+                elif self.batch_mode:
+                    # Se envía al final junto con el resto del lote
+                    self.queued_ids.add(operation.id)
+                    batch.append(operation)
                 else:
-                    # Procesar el documento
-                    success = self.send_document_to_sunat(operation)
-
-                    if success:
-                        self.stdout.write(
-                            self.style.SUCCESS(f'    ✅ {doc_info} enviado exitosamente')
-                        )
-                        self.stats['success'] += 1
-                    else:
-                        self.stdout.write(
-                            self.style.ERROR(f'    ❌ {doc_info} falló el envío')
-                        )
-                        self.stats['failed'] += 1
-
-                    self.stats['processed'] += 1
-
-                    # Pequeña pausa entre documentos
-                    time.sleep(1)
+                    # Procesar el documento (aquí o en el pool de trabajadores)
+                    self.queued_ids.add(operation.id)
+                    self.run_task('pending', self.send_pending_document, operation, doc_info)
 
             except Exception as e:
                 logger.error(f"Error procesando {operation}: {str(e)}", exc_info=True)
-                self.stats['failed'] += 1
+                self.count('failed')
                 self.stats['errors'].append({
                     'operation': str(operation),
                     'error': str(e)
                 })
 
+        self.release([operation for operation in pending_operations if operation.id not in self.queued_ids])
+
+        if batch:
+            self.run_task('pending', self.send_documents_batch, batch)
+
+    def send_pending_document(self, operation, doc_info):
+        """Enviar un documento pendiente (tarea de la fase 'pending')"""
+        try:
+            if not self.renew([operation]):
+                return
+
+            success = self.send_document_to_sunat(operation)
+
+            if success:
+                self.stdout.write(
+                    self.style.SUCCESS(f'    ✅ {doc_info} enviado exitosamente')
+                )
+                self.count('success')
+            else:
+                self.stdout.write(
+                    self.style.ERROR(f'    ❌ {doc_info} falló el envío')
+                )
+                self.count('failed')
+
+            self.count('processed')
+
+        except Exception as e:
+            logger.error(f"Error procesando {operation}: {str(e)}", exc_info=True)
+            self.count('failed')
+            self.stats['errors'].append({
+                'operation': str(operation),
+                'error': str(e)
+            })
+
+        finally:
+            self.release([operation])
+
     def retry_failed_documents(self):
         """Reintentar documentos que fallaron anteriormente"""
         from operations.models import Operation
@@ -254,19 +381,20 @@ class Command(BaseCommand):
             self.style.MIGRATE_LABEL('\n🔄 REINTENTANDO DOCUMENTOS FALLIDOS...')
         )
 
-        # Calcular tiempo mínimo desde último intento
-        retry_time = timezone.now() - timedelta(minutes=self.retry_after)
-
         # Buscar documentos para reintentar
         failed_operations = Operation.objects.filter(
+            self.retry_due(),
             billing_status__in=['ERROR', 'REJECTED'],
             retry_count__lt=self.max_retries,
             operation_type='S',
             company__is_billing=True,
-            last_retry_at__lt=retry_time
+            document__code__in=self.sendbill_document_codes()
+        ).exclude(
+            id__in=self.queued_ids  # Ya encolados como pendientes en este ciclo
         ).select_related(
             'document', 'company', 'person'
-        ).order_by('retry_count', 'created_at')[:self.batch_size]
+        ).order_by('next_attempt_at', 'id')
+        failed_operations = self.claim(failed_operations, fair=True)
 
         if not failed_operations:
             self.stdout.write('  ℹ️ No hay documentos para reintentar')
@@ -274,6 +402,8 @@ class Command(BaseCommand):
 
         self.stdout.write(f'  🔁 Reintentando: {len(failed_operations)} documentos')
 
+        batch = []
+        queued = set()
         for operation in failed_operations:
             try:
                 doc_info = f"{operation.serial}-{operation.number}"
@@ -284,42 +414,301 @@ class Command(BaseCommand):
                         f'\n  🔄 Reintentando {doc_info} {retry_info}...'
                     )
 
+                if self.sunat_unavailable(operation, doc_info):
+                    continue
+
                 if self.dry_run:
                     self.stdout.write(
                         self.style.SUCCESS(f'    ✓ [DRY RUN] {doc_info} sería reintentado')
                     )
+                elif self.batch_mode:
+                    # Se reintenta al final junto con el resto del lote
+                    if self.claim_retry(operation):
+                        queued.add(operation.id)
+                        batch.append(operation)
                 else:
-                    # Incrementar contador de reintentos
-                    operation.retry_count += 1
-                    operation.last_retry_at = timezone.now()
-                    operation.save(update_fields=['retry_count', 'last_retry_at'])
-
-                    # Reintentar envío
-                    success = self.send_document_to_sunat(operation)
-
-                    if success:
-                        self.stdout.write(
-                            self.style.SUCCESS(f'    ✅ {doc_info} enviado exitosamente {retry_info}')
-                        )
-                        self.stats['success'] += 1
-                    else:
-                        remaining = self.max_retries - operation.retry_count
-                        if remaining > 0:
-                            self.stdout.write(
-                                self.style.WARNING(f'    ⚠️ {doc_info} falló. Quedan {remaining} reintentos')
-                            )
-                        else:
-                            self.stdout.write(
-                                self.style.ERROR(f'    ❌ {doc_info} agotó todos los reintentos')
-                            )
-                        self.stats['failed'] += 1
-
-                    # Pausa entre reintentos
-                    time.sleep(2)
+                    # Reintentar envío (aquí o en el pool de trabajadores)
+                    queued.add(operation.id)
+                    self.run_task('retry', self.retry_document, operation, doc_info, retry_info)
 
             except Exception as e:
                 logger.error(f"Error reintentando {operation}: {str(e)}", exc_info=True)
-                self.stats['failed'] += 1
+                self.count('failed')
+
+        self.release([operation for operation in failed_operations if operation.id not in queued])
+
+        if batch:
+            self.run_task('retry', self.send_documents_batch, batch)
+
+    def claim_retry(self, operation):
+        """Incrementar el contador de reintentos (si nadie la tomó mientras tanto)"""
+        try:
+            transition(operation, retry_count=operation.retry_count + 1, last_retry_at=timezone.now())
+            return True
+        except StaleTransition as e:
+            logger.info(str(e))
+            self.count('skipped')
+            return False
+
+    def retry_document(self, operation, doc_info, retry_info):
+        """Reintentar el envío de un documento (tarea de la fase 'retry')"""
+        try:
+            if not self.renew([operation]) or not self.claim_retry(operation):
+                return
+
+            success = self.send_document_to_sunat(operation)
+
+            if success:
+                self.stdout.write(
+                    self.style.SUCCESS(f'    ✅ {doc_info} enviado exitosamente {retry_info}')
+                )
+                self.count('success')
+            else:
+                remaining = self.max_retries - operation.retry_count
+                if remaining > 0:
+                    self.stdout.write(
+                        self.style.WARNING(f'    ⚠️ {doc_info} falló. Quedan {remaining} reintentos')
+                    )
+                else:
+                    self.stdout.write(
+                        self.style.ERROR(f'    ❌ {doc_info} agotó todos los reintentos')
+                    )
+                self.count('failed')
+
+        except Exception as e:
+            logger.error(f"Error reintentando {operation}: {str(e)}", exc_info=True)
+            self.count('failed')
+
+        finally:
+            self.release([operation])
+
+    def retry_due(self):
+        """
+        Documentos con el próximo intento vencido (índice billing_status + next_attempt_at);
+        los anteriores a la política de reintentos usan el tiempo desde el último intento
+        """
+        return due_after(self.retry_after)
+
+    def claim(self, queryset, fair=False):
+        """
+        Reservar hasta batch_size operaciones del queryset (en simulación solo se listan).
+        Con fair=True el lote se reparte entre empresas (fair_scheduler) en lugar
+        de tomar las más antiguas de todas.
+        """
+        if not fair:
+            if self.dry_run:
+                return list(queryset[:self.batch_size])
+            return claim(queryset, self.batch_size, owner=self.owner)
+
+        if self.dry_run:
+            ids = FairScheduler(self.batch_size).select(queryset.filter(available()))
+            return in_order(queryset.filter(id__in=ids), ids)
+        return claim_fair(queryset, self.batch_size, owner=self.owner)
+
+    def renew(self, operations):
+        """
+        Renovar las reservas al empezar a procesar (el lote pudo esperar en cola
+        más que BILLING_LEASE_SECONDS). Las que tomó otro proceso se omiten.
+        """
+        if self.dry_run:
+            return operations
+        renewed = renew(operations, owner=self.owner)
+        lost = len(operations) - len(renewed)
+        if lost:
+            self.stdout.write(self.style.WARNING(f'    ⏭️ {lost} documentos con la reserva tomada por otro proceso'))
+            self.count('skipped', lost)
+        return renewed
+
+    def release(self, operations):
+        """Liberar las reservas de este demonio"""
+        if self.dry_run or not operations:
+            return
+        release(operations, owner=self.owner)
+
+    def reclaim_expired_leases(self):
+        """Operaciones en PROCESSING cuyo proceso se detuvo: vuelven a la cola como ERROR"""
+        reclaimed = reclaim_expired()
+        if reclaimed:
+            self.stdout.write(
+                self.style.WARNING(f'\n♻️ {reclaimed} documentos con reserva vencida vuelven a la cola')
+            )
+
+    def run_task(self, phase, fn, *args):
+        """Ejecutar una tarea de la fase: en el pool (--workers) o aquí mismo, respetando el ritmo de la fase"""
+        if self.pool is not None:
+            self.pool.submit(phase, fn, *args)
+            return
+        self.limiters[phase].acquire()
+        fn(*args)
+
+    def count(self, key, amount=1):
+        """Sumar a las estadísticas (los hilos de --workers las comparten)"""
+        with self.stats_lock:
+            self.stats[key] += amount
+
+    def sendbill_document_codes(self):
+        """Tipos de documento que se envían uno a uno con sendBill"""
+        if self.boleta_summary:
+            return ['01', '07', '08']  # Las boletas van en el Resumen Diario
+        return ['01', '03', '07', '08']  # Facturas, Boletas, NC, ND
+
+    def process_boleta_summaries(self):
+        """Agrupar las boletas pendientes en resúmenes diarios, enviarlos y verificar sus tickets"""
+        from operations.services.summary_service import BoletaSummaryService
+
+        self.stdout.write(
+            self.style.MIGRATE_LABEL('\n🧾 PROCESANDO RESÚMENES DIARIOS DE BOLETAS...')
+        )
+
+        # Tickets de ciclos anteriores que SUNAT aún no había procesado
+        pending_tickets = BoletaSummaryService.pending_tickets()
+        if pending_tickets:
+            self.stdout.write(f'  🎫 Verificando: {len(pending_tickets)} tickets de resumen')
+        for company, ticket in pending_tickets:
+            if self.dry_run:
+                self.stdout.write(self.style.SUCCESS(f'    ✓ [DRY RUN] Ticket {ticket} sería verificado'))
+                continue
+            self.check_summary_ticket(BoletaSummaryService(company), ticket, poll=False)
+
+        pending_boletas = BoletaSummaryService.pending_operations(max_retries=self.max_retries).count()
+        if not pending_boletas:
+            self.stdout.write('  ℹ️ No hay boletas pendientes')
+            return
+
+        self.stdout.write(f'  📦 Boletas pendientes: {pending_boletas}')
+
+        if self.dry_run:
+            self.stdout.write(
+                self.style.SUCCESS(f'    ✓ [DRY RUN] {pending_boletas} boletas serían enviadas en resúmenes diarios')
+            )
+            return
+
+        try:
+            results = BoletaSummaryService.submit_all(max_retries=self.max_retries)
+        except Exception as e:
+            logger.error(f"Error enviando resúmenes diarios: {str(e)}", exc_info=True)
+            self.stats['errors'].append({'operation': 'resumen diario', 'error': str(e)})
+            return
+
+        for summary in results['success']:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"    📨 {summary['summary']} enviado con {summary['count']} boletas (ticket {summary['ticket']})"
+                )
+            )
+            self.count('summaries')
+            self.count('processed', summary['count'] + len(summary['failed']))
+            self.count('failed', len(summary['failed']))
+
+        for failed in results['failed']:
+            self.stdout.write(
+                self.style.ERROR(
+                    f"    ❌ Resumen del {failed['reference_date']} ({failed['count']} boletas): {failed['error'][:100]}"
+                )
+            )
+            self.count('processed', failed['count'])
+            self.count('failed', failed['count'])
+
+        # Consultar los tickets nuevos (SUNAT suele procesarlos en segundos)
+        for summary in results['success']:
+            service = BoletaSummaryService(summary['company'])
+            status = self.check_summary_ticket(service, summary['ticket'], poll=True)
+            if status in ('ACCEPTED', 'ACCEPTED_WITH_OBSERVATIONS'):
+                self.count('success', summary['count'])
+            elif status is not None:
+                self.count('failed', summary['count'])
+
+    def check_summary_ticket(self, service, ticket, poll=False):
+        """Consultar el ticket de un resumen y mostrar el estado aplicado a sus boletas"""
+        try:
+            status = service.poll_ticket(ticket) if poll else service.check_ticket(ticket)
+        except Exception as e:
+            logger.error(f"Error verificando ticket de resumen {ticket}: {str(e)}")
+            self.stdout.write(self.style.WARNING(f'    ⚠️ Ticket {ticket}: {str(e)[:100]}'))
+            return None
+
+        if status is None:
+            self.stdout.write(self.style.WARNING(f'    ⏳ Ticket {ticket} aún pendiente'))
+        elif status in ('ACCEPTED', 'ACCEPTED_WITH_OBSERVATIONS'):
+            self.stdout.write(self.style.SUCCESS(f'    ✅ Ticket {ticket}: boletas {status}'))
+        else:
+            self.stdout.write(self.style.ERROR(f'    ❌ Ticket {ticket}: boletas {status}'))
+        return status
+
+    def reconcile_error_documents(self):
+        """
+        Consultar con getStatusCdr los documentos con error: si SUNAT ya los
+        registró (p. ej. timeout después de recibirlos) se guarda su CDR y no
+        se vuelven a generar, firmar ni enviar.
+        """
+        from operations.models import Operation
+
+        self.stdout.write(
+            self.style.MIGRATE_LABEL('\n🔎 CONCILIANDO DOCUMENTOS CON ERROR...')
+        )
+
+        # getStatusCdr solo responde por facturas y sus notas. Solo se consultan los que
+        # este ciclo reintentaría: si SUNAT no los tiene, el reintento actualiza
+        # next_attempt_at y no se vuelven a consultar hasta el siguiente intento
+        claimed = self.claim(
+            Operation.objects.filter(
+                self.retry_due(),
+                billing_status='ERROR',
+                retry_count__lt=self.max_retries,
+                operation_type='S',
+                company__is_billing=True,
+                document__code__in=['01', '07', '08']
+            ).select_related(
+                'document', 'company'
+            ).order_by('next_attempt_at', 'id')
+        )
+        try:
+            error_operations = [
+                operation for operation in claimed
+                if not self.sunat_unavailable(operation, f"{operation.serial}-{operation.number}")
+            ]
+            self.send_status_cdr_requests(error_operations)
+        finally:
+            self.release(claimed)
+
+    def send_status_cdr_requests(self, error_operations):
+        """Consultar getStatusCdr en paralelo y guardar los CDR encontrados"""
+        from operations.services.billing_service import SunatConnector
+        from operations.services.sunat_dispatcher import SunatDispatcher
+
+        if not error_operations:
+            self.stdout.write('  ℹ️ No hay documentos para conciliar')
+            return
+
+        self.stdout.write(f'  🔎 Consultando: {len(error_operations)} documentos')
+
+        if self.dry_run:
+            self.stdout.write(
+                self.style.SUCCESS(f'    ✓ [DRY RUN] {len(error_operations)} documentos serían consultados')
+            )
+            return
+
+        connectors = [SunatConnector(operation.company) for operation in error_operations]
+        requests = [
+            connector.status_cdr_request(operation, key=operation.id)
+            for connector, operation in zip(connectors, error_operations)
+        ]
+        results = SunatDispatcher(self.concurrency or None, self.per_company or None).dispatch(requests)
+
+        for connector, operation, result in zip(connectors, error_operations, results):
+            doc_info = f"{operation.serial}-{operation.number}"
+            try:
+                if connector.handle_status_cdr_result(result, operation):
+                    self.stdout.write(
+                        self.style.SUCCESS(f'    ✅ {doc_info} ya registrado en SUNAT: {operation.billing_status}')
+                    )
+                    self.count('reconciled')
+                elif self.verbose:
+                    self.stdout.write(f'    ↩️ {doc_info} no existe en SUNAT, se reenviará')
+            except Exception as e:
+                logger.error(f"Error conciliando {operation}: {str(e)}")
+                if self.verbose:
+                    self.stdout.write(self.style.WARNING(f'    ⚠️ {doc_info}: {str(e)[:100]}'))
 
     def process_pending_cancellations(self):
         """Procesar anulaciones pendientes"""
@@ -331,15 +720,14 @@ class Command(BaseCommand):
 
         # Buscar anulaciones pendientes o con error
         pending_cancellations = Operation.objects.filter(
-            Q(billing_status='PROCESSING_CANCELLATION') |
-            Q(billing_status='CANCELLATION_ERROR') |
-            Q(billing_status='CANCELLATION_PENDING'),
+            billing_status__in=CANCELLATION_STATUSES,
             company__is_billing=True
         ).exclude(
             cancellation_date__isnull=True
         ).select_related(
             'document', 'company', 'person'
-        ).order_by('cancellation_date')[:self.batch_size]
+        ).order_by('cancellation_date')
+        pending_cancellations = self.claim(pending_cancellations)
 
         if not pending_cancellations:
             self.stdout.write('  ℹ️ No hay anulaciones pendientes')
@@ -360,28 +748,43 @@ class Command(BaseCommand):
                     self.stdout.write(
                         self.style.SUCCESS(f'    ✓ [DRY RUN] {doc_info} sería anulado')
                     )
-                    self.stats['cancellations'] += 1
+                    self.count('cancellations')
                 else:
-                    # Procesar anulación
-                    success = self.process_cancellation(operation)
-
-                    if success:
-                        self.stdout.write(
-                            self.style.SUCCESS(f'    ✅ {doc_info} anulado exitosamente')
-                        )
-                        self.stats['cancellations'] += 1
-                    else:
-                        self.stdout.write(
-                            self.style.ERROR(f'    ❌ {doc_info} falló la anulación')
-                        )
-                        self.stats['failed'] += 1
-
-                    # Pausa entre anulaciones
-                    time.sleep(2)
+                    # Procesar anulación (aquí o en el pool de trabajadores)
+                    self.queued_ids.add(operation.id)
+                    self.run_task('cancellation', self.cancel_document, operation, doc_info)
 
             except Exception as e:
                 logger.error(f"Error anulando {operation}: {str(e)}", exc_info=True)
-                self.stats['failed'] += 1
+                self.count('failed')
+
+        self.release([operation for operation in pending_cancellations if operation.id not in self.queued_ids])
+
+    def cancel_document(self, operation, doc_info):
+        """Anular un documento (tarea de la fase 'cancellation')"""
+        try:
+            if not self.renew([operation]):
+                return
+
+            success = self.process_cancellation(operation)
+
+            if success:
+                self.stdout.write(
+                    self.style.SUCCESS(f'    ✅ {doc_info} anulado exitosamente')
+                )
+                self.count('cancellations')
+            else:
+                self.stdout.write(
+                    self.style.ERROR(f'    ❌ {doc_info} falló la anulación')
+                )
+                self.count('failed')
+
+        except Exception as e:
+            logger.error(f"Error anulando {operation}: {str(e)}", exc_info=True)
+            self.count('failed')
+
+        finally:
+            self.release([operation])
 
     def check_cancellation_tickets(self):
         """Verificar estado de tickets de anulación pendientes"""
@@ -397,6 +800,8 @@ class Command(BaseCommand):
             cancellation_ticket__isnull=False
         ).exclude(
             cancellation_ticket=''
+        ).exclude(
+            id__in=self.queued_ids  # Su anulación ya consulta el ticket en este ciclo
         ).select_related('company')[:self.batch_size]
 
         if not pending_tickets:
@@ -420,46 +825,70 @@ class Command(BaseCommand):
                         self.style.SUCCESS(f'    ✓ [DRY RUN] Ticket {ticket} sería verificado')
                     )
                 else:
-                    # Verificar estado del ticket
-                    from operations.services.cancellation_service import CancellationService
+                    # Verificar estado del ticket (aquí o en el pool de trabajadores)
+                    self.run_task('ticket', self.check_cancellation_ticket, operation, ticket)
 
-                    service = CancellationService(operation)
-                    success = service._check_ticket_status(ticket)
+            except Exception as e:
+                logger.error(f"Error verificando ticket {operation.cancellation_ticket}: {str(e)}")
 
-                    if success:
-                        self.stdout.write(
-                            self.style.SUCCESS(f'    ✅ Ticket {ticket} procesado')
-                        )
-                    else:
-                        self.stdout.write(
-                            self.style.WARNING(f'    ⏳ Ticket {ticket} aún pendiente')
-                        )
+    def check_cancellation_ticket(self, operation, ticket):
+        """Consultar el ticket de una anulación (tarea de la fase 'ticket')"""
+        try:
+            from operations.services.cancellation_service import CancellationService
 
-                    time.sleep(1)
+            service = CancellationService(operation)
+            success = service._check_ticket_status(ticket)
 
-            except Exception as e:
-                logger.error(f"Error verificando ticket {operation.cancellation_ticket}: {str(e)}")
+            if success:
+                self.stdout.write(
+                    self.style.SUCCESS(f'    ✅ Ticket {ticket} procesado')
+                )
+            else:
+                self.stdout.write(
+                    self.style.WARNING(f'    ⏳ Ticket {ticket} aún pendiente')
+                )
+
+        except Exception as e:
+            logger.error(f"Error verificando ticket {ticket}: {str(e)}")
+
+    def sunat_unavailable(self, operation, doc_info):
+        """Verificar el circuito SUNAT del ambiente de la empresa"""
+        from operations.services.sunat_circuit import CircuitBreaker
+
+        breaker = CircuitBreaker(operation.company.environment)
+        if not breaker.is_open():
+            return False
+
+        self.stdout.write(
+            self.style.WARNING(
+                f'    ⛔ {doc_info} en espera: SUNAT {operation.company.environment} no disponible '
+                f'(circuito abierto, {breaker.retry_after():.0f}s)'
+            )
+        )
+        self.count('skipped')
+        return True
 
     def send_document_to_sunat(self, operation):
         """Enviar documento a SUNAT usando el servicio de facturación"""
         try:
-            # Verificar si ya tiene XML generado
+            # Sin XML generado y firmado no hay punto de control desde donde retomar
             regenerate = False
             if not operation.xml_file_path or not operation.signed_xml_file_path:
                 regenerate = True
                 if self.verbose:
                     self.stdout.write('      📝 Generando XML...')
+            elif self.verbose:
+                self.stdout.write('      ♻️ Retomando desde el XML firmado si sigue vigente...')
 
             # Usar el servicio de facturación existente
             from operations.services.billing_service import BillingService
 
-            # Actualizar estado
-            operation.billing_status = 'PROCESSING'
-            operation.save(update_fields=['billing_status'])
+            # Actualizar estado (falla si otro proceso ya la tomó)
+            transition(operation, 'PROCESSING')
 
             # Procesar facturación
-            billing_service = BillingService(operation.id)
-            success = billing_service.process_electronic_billing()
+            billing_service = BillingService(operation.id, operation=operation)
+            success = billing_service.process_electronic_billing(regenerate=regenerate)
 
             if success:
                 logger.info(f"✅ Documento {operation} enviado exitosamente")
@@ -468,16 +897,63 @@ class Command(BaseCommand):
                 logger.error(f"❌ Fallo envío de {operation}")
                 return False
 
+        except StaleTransition as e:
+            logger.info(str(e))
+            if self.verbose:
+                self.stdout.write('      ⏭️ Ya fue tomado por otro proceso')
+            return False
+
         except Exception as e:
             logger.error(f"Error enviando {operation}: {str(e)}", exc_info=True)
 
             # Actualizar estado de error
-            operation.billing_status = 'ERROR'
-            operation.sunat_error_description = str(e)[:500]
-            operation.save(update_fields=['billing_status', 'sunat_error_description'])
+            try:
+                transition(operation, 'ERROR', sunat_error_description=str(e)[:500])
+            except StaleTransition as stale:
+                logger.info(str(stale))
 
             return False
 
+    def send_documents_batch(self, operations):
+        """Generar y firmar el lote en paralelo y enviarlo a SUNAT con envíos simultáneos"""
+        from operations.services.billing_service import BillingService
+        from operations.services.sunat_dispatcher import SunatDispatcher
+
+        # El lote pudo esperar en cola más que la reserva
+        renewed = self.renew(operations)
+        if not renewed:
+            return
+        operations = renewed
+
+        dispatcher = SunatDispatcher(self.concurrency or None, self.per_company or None)
+        self.stdout.write(
+            f'  ✍️ Procesando {len(operations)} documentos '
+            f'({dispatcher.max_concurrency} envíos simultáneos, {dispatcher.per_company} por RUC)...'
+        )
+
+        try:
+            results = BillingService.process_batch([operation.id for operation in operations], dispatcher=dispatcher)
+        except Exception as e:
+            logger.error(f"Error procesando lote: {str(e)}", exc_info=True)
+            self.count('failed', len(operations))
+            self.stats['errors'].append({'operation': 'lote', 'error': str(e)})
+            return
+        finally:
+            self.release(operations)
+
+        for item in results['success']:
+            self.stdout.write(
+                self.style.SUCCESS(f"    ✅ {item['document']} enviado exitosamente")
+            )
+        for item in results['failed']:
+            self.stdout.write(
+                self.style.ERROR(f"    ❌ {item['document']} falló el envío")
+            )
+
+        self.count('success', len(results['success']))
+        self.count('failed', len(results['failed']))
+        self.count('processed', len(operations))
+
     def process_cancellation(self, operation):
         """Procesar anulación de documento"""
         try:
@@ -508,10 +984,14 @@ class Command(BaseCommand):
         except Exception as e:
             logger.error(f"Error anulando {operation}: {str(e)}", exc_info=True)
 
-            # Actualizar estado de error
-            operation.billing_status = 'CANCELLATION_ERROR'
-            operation.sunat_error_description = str(e)[:500]
-            operation.save(update_fields=['billing_status', 'sunat_error_description'])
+            # Actualizar estado de error (si la anulación no terminó mientras tanto)
+            try:
+                transition(
+                    operation, 'CANCELLATION_ERROR', expected=CANCELLATION_STATUSES,
+                    sunat_error_description=str(e)[:500]
+                )
+            except StaleTransition as stale:
+                logger.info(str(stale))
 
             return False
 
@@ -525,16 +1005,12 @@ class Command(BaseCommand):
             )
 
         # Marcar como finalizados los documentos que superaron reintentos
-        exceeded = Operation.objects.filter(
-            billing_status='ERROR',
-            retry_count__gte=F('max_retries')
-        ).update(
-            billing_status='ERROR_FINAL',
-            updated_at=timezone.now()
+        exceeded = transition_many(
+            Operation.objects.filter(retry_count__gte=F('max_retries')), 'ERROR_FINAL', expected='ERROR'
         )
 
-        if exceeded > 0 and self.verbose:
-            self.stdout.write(f'  🔚 Marcados como error final: {exceeded} documentos')
+        if exceeded and self.verbose:
+            self.stdout.write(f'  🔚 Marcados como error final: {len(exceeded)} documentos')
 
     def reset_cycle_stats(self):
         """Resetear estadísticas del ciclo actual"""
@@ -544,6 +1020,8 @@ class Command(BaseCommand):
             'failed': 0,
             'skipped': 0,
             'cancellations': 0,
+            'reconciled': 0,
+            'summaries': 0,
             'errors': []
         }
 
@@ -563,6 +1041,15 @@ class Command(BaseCommand):
             f"🔄 Máximo reintentos: {self.max_retries}",
             f"⏳ Reintentar después de: {self.retry_after} minutos",
             f"🔧 Modo: {'SIMULACIÓN' if self.dry_run else 'PRODUCCIÓN'}",
+            f"✍️ Firma en paralelo: {'SÍ' if self.parallel_signing else 'NO'}",
+            f"🔎 Conciliación de errores: {'SÍ' if self.reconcile else 'NO'}",
+            f"📡 Envíos simultáneos: {self.concurrency if self.concurrency > 0 else ('AUTO' if self.batch_mode else 1)}",
+            f"👷 Trabajadores: {f'{self.workers} (una cola por fase)' if self.workers > 0 else 'SECUENCIAL'}",
+            f"🚦 Ritmo por fase: {f'{self.rate:g}/s' if self.rate else 'POR DEFECTO'}",
+            f"🔐 Reserva de documentos: {lease_seconds()} segundos ({self.owner})",
+            f"⚖️ Reparto por empresa: {f'máx. {in_flight_cap()} en curso por empresa' if in_flight_cap() else 'SIN TOPE'}",
+            f"🔔 Avisos de trabajo nuevo: {'SÍ' if wakeup_enabled() else 'NO'}",
+            f"🧾 Boletas por resumen diario: {'SÍ' if self.boleta_summary else 'NO'}",
             f"🔁 Ejecución: {'ÚNICA' if self.once else 'CONTINUA'}",
             f"📊 Verbosidad: {'ALTA' if self.verbose else 'NORMAL'}"
         ]
@@ -585,6 +1072,8 @@ class Command(BaseCommand):
             f"  ❌ Fallidos: {self.stats['failed']}",
             f"  ⏭️ Omitidos: {self.stats['skipped']}",
             f"  🚫 Anulaciones: {self.stats['cancellations']}",
+            f"  🔎 Conciliados: {self.stats['reconciled']}",
+            f"  🧾 Resúmenes diarios: {self.stats['summaries']}",
         ]
 
         for line in summary:
@@ -617,6 +1106,7 @@ class Command(BaseCommand):
             f"❌ Fallidos: {self.stats['failed']}",
             f"⏭️ Omitidos: {self.stats['skipped']}",
             f"🚫 Anulaciones: {self.stats['cancellations']}",
+            f"🧾 Resúmenes diarios: {self.stats['summaries']}",
             f"⚠️ Total errores: {len(self.stats['errors'])}"
         ]
 
@@ -627,33 +1117,39 @@ class Command(BaseCommand):
         self.stdout.write(f"{'=' * 80}\n")
 
     def wait_next_cycle(self):
-        """Esperar hasta el siguiente ciclo mostrando cuenta regresiva"""
+        """Esperar el siguiente ciclo: hasta --interval o hasta un aviso de trabajo nuevo"""
+        from operations.services.billing_wakeup import wait as wait_for_wakeup
+
         next_run = timezone.now() + timedelta(seconds=self.interval)
 
         self.stdout.write(
             self.style.WARNING(
-                f"\n⏳ Próxima ejecución: {next_run.strftime('%Y-%m-%d %H:%M:%S')}"
+                f"\n⏳ Próxima ejecución: {next_run.strftime('%Y-%m-%d %H:%M:%S')} (o antes si llega un aviso)"
             )
         )
 
-        # Mostrar cuenta regresiva si verbose está activo
-        if self.verbose:
-            for remaining in range(self.interval, 0, -60):  # Actualizar cada minuto
-                if not self.running:
-                    break
+        # Se espera por tramos de hasta un minuto para atender las señales de parada
+        deadline = time.monotonic() + self.interval
+        while self.running:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
 
-                if remaining >= 60:
-                    mins = remaining // 60
-                    self.stdout.write(
-                        f"\r  ⏰ Esperando: {mins} minutos restantes...",
-                        ending=''
-                    )
-                    self.stdout.flush()
+            # Mostrar cuenta regresiva si verbose está activo
+            if self.verbose and remaining >= 60:
+                self.stdout.write(
+                    f"\r  ⏰ Esperando: {int(remaining // 60)} minutos restantes...",
+                    ending=''
+                )
+                self.stdout.flush()
 
-                time.sleep(min(60, remaining))
-        else:
-            # Espera simple sin cuenta regresiva
-            time.sleep(self.interval)
+            events = wait_for_wakeup(min(60, remaining))
+            if events:
+                reasons = ', '.join(sorted({str(event.get('reason')) for event in events}))
+                self.stdout.write(
+                    self.style.SUCCESS(f"\n🔔 {len(events)} avisos de trabajo nuevo ({reasons}): iniciando ciclo")
+                )
+                return
 
     def signal_handler(self, signum, frame):
         """Manejador de señales para detener el demonio elegantemente"""
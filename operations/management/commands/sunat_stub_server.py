@@ -0,0 +1,480 @@
+# operations/management/commands/sunat_stub_server.py
+"""
+Management Command con un servidor local que imita billService de SUNAT.
+
+Implementa sendBill, sendSummary, getStatus y getStatusCdr con sobres SOAP
+y CDR (ZIP con ApplicationResponse) con la forma de los de SUNAT, para
+medir el demonio y las tareas de Celery sin depender de SUNAT beta.
+
+Uso:
+    python manage.py sunat_stub_server --port 8085 --latency lognormal:150,0.4 --fault-rate 0.02
+
+y en la aplicación (demonio, worker de Celery):
+    SUNAT_SERVICE_URL=http://127.0.0.1:8085/billService
+"""
+
+import base64
+import io
+import logging
+import math
+import random
+import signal
+import threading
+import time
+import zipfile
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+from django.core.management.base import BaseCommand, CommandError
+from lxml import etree
+
+logger = logging.getLogger('operations.billing_daemon')
+
+SUNAT_RUC = '20131312955'
+
+# Fallas de servicio que SUNAT devuelve como SOAP Fault
+SERVICE_FAULTS = [
+    ('0109', 'El sistema no puede responder su solicitud. (El servicio de autenticación no está disponible)'),
+    ('0130', 'El sistema no puede responder su solicitud. (No se pudo obtener el ticket de proceso)'),
+    ('0200', 'No se pudo procesar su solicitud. (Ocurrio un error en el batch)'),
+]
+
+# Rechazos (CDR con código 2000-3999)
+REJECTIONS = [
+    ('2017', 'El numero de documento de identidad del receptor debe ser RUC'),
+    ('2800', 'El dato ingresado en el tipo de documento de identidad del receptor no esta permitido.'),
+    ('3105', 'El XML no contiene el tag o no existe información del código de local anexo del emisor'),
+]
+
+# Observaciones (cbc:Note en un CDR aceptado)
+OBSERVATIONS = [
+    '4252 - El dato ingresado como atributo @listName es incorrecto.',
+    '4287 - El precio unitario de la operación que está informando difiere de los datos consignados.',
+]
+
+DUPLICATE_FAULT = ('1033', 'El comprobante fue registrado previamente con otros datos')
+
+WSDL = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<wsdl:definitions xmlns:wsdl="http://schemas.xmlsoap.org/wsdl/" '
+    'targetNamespace="http://service.sunat.gob.pe" name="billService"/>'
+).encode('utf-8')
+
+
+def parse_latency(spec):
+    """
+    Distribución de latencia en milisegundos.
+
+    Formatos: fixed:MS, uniform:MIN,MAX, normal:MEDIA,DESV, lognormal:MEDIANA,SIGMA,
+    exponential:MEDIA
+    """
+    kind, _, args = spec.partition(':')
+    try:
+        values = [float(value) for value in args.split(',')] if args else []
+    except ValueError:
+        raise CommandError(f'Latencia inválida: {spec}')
+
+    if kind == 'fixed' and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == 'uniform' and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == 'normal' and len(values) == 2:
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == 'lognormal' and len(values) == 2:
+        return lambda rng: rng.lognormvariate(math.log(max(values[0], 1.0)), values[1])
+    if kind == 'exponential' and len(values) == 1:
+        return lambda rng: rng.expovariate(1.0 / max(values[0], 1.0))
+    raise CommandError(f'Latencia inválida: {spec}')
+
+
+def build_cdr(ruc, reference_id, xml_filename, code, description, notes=()):
+    """CDR de SUNAT: ZIP con el ApplicationResponse R-<archivo>.xml"""
+    now = datetime.now()
+    notes_xml = ''.join(f'<cbc:Note>{escape(note)}</cbc:Note>' for note in notes)
+    application_response = (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<ar:ApplicationResponse '
+        'xmlns:ar="urn:oasis:names:specification:ubl:schema:xsd:ApplicationResponse-2" '
+        'xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2" '
+        'xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2" '
+        'xmlns:ext="urn:oasis:names:specification:ubl:schema:xsd:CommonExtensionComponents-2">'
+        '<ext:UBLExtensions><ext:UBLExtension><ext:ExtensionContent/></ext:UBLExtension></ext:UBLExtensions>'
+        '<cbc:UBLVersionID>2.0</cbc:UBLVersionID>'
+        '<cbc:CustomizationID>1.0</cbc:CustomizationID>'
+        f'<cbc:ID>{int(time.time() * 1000)}</cbc:ID>'
+        f'<cbc:IssueDate>{now:%Y-%m-%d}</cbc:IssueDate>'
+        f'<cbc:IssueTime>{now:%H:%M:%S}</cbc:IssueTime>'
+        f'<cbc:ResponseDate>{now:%Y-%m-%d}</cbc:ResponseDate>'
+        f'<cbc:ResponseTime>{now:%H:%M:%S}</cbc:ResponseTime>'
+        f'{notes_xml}'
+        f'<cac:SenderParty><cac:PartyIdentification><cbc:ID>{SUNAT_RUC}</cbc:ID>'
+        '</cac:PartyIdentification></cac:SenderParty>'
+        f'<cac:ReceiverParty><cac:PartyIdentification><cbc:ID>{escape(ruc)}</cbc:ID>'
+        '</cac:PartyIdentification></cac:ReceiverParty>'
+        '<cac:DocumentResponse><cac:Response>'
+        f'<cbc:ReferenceID>{escape(reference_id)}</cbc:ReferenceID>'
+        f'<cbc:ResponseCode>{code}</cbc:ResponseCode>'
+        f'<cbc:Description>{escape(description)}</cbc:Description>'
+        '</cac:Response>'
+        f'<cac:DocumentReference><cbc:ID>{escape(reference_id)}</cbc:ID></cac:DocumentReference>'
+        '</cac:DocumentResponse>'
+        '</ar:ApplicationResponse>'
+    ).encode('utf-8')
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        zipf.writestr(f'R-{xml_filename}', application_response)
+    return buffer.getvalue()
+
+
+def soap_envelope(body):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<soap-env:Envelope xmlns:soap-env="http://schemas.xmlsoap.org/soap/envelope/">'
+        f'<soap-env:Header/><soap-env:Body>{body}</soap-env:Body></soap-env:Envelope>'
+    ).encode('utf-8')
+
+
+def soap_fault(code, message):
+    return soap_envelope(
+        '<soap-env:Fault>'
+        f'<faultcode>soap-env:Client.{code}</faultcode>'
+        f'<faultstring>{escape(message)}</faultstring>'
+        '</soap-env:Fault>'
+    )
+
+
+class StubState:
+    """Documentos recibidos, tickets y contadores del servidor"""
+
+    def __init__(self, options):
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.latency = parse_latency(options['latency'])
+        self.lock = threading.Lock()
+        # nombre (RUC-TIPO-SERIE-NUMERO) -> CDR del comprobante aceptado o rechazado
+        self.documents = {}
+        # ticket -> (listo_en, código de estado, CDR)
+        self.tickets = {}
+        self.ticket_sequence = int(time.time() * 1000)
+        self.stats = {'requests': 0, 'sendBill': 0, 'sendSummary': 0, 'getStatus': 0,
+                      'getStatusCdr': 0, 'faults': 0, 'errors': 0, 'hangs': 0, 'duplicates': 0}
+
+    def chance(self, rate):
+        return rate > 0 and self.rng.random() < rate
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def new_ticket(self):
+        with self.lock:
+            self.ticket_sequence += 1
+            return str(self.ticket_sequence)
+
+
+class SunatStubHandler(BaseHTTPRequestHandler):
+    """Manejador HTTP del servidor de pruebas (un hilo por conexión)"""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'SunatStub/1.0'
+    state = None
+    verbose = False
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            logger.info(f"[sunat_stub] {self.address_string()} {format % args}")
+
+    def _reply(self, status, body, content_type='text/xml; charset=utf-8'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        # health_check_sunat consulta ?wsdl
+        self._reply(200, WSDL)
+
+    def do_POST(self):
+        state = self.state
+        options = state.options
+        state.count('requests')
+
+        payload = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+        time.sleep(state.latency(state.rng) / 1000.0)
+
+        if state.chance(options['hang_rate']):
+            # Simular que SUNAT no responde dentro del timeout del cliente
+            state.count('hangs')
+            time.sleep(options['hang_seconds'])
+        if state.chance(options['error_rate']):
+            state.count('errors')
+            return self._reply(503, b'Service Unavailable', 'text/plain')
+        if state.chance(options['fault_rate']):
+            state.count('faults')
+            return self._reply(500, soap_fault(*state.rng.choice(SERVICE_FAULTS)))
+
+        try:
+            root = etree.fromstring(payload)
+            body = root.find('{http://schemas.xmlsoap.org/soap/envelope/}Body')
+            call = body[0]
+        except (etree.XMLSyntaxError, TypeError, IndexError):
+            return self._reply(500, soap_fault('0155', 'El archivo ZIP esta vacio'))
+
+        operation = etree.QName(call).localname
+        fields = {etree.QName(child).localname: (child.text or '').strip() for child in call}
+        if not root.findtext('.//{*}Username'):
+            return self._reply(500, soap_fault('0102', 'Usuario o contraseña incorrectos'))
+
+        handler = getattr(self, f'_{operation}', None)
+        if handler is None:
+            return self._reply(500, soap_fault('0100', f'Operación no soportada: {operation}'))
+
+        state.count(operation)
+        status, response = handler(fields)
+        self._reply(status, response)
+
+    def _document(self, filename, content):
+        """Validar el ZIP recibido y devolver (RUC, nombre del XML)"""
+        if not filename or not content:
+            return None, None
+        try:
+            with zipfile.ZipFile(io.BytesIO(base64.b64decode(content))) as zipf:
+                names = zipf.namelist()
+        except (ValueError, zipfile.BadZipFile):
+            return None, None
+        if not names:
+            return None, None
+        return filename.split('-')[0], names[0]
+
+    def _sendBill(self, fields):
+        state = self.state
+        ruc, xml_filename = self._document(fields.get('fileName'), fields.get('contentFile'))
+        if xml_filename is None:
+            return 500, soap_fault('0155', 'El archivo ZIP esta vacio')
+
+        document_name = xml_filename[:-4]
+        with state.lock:
+            duplicate = document_name in state.documents
+        if duplicate:
+            state.count('duplicates')
+            return 500, soap_fault(*DUPLICATE_FAULT)
+
+        # RUC-TIPO-SERIE-NUMERO -> SERIE-NUMERO
+        reference_id = '-'.join(document_name.split('-')[2:])
+        if state.chance(state.options['reject_rate']):
+            code, description = state.rng.choice(REJECTIONS)
+            cdr = build_cdr(ruc, reference_id, xml_filename, code, description)
+        else:
+            notes = [state.rng.choice(OBSERVATIONS)] if state.chance(state.options['observe_rate']) else []
+            cdr = build_cdr(ruc, reference_id, xml_filename, '0',
+                            f'El comprobante numero {reference_id}, ha sido aceptado', notes)
+
+        with state.lock:
+            state.documents[document_name] = cdr
+
+        return 200, soap_envelope(
+            '<br:sendBillResponse xmlns:br="http://service.sunat.gob.pe">'
+            f'<applicationResponse>{base64.b64encode(cdr).decode()}</applicationResponse>'
+            '</br:sendBillResponse>'
+        )
+
+    def _sendSummary(self, fields):
+        state = self.state
+        ruc, xml_filename = self._document(fields.get('fileName'), fields.get('contentFile'))
+        if xml_filename is None:
+            return 500, soap_fault('0155', 'El archivo ZIP esta vacio')
+
+        # RUC-RC-YYYYMMDD-N / RUC-RA-YYYYMMDD-N -> RC-YYYYMMDD-N
+        reference_id = '-'.join(xml_filename[:-4].split('-')[1:])
+        if state.chance(state.options['reject_rate']):
+            code, description = state.rng.choice(REJECTIONS)
+            status_code = '99'
+        else:
+            code, description = '0', f'El Resumen diario {reference_id}, ha sido aceptado'
+            status_code = '0'
+
+        ticket = state.new_ticket()
+        cdr = build_cdr(ruc, reference_id, xml_filename, code, description)
+        with state.lock:
+            state.tickets[ticket] = (time.monotonic() + state.options['ticket_delay'], status_code, cdr)
+
+        return 200, soap_envelope(
+            '<br:sendSummaryResponse xmlns:br="http://service.sunat.gob.pe">'
+            f'<ticket>{ticket}</ticket>'
+            '</br:sendSummaryResponse>'
+        )
+
+    def _getStatus(self, fields):
+        state = self.state
+        with state.lock:
+            entry = state.tickets.get(fields.get('ticket'))
+        if entry is None:
+            return 500, soap_fault('0127', 'El ticket no le pertenece al usuario')
+
+        ready_at, status_code, cdr = entry
+        if time.monotonic() < ready_at:
+            # Ticket en proceso
+            status = '<statusCode>98</statusCode>'
+        else:
+            status = f'<statusCode>{status_code}</statusCode><content>{base64.b64encode(cdr).decode()}</content>'
+
+        return 200, soap_envelope(
+            '<br:getStatusResponse xmlns:br="http://service.sunat.gob.pe">'
+            f'<status>{status}</status>'
+            '</br:getStatusResponse>'
+        )
+
+    def _getStatusCdr(self, fields):
+        state = self.state
+        number = fields.get('numeroComprobante', '')
+        document_name = '-'.join([
+            fields.get('rucComprobante', ''),
+            fields.get('tipoComprobante', ''),
+            fields.get('serieComprobante', ''),
+            number,
+        ])
+        with state.lock:
+            cdr = state.documents.get(document_name)
+
+        if cdr is None:
+            status = '<statusCode>0011</statusCode><statusMessage>El comprobante de pago electrónico no existe</statusMessage>'
+        else:
+            status = (
+                f'<content>{base64.b64encode(cdr).decode()}</content>'
+                '<statusCode>0004</statusCode><statusMessage>La constancia existe</statusMessage>'
+            )
+
+        return 200, soap_envelope(
+            '<br:getStatusCdrResponse xmlns:br="http://service.sunat.gob.pe">'
+            f'<statusCdr>{status}</statusCdr>'
+            '</br:getStatusCdrResponse>'
+        )
+
+
+class StubHTTPServer(ThreadingHTTPServer):
+    # Cola amplia para pruebas con miles de documentos por minuto
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+class Command(BaseCommand):
+    help = 'Servidor local que imita billService de SUNAT para pruebas de carga'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--host',
+            default='127.0.0.1',
+            help='Dirección de escucha (default: 127.0.0.1)'
+        )
+        parser.add_argument(
+            '--port',
+            type=int,
+            default=8085,
+            help='Puerto de escucha (default: 8085)'
+        )
+        parser.add_argument(
+            '--latency',
+            default='fixed:100',
+            help='Latencia en ms: fixed:MS, uniform:MIN,MAX, normal:MEDIA,DESV, '
+                 'lognormal:MEDIANA,SIGMA o exponential:MEDIA (default: fixed:100)'
+        )
+        parser.add_argument(
+            '--fault-rate',
+            type=float,
+            default=0.0,
+            help='Proporción de respuestas SOAP Fault de servicio (default: 0)'
+        )
+        parser.add_argument(
+            '--error-rate',
+            type=float,
+            default=0.0,
+            help='Proporción de respuestas HTTP 503 (default: 0)'
+        )
+        parser.add_argument(
+            '--hang-rate',
+            type=float,
+            default=0.0,
+            help='Proporción de llamadas que tardan --hang-seconds (default: 0)'
+        )
+        parser.add_argument(
+            '--hang-seconds',
+            type=float,
+            default=65.0,
+            help='Demora de las llamadas colgadas, mayor al timeout del cliente (default: 65)'
+        )
+        parser.add_argument(
+            '--reject-rate',
+            type=float,
+            default=0.0,
+            help='Proporción de comprobantes rechazados con CDR 2xxx/3xxx (default: 0)'
+        )
+        parser.add_argument(
+            '--observe-rate',
+            type=float,
+            default=0.0,
+            help='Proporción de comprobantes aceptados con observaciones (default: 0)'
+        )
+        parser.add_argument(
+            '--ticket-delay',
+            type=float,
+            default=5.0,
+            help='Segundos hasta que un ticket de sendSummary deja de estar en proceso (default: 5)'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            help='Semilla para reproducir la secuencia de latencias y fallas'
+        )
+        parser.add_argument(
+            '--verbose',
+            action='store_true',
+            help='Registrar cada solicitud'
+        )
+
+    def handle(self, *args, **options):
+        state = StubState(options)
+        handler = type('Handler', (SunatStubHandler,), {'state': state, 'verbose': options['verbose']})
+
+        server = StubHTTPServer((options['host'], options['port']), handler)
+
+        url = f"http://{options['host']}:{server.server_address[1]}/billService"
+        self.stdout.write(self.style.SUCCESS(
+            f"\n{'=' * 80}\n"
+            f"🧪 SERVIDOR DE PRUEBAS SUNAT (billService)\n"
+            f"{'=' * 80}"
+        ))
+        for line in [
+            f"🌐 URL: {url}",
+            f"⏱️ Latencia: {options['latency']}",
+            f"💥 SOAP Fault: {options['fault_rate']:.1%}  HTTP 503: {options['error_rate']:.1%}  "
+            f"Colgadas: {options['hang_rate']:.1%}",
+            f"❌ Rechazos: {options['reject_rate']:.1%}  ⚠️ Observaciones: {options['observe_rate']:.1%}",
+            f"🎫 Demora de tickets: {options['ticket_delay']} segundos",
+            f"👉 Configure SUNAT_SERVICE_URL={url}",
+        ]:
+            self.stdout.write(f"  {line}")
+
+        def stop(signum, frame):
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+        started = time.monotonic()
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+
+        elapsed = max(time.monotonic() - started, 1e-6)
+        stats = state.stats
+        self.stdout.write(self.style.MIGRATE_HEADING('\n📊 RESUMEN DEL SERVIDOR DE PRUEBAS'))
+        self.stdout.write(f"  📨 Solicitudes: {stats['requests']} ({stats['requests'] / elapsed * 60:.0f}/min)")
+        self.stdout.write(f"  📄 sendBill: {stats['sendBill']}  📦 sendSummary: {stats['sendSummary']}")
+        self.stdout.write(f"  🎫 getStatus: {stats['getStatus']}  🔎 getStatusCdr: {stats['getStatusCdr']}")
+        self.stdout.write(f"  🔁 Duplicados: {stats['duplicates']}")
+        self.stdout.write(f"  💥 Fallas: {stats['faults']}  HTTP 503: {stats['errors']}  Colgadas: {stats['hangs']}")
@@ -0,0 +1,157 @@
+# operations/management/commands/validate_documents.py
+"""
+Management Command para validar en bloque los XML UBL contra los XSD
+Genera el XML en memoria (o lee el archivo ya generado) y reporta los errores
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Prefetch
+from lxml import etree
+import logging
+
+logger = logging.getLogger('operations.billing_daemon')
+
+# Estados que aún no llegaron a SUNAT (o fueron rechazados) y pueden pasar a INVALID
+MARKABLE_STATUSES = ('PENDING', 'ERROR', 'REJECTED')
+
+
+class Command(BaseCommand):
+    help = 'Validar comprobantes electrónicos contra los esquemas XSD de UBL 2.1'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--status',
+            nargs='+',
+            default=['PENDING', 'ERROR'],
+            help='Estados de facturación a validar (default: PENDING ERROR)'
+        )
+        parser.add_argument(
+            '--company',
+            type=int,
+            help='ID de la empresa'
+        )
+        parser.add_argument(
+            '--ids',
+            type=int,
+            nargs='+',
+            help='IDs de operaciones específicas'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=500,
+            help='Cantidad máxima de documentos a validar (default: 500)'
+        )
+        parser.add_argument(
+            '--from-files',
+            action='store_true',
+            help='Validar el XML ya generado (xml_file_path) en lugar de regenerarlo'
+        )
+        parser.add_argument(
+            '--mark-invalid',
+            action='store_true',
+            help='Marcar como INVALID los documentos que no cumplen el esquema'
+        )
+        parser.add_argument(
+            '--verbose',
+            action='store_true',
+            help='Mostrar todos los errores de cada documento'
+        )
+
+    def handle(self, *args, **options):
+        from operations.models import Operation, OperationDetail
+        from operations.services.billing_state import StaleTransition, transition
+        from operations.services.billing_service import XMLGenerator
+        from operations.services.ubl_validator import SCHEMA_FILES, UBLValidationError, UBLValidator, describe_location
+
+        # Sin esquemas no hay nada que validar
+        available = [name for name in SCHEMA_FILES if UBLValidator.get_schema(name) is not None]
+        if not available:
+            raise CommandError('No se encontraron los XSD de UBL 2.1 (revise BILLING_UBL_XSD_ROOT)')
+
+        operations = Operation.objects.filter(
+            operation_type='S',
+            document__code__in=['01', '03', '07', '08']
+        ).select_related(
+            'company', 'person', 'document'
+        ).prefetch_related(
+            Prefetch('operationdetail_set', queryset=OperationDetail.objects.select_related('product')),
+            'payment_set',
+        ).order_by('id')
+
+        if options['ids']:
+            operations = operations.filter(id__in=options['ids'])
+        else:
+            operations = operations.filter(billing_status__in=options['status'])
+        if options['company']:
+            operations = operations.filter(company_id=options['company'])
+
+        operations = operations[:options['limit']]
+
+        self.stdout.write(
+            self.style.MIGRATE_LABEL(f'\n🔎 VALIDANDO {len(operations)} DOCUMENTOS CONTRA XSD UBL 2.1...')
+        )
+
+        valid = 0
+        invalid = []
+        marked = 0
+        skipped = []
+        failed = 0
+
+        for operation in operations:
+            doc_info = f"{operation.serial}-{operation.number}"
+            try:
+                if options['from_files']:
+                    if not operation.xml_file_path:
+                        self.stdout.write(self.style.WARNING(f'  ⏭️ {doc_info} no tiene XML generado'))
+                        failed += 1
+                        continue
+                    document = etree.parse(operation.xml_file_path)
+                else:
+                    document = XMLGenerator(operation, operation.company).build_document()
+
+                if etree.QName(document.getroot()).localname not in available:
+                    self.stdout.write(self.style.WARNING(f'  ⏭️ {doc_info} sin esquema XSD para su tipo'))
+                    failed += 1
+                    continue
+
+                UBLValidator.check(document)
+                valid += 1
+
+            except UBLValidationError as e:
+                invalid.append(operation)
+                self.stdout.write(self.style.ERROR(f'  ❌ {doc_info}: {len(e.errors)} errores'))
+                errors = e.errors if options['verbose'] else e.errors[:3]
+                for error in errors:
+                    self.stdout.write(f"      {describe_location(error)}: {error['message']}")
+
+                if options['mark_invalid']:
+                    # Con --ids pueden venir documentos ya enviados: solo se marcan los que no salieron
+                    try:
+                        transition(
+                            operation, 'INVALID', expected=MARKABLE_STATUSES,
+                            sunat_error_code='XSD', sunat_error_description=e.format()
+                        )
+                        marked += 1
+                    except StaleTransition:
+                        skipped.append(operation)
+                        self.stdout.write(self.style.WARNING(
+                            f'      ⏭️ No se marca: estado {operation.billing_status}'
+                        ))
+
+            except Exception as e:
+                logger.error(f"Error validando {operation}: {str(e)}", exc_info=True)
+                self.stdout.write(self.style.ERROR(f'  ⚠️ {doc_info}: {str(e)}'))
+                failed += 1
+
+        self.stdout.write(self.style.MIGRATE_HEADING('\n📊 RESUMEN DE VALIDACIÓN'))
+        self.stdout.write(f'  ✅ Válidos: {valid}')
+        self.stdout.write(f'  ❌ Inválidos: {len(invalid)}')
+        self.stdout.write(f'  ⚠️ Sin validar: {failed}')
+        if invalid and options['mark_invalid']:
+            self.stdout.write(self.style.WARNING(f'  🏷️ Marcados como INVALID: {marked}'))
+            if skipped:
+                documents = ', '.join(f'{operation.serial}-{operation.number}' for operation in skipped)
+                self.stdout.write(self.style.WARNING(
+                    f'  ⏭️ No marcados (estado distinto de {"/".join(MARKABLE_STATUSES)}): {len(skipped)} ({documents})'
+                ))
@@ -63,6 +63,7 @@ class Operation(models.Model):
             ('ACCEPTED_WITH_OBSERVATIONS', 'Emitido con observaciones'),
             ('REJECTED', 'Rechazado'),
             ('ERROR', 'Error'),
+            ('INVALID', 'XML inválido'),
             ('PROCESSING_CANCELLATION', 'Procesando anulación'),
             ('CANCELLATION_PENDING', 'Anulación pendiente'),
             ('CANCELLED', 'Anulado'),
@@ -70,6 +71,8 @@ class Operation(models.Model):
         ],
         default='REGISTER'
     )
+    # Momento del último cambio de billing_status (ver billing_state.transition)
+    billing_status_at = models.DateTimeField('Fecha Estado Facturación', null=True, blank=True)
     serial = models.CharField(verbose_name='SERIE', max_length=4, null=True, blank=True)
     number = models.IntegerField(verbose_name='NUMERO', null=True, blank=True)
     currency = models.CharField('MONEDA', max_length=3, choices=CURRENCY_TYPE_CHOICES, default='PEN')
@@ -112,6 +115,9 @@ class Operation(models.Model):
     parent_operation = models.ForeignKey('Operation', on_delete=models.SET_NULL, null=True, blank=True)
     low_number = models.IntegerField(verbose_name='NUMERO ANULACION', null=True, blank=True)
     summary_number = models.IntegerField(verbose_name='NUMERO RESUMEN', null=True, blank=True)
+    # Resumen diario (RC) en el que se informó la boleta
+    summary_date = models.DateField('Fecha Resumen', null=True, blank=True)
+    summary_ticket = models.CharField('Ticket Resumen', max_length=100, null=True, blank=True)
 
     # Códigos y descripciones SUNAT
     sunat_response_code = models.CharField('Código Respuesta SUNAT', max_length=10, null=True, blank=True)
@@ -125,10 +131,21 @@ class Operation(models.Model):
     cdr_file_path = models.CharField('Ruta CDR', max_length=800, null=True, blank=True)
     hash_code = models.CharField('Código Hash', max_length=800, null=True, blank=True)
 
+    # Puntos de control (SHA-256) para retomar reintentos sin regenerar ni firmar
+    input_fingerprint = models.CharField('Huella de datos', max_length=64, null=True, blank=True)
+    xml_hash = models.CharField('Hash XML', max_length=64, null=True, blank=True)
+    signed_xml_hash = models.CharField('Hash XML Firmado', max_length=64, null=True, blank=True)
+
     # Control de reintentos
     retry_count = models.IntegerField('Intentos de Envío', default=0)
     max_retries = models.IntegerField('Máximo Intentos', default=5)
     last_retry_at = models.DateTimeField('Último Intento', null=True, blank=True)
+    # Programado en cada falla (ver retry_policy); el demonio solo toma las vencidas
+    next_attempt_at = models.DateTimeField('Próximo Intento', null=True, blank=True)
+
+    # Reserva del proceso que la está facturando (ver billing_lease)
+    lease_owner = models.CharField('Reservado por', max_length=100, null=True, blank=True)
+    lease_expires_at = models.DateTimeField('Reserva vence', null=True, blank=True)
 
     # Datos para anulación
     cancellation_reason = models.CharField(
@@ -163,6 +180,10 @@ class Operation(models.Model):
         verbose_name = 'Operacion'
         verbose_name_plural = 'Operaciones'
         ordering = ['id']
+        indexes = [
+            models.Index(fields=['billing_status', 'next_attempt_at']),
+            models.Index(fields=['company', 'lease_expires_at']),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['company', 'operation_date', 'total_amount', 'person', 'emit_time'],
@@ -225,6 +246,44 @@ class Operation(models.Model):
         return f"{self.serial}-{self.number}"
 
 
+class BillingStatusTransition(models.Model):
+    """Historial de cambios de billing_status de una operación"""
+    id = models.AutoField(primary_key=True)
+    operation = models.ForeignKey('Operation', on_delete=models.CASCADE, related_name='billing_transitions')
+    from_status = models.CharField('Estado anterior', max_length=30, null=True, blank=True)
+    to_status = models.CharField('Estado nuevo', max_length=30)
+    # Segundos que la operación permaneció en el estado anterior
+    duration = models.FloatField('Duración estado anterior', null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Transición de Facturación'
+        verbose_name_plural = 'Transiciones de Facturación'
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.operation_id}: {self.from_status} -> {self.to_status}"
+
+
+class SummaryCorrelative(models.Model):
+    """Último correlativo de la serie RC (resúmenes y anulaciones de boletas) por empresa y fecha"""
+    id = models.AutoField(primary_key=True)
+    company = models.ForeignKey('users.Company', on_delete=models.CASCADE)
+    issue_date = models.DateField('Fecha de emisión')
+    last_number = models.IntegerField('Último correlativo', default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Correlativo de Resumen'
+        verbose_name_plural = 'Correlativos de Resumen'
+        constraints = [
+            models.UniqueConstraint(fields=['company', 'issue_date'], name='unique_summary_correlative')
+        ]
+
+    def __str__(self):
+        return f"{self.company_id} RC-{self.issue_date:%Y%m%d}-{self.last_number:05d}"
+
+
 class OperationDetail(models.Model):
     id = models.AutoField(primary_key=True)
     operation = models.ForeignKey('operations.Operation', on_delete=models.SET_NULL, null=True, blank=True)
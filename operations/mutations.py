@@ -5,6 +5,7 @@ from finances.models import Payment
 from finances.types import PaymentInput
 from inova import settings
 from operations.models import Person, Serial, Operation, OperationDetail
+from operations.services.billing_wakeup import notify_on_commit
 from operations.types import PersonInput, PersonType, OperationDetailInput, OperationType
 from operations.views import generate_next_number, get_peru_date
 from products.models import Product, TypeAffectation
@@ -351,6 +352,8 @@ class CreateOperation(graphene.Mutation):
                 if operation.document and operation.document.code in ['01', '03', '07', '08']:
                     operation.billing_status = 'PENDING'
                     operation.save()
+                    # Despertar al demonio de facturación cuando se confirme la operación
+                    notify_on_commit('operation', operation.id)
 
                     import threading
 
@@ -567,6 +570,7 @@ class CancelOperation(graphene.Mutation):
             elif operation.billing_status in ['ACCEPTED', 'ACCEPTED_WITH_OBSERVATIONS']:
                 operation.billing_status = 'PROCESSING_CANCELLATION'
                 operation.save()
+                notify_on_commit('cancellation', operation.id)
                 try:
                     from operations.tasks import cancel_document_task
 
@@ -693,6 +697,7 @@ class ResendOperationToBilling(graphene.Mutation):
 
             # Lanzar tarea de facturación
             process_electronic_billing_task.delay(operation_id)
+            notify_on_commit('resend', operation.id)
 
             return ResendOperationToBilling(
                 success=True,
@@ -131,7 +131,7 @@ class OperationsQuery(graphene.ObjectType):
             operation_type=operation_type
         ).select_related(
             'document', 'person', 'user'
-        ).order_by('-created_at')
+        ).prefetch_related('payment_set').order_by('-created_at')
 
     @staticmethod
     def resolve_operation_by_id(root, info, operation_id):
@@ -141,7 +141,8 @@ class OperationsQuery(graphene.ObjectType):
             ).prefetch_related(
                 'operationdetail_set__product__unit',
                 'operationdetail_set__product__type_affectation',
-                'operationdetail_set__type_affectation'
+                'operationdetail_set__type_affectation',
+                'payment_set'
             ).get(id=operation_id)
         except Operation.DoesNotExist:
             return None
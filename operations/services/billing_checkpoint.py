@@ -0,0 +1,180 @@
+# operations/services/billing_checkpoint.py
+"""
+Puntos de control por contenido de la facturación.
+
+Al generar y firmar un comprobante se guardan en la operación tres huellas
+SHA-256:
+
+- input_fingerprint: datos de entrada del XML (operación, cliente, detalle
+  con sus productos, pagos, datos de la empresa y certificado).
+- xml_hash: XML sin firmar tal como se escribió en disco.
+- signed_xml_hash: XML firmado tal como se escribió en disco.
+
+En un reintento (p. ej. timeout o SUNAT caído) el circuito retoma desde la
+última etapa válida: si los datos no cambiaron y el XML firmado en disco
+coincide con su huella se envía directamente; si solo el XML sin firmar
+sigue válido se firma sin volver a generarlo. Cualquier diferencia (una
+edición de la operación, un certificado nuevo, un archivo alterado o
+faltante) vuelve al circuito completo.
+
+Se desactiva con BILLING_CHECKPOINTS = False.
+"""
+import hashlib
+import json
+import logging
+import os
+
+from django.conf import settings
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+# Cambiar si cambia el armado del XML: invalida todos los puntos de control
+CHECKPOINT_VERSION = 1
+
+OPERATION_FIELDS = (
+    'document_id', 'operation_type', 'serial', 'number', 'currency', 'emit_date', 'emit_time', 'due_date',
+    'person_id', 'parent_operation_id', 'items_total_discount', 'global_discount', 'global_discount_percent',
+    'total_discount', 'igv_percent', 'igv_amount', 'total_taxable', 'total_unaffected', 'total_exempt',
+    'total_free', 'total_amount',
+)
+PERSON_FIELDS = ('person_type', 'document', 'full_name')
+DETAIL_FIELDS = (
+    'id', 'product_id', 'description', 'type_affectation_id', 'quantity', 'unit_value', 'unit_price',
+    'discount_percentage', 'total_discount', 'total_value', 'total_igv', 'total_amount',
+)
+PAYMENT_FIELDS = ('id', 'payment_type', 'payment_date', 'paid_amount', 'is_enabled')
+COMPANY_FIELDS = (
+    'ruc', 'denomination', 'address', 'ubigeo', 'department', 'province', 'district', 'country_code',
+    'establishment_code', 'environment',
+)
+
+CHECKPOINT_FIELDS = ['input_fingerprint', 'xml_hash', 'signed_xml_hash']
+
+
+def is_enabled():
+    return getattr(settings, 'BILLING_CHECKPOINTS', True)
+
+
+def content_hash(content):
+    """SHA-256 (hex) de un contenido en bytes o texto UTF-8"""
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return hashlib.sha256(content).hexdigest()
+
+
+def _values(instance, fields):
+    if instance is None:
+        return None
+    return [getattr(instance, field, None) for field in fields]
+
+
+def input_fingerprint(operation):
+    """
+    Huella de los datos con los que se arma el XML de la operación.
+    Usa el detalle y los pagos precargados (prefetch) si los hay.
+    """
+    from operations.services.billing_service import SigningKeyCache
+
+    company = operation.company
+    cert_path, key_path = SigningKeyCache.get_paths(company.ruc, company.environment)
+    try:
+        certificate = [os.path.getmtime(cert_path), os.path.getmtime(key_path)]
+    except OSError:
+        certificate = None
+
+    data = {
+        'version': CHECKPOINT_VERSION,
+        'operation': _values(operation, OPERATION_FIELDS),
+        'document': operation.document.code if operation.document else None,
+        'person': _values(operation.person, PERSON_FIELDS),
+        'details': [
+            _values(detail, DETAIL_FIELDS) + [detail.product.code if detail.product else None]
+            for detail in operation.operationdetail_set.all()
+        ],
+        'payments': [_values(payment, PAYMENT_FIELDS) for payment in operation.payment_set.all()],
+        'company': _values(company, COMPANY_FIELDS),
+        'certificate': certificate,
+    }
+    return content_hash(json.dumps(data, default=str, sort_keys=True))
+
+
+def _read(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except (OSError, TypeError):
+        return None
+
+
+class BillingCheckpoint:
+    """Puntos de control de una operación"""
+
+    def __init__(self, operation):
+        self.operation = operation
+        self._fingerprint = None
+
+    @property
+    def fingerprint(self):
+        if self._fingerprint is None:
+            self._fingerprint = input_fingerprint(self.operation)
+        return self._fingerprint
+
+    def record_generated(self, xml_content):
+        """Registrar en la operación (sin guardarla) el XML generado"""
+        if not is_enabled():
+            return
+        self.operation.input_fingerprint = self.fingerprint
+        self.operation.xml_hash = content_hash(xml_content)
+        self.operation.signed_xml_hash = None
+
+    def record_signed(self, signed_xml):
+        """Registrar en la operación (sin guardarla) el XML firmado"""
+        if not is_enabled():
+            return
+        self.operation.signed_xml_hash = content_hash(signed_xml)
+
+    def _inputs_unchanged(self):
+        if not is_enabled() or not self.operation.input_fingerprint:
+            return False
+        return self.operation.input_fingerprint == self.fingerprint
+
+    def signed(self):
+        """
+        XML firmado reutilizable (etapa de envío).
+
+        Returns:
+            SigningResult con el contenido leído de disco, o None si hay que
+            volver a firmar
+        """
+        from operations.services.billing_service import SigningResult
+
+        operation = self.operation
+        if not operation.signed_xml_hash or not operation.hash_code or not self._inputs_unchanged():
+            return None
+
+        signed_xml = _read(operation.signed_xml_file_path)
+        if signed_xml is None or content_hash(signed_xml) != operation.signed_xml_hash:
+            return None
+
+        logger.info(f"Punto de control válido: se reutiliza el XML firmado de {operation}")
+        return SigningResult(operation.signed_xml_file_path, signed_xml, operation.hash_code, None, None)
+
+    def generated(self):
+        """
+        XML sin firmar reutilizable (etapa de firma).
+
+        Returns:
+            (ruta, contenido, árbol) o None si hay que volver a generarlo
+        """
+        operation = self.operation
+        if not operation.xml_hash or not self._inputs_unchanged():
+            return None
+
+        xml_content = _read(operation.xml_file_path)
+        if xml_content is None or content_hash(xml_content) != operation.xml_hash:
+            return None
+
+        logger.info(f"Punto de control válido: se reutiliza el XML generado de {operation}")
+        document = etree.ElementTree(etree.fromstring(xml_content, etree.XMLParser(remove_blank_text=False)))
+        return operation.xml_file_path, xml_content, document
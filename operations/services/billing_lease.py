@@ -0,0 +1,179 @@
+# operations/services/billing_lease.py
+"""
+Reserva (lease) de operaciones para facturar.
+
+Antes de enviar una operación, el demonio o el worker de Celery la reserva
+a su nombre (lease_owner) hasta lease_expires_at. Otro proceso no puede
+tomarla mientras la reserva esté vigente, así que se pueden correr varios
+demonios, en uno o varios servidores, junto con Celery sin que un
+comprobante se envíe dos veces.
+
+- La reserva es un UPDATE condicional (sin dueño o con la reserva vencida)
+  que solo afecta las filas libres. Si la base lo soporta (MySQL 8,
+  PostgreSQL) los candidatos se eligen con SELECT ... FOR UPDATE SKIP LOCKED,
+  así dos procesos no compiten por las mismas filas.
+- Quien procesa un lote renueva la reserva de cada operación al empezar a
+  enviarla (renew): un lote que tarda más que una reserva no pierde las
+  operaciones en cola, y si otro proceso ya tomó una reserva vencida la
+  renovación falla y la operación se omite (la envía solo el nuevo dueño).
+- Si un proceso muere su reserva vence (BILLING_LEASE_SECONDS) y otro la
+  retoma. Las operaciones que quedaron en PROCESSING con la reserva vencida
+  pasan a ERROR para que se concilien o reintenten (reclaim_expired).
+"""
+import logging
+import os
+import socket
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Rondas de candidatos cuando la base no soporta SKIP LOCKED
+CLAIM_ATTEMPTS = 5
+
+
+def lease_seconds():
+    return getattr(settings, 'BILLING_LEASE_SECONDS', 600)
+
+
+def worker_id():
+    """Identificador del proceso que reserva (servidor:pid)"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _free(now):
+    return Q(lease_owner__isnull=True) | Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lt=now)
+
+
+def available(now=None):
+    """Filtro de operaciones sin reserva vigente"""
+    return _free(now or timezone.now())
+
+
+def _lock_of():
+    # Bloquear solo las filas de la operación, no las de los joins del filtro
+    return ('self',) if connection.features.has_select_for_update_of else ()
+
+
+def claim(queryset, limit, owner=None, seconds=None):
+    """
+    Reservar hasta limit operaciones libres del queryset (en su orden).
+
+    Returns:
+        Lista de operaciones reservadas por owner (del mismo queryset)
+    """
+    owner = owner or worker_id()
+    now = timezone.now()
+    expires = now + timedelta(seconds=seconds or lease_seconds())
+    free = queryset.filter(_free(now))
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(
+                free.select_for_update(skip_locked=True, of=_lock_of()).values_list('id', flat=True)[:limit]
+            )
+            queryset.model.objects.filter(id__in=ids).update(lease_owner=owner, lease_expires_at=expires)
+        if not ids:
+            return []
+    else:
+        # La condición se vuelve a evaluar en el UPDATE: solo se toman las que
+        # siguen libres. Si otro proceso ganó parte de los candidatos se
+        # buscan otros (los ya reservados dejan de estar libres)
+        claimed = 0
+        for attempt in range(CLAIM_ATTEMPTS):
+            ids = list(free.values_list('id', flat=True)[:limit - claimed])
+            if not ids:
+                break
+            claimed += free.filter(id__in=ids).update(lease_owner=owner, lease_expires_at=expires)
+            if claimed >= limit:
+                break
+        if not claimed:
+            return []
+
+    return list(queryset.filter(lease_owner=owner, lease_expires_at=expires))
+
+
+def claim_operation(operation, owner=None, seconds=None):
+    """Reservar una operación puntual; False si otro proceso la tiene reservada"""
+    from operations.models import Operation
+
+    owner = owner or worker_id()
+    now = timezone.now()
+    expires = now + timedelta(seconds=seconds or lease_seconds())
+    claimed = Operation.objects.filter(_free(now), pk=operation.pk).update(lease_owner=owner, lease_expires_at=expires)
+    if claimed:
+        operation.lease_owner = owner
+        operation.lease_expires_at = expires
+    return bool(claimed)
+
+
+def renew(operations, owner=None, seconds=None):
+    """
+    Extender las reservas propias (aunque hayan vencido, si nadie más las tomó).
+
+    Returns:
+        Operaciones que siguen reservadas por owner; las demás las tomó otro proceso
+    """
+    from operations.models import Operation
+
+    owner = owner or worker_id()
+    ids = [operation.pk for operation in operations]
+    if not ids:
+        return []
+    expires = timezone.now() + timedelta(seconds=seconds or lease_seconds())
+    with transaction.atomic():
+        kept = set(
+            Operation.objects.select_for_update().filter(id__in=ids, lease_owner=owner).values_list('id', flat=True)
+        )
+        Operation.objects.filter(id__in=kept).update(lease_expires_at=expires)
+    renewed = []
+    for operation in operations:
+        if operation.pk in kept:
+            operation.lease_expires_at = expires
+            renewed.append(operation)
+        else:
+            logger.info(f"Reserva de {operation} perdida: la tomó otro proceso")
+    return renewed
+
+
+def release(operations, owner=None):
+    """Liberar las reservas propias de las operaciones"""
+    from operations.models import Operation
+
+    owner = owner or worker_id()
+    ids = [operation.pk for operation in operations]
+    if not ids:
+        return 0
+    for operation in operations:
+        if operation.lease_owner == owner:
+            operation.lease_owner = None
+            operation.lease_expires_at = None
+    return Operation.objects.filter(id__in=ids, lease_owner=owner).update(lease_owner=None, lease_expires_at=None)
+
+
+def reclaim_expired():
+    """
+    Devolver a la cola las operaciones que quedaron en PROCESSING con la
+    reserva vencida (el proceso que las tomó se detuvo a mitad del envío).
+    Quedan en ERROR: si SUNAT llegó a recibirlas, la conciliación o el
+    reintento recuperan su CDR sin duplicarlas.
+    """
+    from operations.models import Operation
+    from operations.services.billing_state import transition_many
+
+    now = timezone.now()
+    reclaimed = transition_many(
+        Operation.objects.filter(billing_status='PROCESSING', lease_expires_at__lt=now),
+        'ERROR', expected='PROCESSING',
+        next_attempt_at=now,
+        sunat_error_description='Procesamiento interrumpido (reserva vencida)',
+        lease_owner=None,
+        lease_expires_at=None
+    )
+    if reclaimed:
+        logger.warning(f"{len(reclaimed)} operaciones con reserva vencida vuelven a la cola")
+    return len(reclaimed)
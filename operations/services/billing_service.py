@@ -3,16 +3,37 @@ import os
 from decimal import Decimal
 from django.conf import settings
 from django.utils import timezone as django_timezone
+import hashlib
+import io
 import logging
-import zipfile
+import threading
 from lxml import etree
-import requests
 import base64
 
-from finances.models import Payment
+from operations.services.billing_checkpoint import (
+    CHECKPOINT_FIELDS, BillingCheckpoint, is_enabled as checkpoints_enabled
+)
+from operations.services.billing_state import StaleTransition, transition
+from operations.services.invoice_computation import InvoiceComputation
+from operations.services.payment_schedule import PaymentSchedule
+from operations.services.retry_policy import unavailable_until
+from operations.services.sunat_circuit import SunatUnavailable
+from operations.services.sunat_dispatcher import DispatchRequest, SunatDispatcher
+from operations.services.sunat_package import SunatPackage, is_archiving_enabled as is_zip_archiving_enabled
+from operations.services.sunat_response import SunatResponseError, parse_cdr, parse_soap_response
+from operations.services.sunat_soap import (
+    SEND_BILL, build_envelope, get_credentials, is_duplicate_submission, post_envelope
+)
+from operations.services.ubl_validator import UBLValidationError, UBLValidator, is_enabled as xsd_validation_enabled
+from operations.services.ubl_writer import (
+    UBLWriter, UBL_NAMESPACES, CompanyFragmentCache, amount, cac, cbc, serialize_document
+)
 
 logger = logging.getLogger(__name__)
 
+# Campos que se escriben junto con el paso a PROCESSING (XML, firma y puntos de control)
+SUBMISSION_FIELDS = ['xml_file_path', 'signed_xml_file_path', 'hash_code'] + CHECKPOINT_FIELDS
+
 # Configurar logging para evitar errores de encoding en Windows
 import sys
 
@@ -27,6 +48,10 @@ class BillingFileManager:
     """Administrador de archivos de facturación"""
 
     BASE_PATH = os.path.join(settings.MEDIA_ROOT, 'electronic_billing')
+    _ensured_rucs = set()
+    _artifact_executor = None
+    _executor_pid = None
+    _executor_lock = threading.Lock()
 
     @classmethod
     def create_company_folders(cls, ruc):
@@ -43,6 +68,9 @@ class BillingFileManager:
             'BAJA/XML',
             'BAJA/FIRMA',
             'BAJA/CDR',
+            'RESUMEN/XML',
+            'RESUMEN/FIRMA',
+            'RESUMEN/CDR',
         ]
 
         for folder in folders:
@@ -51,6 +79,13 @@ class BillingFileManager:
 
         logger.info(f"Estructura de carpetas creada para RUC: {ruc}")
 
+    @classmethod
+    def ensure_company_folders(cls, ruc):
+        """Crear la estructura de carpetas una sola vez por proceso"""
+        if ruc not in cls._ensured_rucs:
+            cls.create_company_folders(ruc)
+            cls._ensured_rucs.add(ruc)
+
     @classmethod
     def get_company_path(cls, ruc, folder_type):
         """Obtener ruta de carpeta específica"""
@@ -61,6 +96,61 @@ class BillingFileManager:
         """Obtener ruta completa de archivo"""
         return os.path.join(cls.get_company_path(ruc, folder_type), filename)
 
+    @classmethod
+    def write_artifact(cls, file_path, content):
+        """Escribir un archivo de facturación (bytes o texto UTF-8)"""
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        with open(file_path, 'wb') as f:
+            f.write(content)
+
+    @classmethod
+    def persist_artifacts(cls, artifacts, asynchronous=None):
+        """
+        Escribir los archivos generados en memoria por el proceso de facturación.
+
+        Args:
+            artifacts: lista de tuplas (ruta, contenido)
+            asynchronous: escribir en segundo plano; por defecto BILLING_ASYNC_ARTIFACTS
+
+        Returns:
+            Future si la escritura es en segundo plano, None si ya terminó
+        """
+        if not artifacts:
+            return None
+
+        if asynchronous is None:
+            asynchronous = getattr(settings, 'BILLING_ASYNC_ARTIFACTS', False)
+
+        artifacts = list(artifacts)
+        if asynchronous:
+            return cls._get_artifact_executor().submit(cls._write_artifacts, artifacts)
+
+        cls._write_artifacts(artifacts)
+        return None
+
+    @classmethod
+    def _write_artifacts(cls, artifacts):
+        for file_path, content in artifacts:
+            try:
+                cls.write_artifact(file_path, content)
+            except Exception as e:
+                logger.error(f"Error guardando archivo {file_path}: {str(e)}")
+
+    @classmethod
+    def _get_artifact_executor(cls):
+        """Hilos de escritura en segundo plano (uno por proceso, se crean al primer uso)"""
+        with cls._executor_lock:
+            # Tras un fork los hilos del padre no existen en el hijo
+            if cls._artifact_executor is None or cls._executor_pid != os.getpid():
+                from concurrent.futures import ThreadPoolExecutor
+                cls._artifact_executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'BILLING_ARTIFACT_WRITERS', 2),
+                    thread_name_prefix='billing-artifacts'
+                )
+                cls._executor_pid = os.getpid()
+            return cls._artifact_executor
+
 
 class BillingConfiguration:
     """Configuración de facturación electrónica"""
@@ -99,9 +189,25 @@ class XMLGenerator:
         self.operation = operation
         self.company = company
         self.config = BillingConfiguration()
-
-    def generate_xml(self):
-        """Generar XML del comprobante"""
+        self.document = None
+        self.xml_content = None
+        self._computation = None
+
+    @property
+    def computation(self):
+        """Importes del comprobante, calculados una sola vez por operación"""
+        if self._computation is None:
+            self._computation = InvoiceComputation.from_operation(self.operation)
+        return self._computation
+
+    def generate_xml(self, commit=True, persist=True):
+        """
+        Generar XML del comprobante.
+        Con commit=False no se guarda la operación (la generación por lotes
+        actualiza las rutas de todas las operaciones en una sola consulta).
+        Con persist=False no se escribe el archivo: el contenido queda en
+        xml_content para guardarlo después con BillingFileManager.
+        """
         try:
             # DEBUG - Verificar el valor del descuento
             logger.info(f"=== GENERANDO XML ===")
@@ -112,14 +218,13 @@ class XMLGenerator:
             logger.info(f"Total: {self.operation.total_amount}")
 
             document_code = self._get_document_code()
-            xml_content = self._build_xml_content(document_code)
+            document = self.build_document(document_code)
 
             # Verificar que el AllowanceCharge esté presente
             if self.operation.global_discount and self.operation.global_discount > 0:
-                if '<cac:AllowanceCharge>' in xml_content:
+                count = len(document.getroot().findall('cac:AllowanceCharge', UBL_NAMESPACES))
+                if count:
                     logger.info(" AllowanceCharge ENCONTRADO en XML")
-                    # Contar cuántas veces aparece
-                    count = xml_content.count('<cac:AllowanceCharge>')
                     logger.info(f"  Aparece {count} vez(ces)")
                 else:
                     logger.error(" AllowanceCharge NO ENCONTRADO en XML")
@@ -127,19 +232,24 @@ class XMLGenerator:
             filename = f"{self.company.ruc}-{document_code}-{self.operation.serial}-{self.operation.number}.xml"
 
             # Crear carpeta si no existe
-            BillingFileManager.create_company_folders(self.company.ruc)
+            BillingFileManager.ensure_company_folders(self.company.ruc)
 
             file_path = BillingFileManager.get_file_path(
                 self.company.ruc, 'XML', filename
             )
 
-            # Guardar XML
-            with open(file_path, 'w', encoding='iso-8859-1') as f:
-                f.write(xml_content)
+            # Serializar antes de firmar: la firma modifica el árbol
+            self.xml_content = serialize_document(document)
+            if persist:
+                BillingFileManager.write_artifact(file_path, self.xml_content)
+
+            # El árbol queda disponible para firmarlo sin volver a leer el archivo
+            self.document = document
 
             # Actualizar operation
             self.operation.xml_file_path = file_path
-            self.operation.save()
+            if commit:
+                self.operation.save(update_fields=['xml_file_path'])
 
             logger.info(f"XML generado: {filename}")
             return file_path
@@ -148,6 +258,75 @@ class XMLGenerator:
             logger.error(f"Error generando XML: {str(e)}")
             raise
 
+    def build_document(self, document_code=None):
+        """Construir el árbol UBL del comprobante sin escribir ningún archivo"""
+        if document_code is None:
+            document_code = self._get_document_code()
+        return self._build_xml_content(document_code)
+
+    @classmethod
+    def generate_batch(cls, operation_ids, persist=True):
+        """
+        Generar los XML de muchas operaciones en una sola pasada.
+
+        Las operaciones se cargan con un select_related (empresa, cliente,
+        documento) y un prefetch del detalle con sus productos y de los pagos,
+        así que el número de consultas es constante por lote.
+
+        Con persist=False los XML no se escriben: el contenido va en
+        'xml_content' de cada resultado.
+
+        Returns:
+            Diccionario con resultados: 'success' (incluye la operación y el
+            árbol generado en 'tree', listo para firmar) y 'failed'
+        """
+        from django.db.models import Prefetch
+        from operations.models import Operation, OperationDetail
+
+        operations = Operation.objects.filter(
+            id__in=operation_ids
+        ).select_related(
+            'company', 'person', 'document'
+        ).prefetch_related(
+            Prefetch('operationdetail_set', queryset=OperationDetail.objects.select_related('product')),
+            'payment_set',
+        )
+
+        results = {
+            'success': [],
+            'failed': []
+        }
+        generated = []
+
+        for operation in operations:
+            try:
+                generator = cls(operation, operation.company)
+                xml_path = generator.generate_xml(commit=False, persist=persist)
+                generated.append(operation)
+                results['success'].append({
+                    'id': operation.id,
+                    'operation': operation,
+                    'document': f"{operation.serial}-{operation.number}",
+                    'xml_file_path': xml_path,
+                    'xml_content': generator.xml_content,
+                    'tree': generator.document
+                })
+            except Exception as e:
+                results['failed'].append({
+                    'id': operation.id,
+                    'operation': operation,
+                    'document': f"{operation.serial}-{operation.number}",
+                    'error': str(e)
+                })
+
+        if generated:
+            Operation.objects.bulk_update(generated, ['xml_file_path'])
+
+        logger.info(f"Generación por lote completada: {len(results['success'])} exitosas, "
+                    f"{len(results['failed'])} fallidas")
+
+        return results
+
     def _get_document_code(self):
         """Obtener código de documento"""
         if self.operation.document:
@@ -164,47 +343,35 @@ class XMLGenerator:
         return format(value, f'.{decimals}f')
 
     def _build_xml_content(self, document_code):
-        """Construir contenido XML"""
-        xml_header = '<?xml version="1.0" encoding="ISO-8859-1" standalone="no"?>'
-
-        if document_code in ['01', '03']:
-            root_element = 'Invoice'
-            namespace = 'urn:oasis:names:specification:ubl:schema:xsd:Invoice-2'
-        elif document_code == '07':
+        """Construir el documento XML como árbol lxml"""
+        if document_code == '07':
             root_element = 'CreditNote'
-            namespace = 'urn:oasis:names:specification:ubl:schema:xsd:CreditNote-2'
         else:
             root_element = 'Invoice'
-            namespace = 'urn:oasis:names:specification:ubl:schema:xsd:Invoice-2'
-        # Obtener fecha de vencimiento si es crédito
-        due_date_xml = self._get_due_date_xml()
-        # Construir XML completo sin espacios extras
-        xml_content = f'''{xml_header}
-    <{root_element} xmlns="{namespace}" xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2" xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2" xmlns:ccts="urn:un:unece:uncefact:documentation:2" xmlns:ds="http://www.w3.org/2000/09/xmldsig#" xmlns:ext="urn:oasis:names:specification:ubl:schema:xsd:CommonExtensionComponents-2" xmlns:qdt="urn:oasis:names:specification:ubl:schema:xsd:QualifiedDatatypes-2" xmlns:udt="urn:un:unece:uncefact:data:specification:UnqualifiedDataTypesSchemaModule:2" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
-    <ext:UBLExtensions>
-    <ext:UBLExtension>
-    <ext:ExtensionContent></ext:ExtensionContent>
-    </ext:UBLExtension>
-    </ext:UBLExtensions>
-    <cbc:UBLVersionID>2.1</cbc:UBLVersionID>
-    <cbc:CustomizationID>2.0</cbc:CustomizationID>
-    <cbc:ID>{self.operation.serial}-{self.operation.number}</cbc:ID>
-    <cbc:IssueDate>{self.operation.emit_date}</cbc:IssueDate>
-    <cbc:IssueTime>{self.operation.emit_time}</cbc:IssueTime>
-    {self._build_document_type_code(document_code)}
-    <cbc:Note languageLocaleID="1000">{self._get_amount_in_words()}</cbc:Note>
-    {self._build_currency_code()}
-    {self._build_signature()}
-    {self._build_supplier_party()}
-    {self._build_customer_party()}
-    {self._build_payment_terms()}
-    {self._build_allowance_charge()}
-    {self._build_tax_total()}
-    {self._build_legal_monetary_total()}
-    {self._build_invoice_lines()}
-    </{root_element}>'''
-
-        return xml_content
+
+        writer = UBLWriter(root_element)
+        root = writer.root
+        writer.add_extension_content()
+
+        cbc(root, 'UBLVersionID', '2.1')
+        cbc(root, 'CustomizationID', '2.0')
+        cbc(root, 'ID', f"{self.operation.serial}-{self.operation.number}")
+        cbc(root, 'IssueDate', self.operation.emit_date)
+        cbc(root, 'IssueTime', self.operation.emit_time)
+        self._build_document_type_code(root, document_code)
+        cbc(root, 'Note', self._get_amount_in_words(), {'languageLocaleID': '1000'})
+        self._build_currency_code(root)
+        # Firma y emisor solo dependen de la empresa: se copian del caché
+        CompanyFragmentCache.append(root, self.company, 'signature', self._build_signature)
+        CompanyFragmentCache.append(root, self.company, 'supplier_party', self._build_supplier_party)
+        self._build_customer_party(root)
+        self._build_payment_terms(root)
+        self._build_allowance_charge(root)
+        self._build_tax_total(root)
+        self._build_legal_monetary_total(root)
+        self._build_invoice_lines(root)
+
+        return writer.document
 
     def _get_amount_in_words(self):
         """Convertir monto a palabras"""
@@ -223,335 +390,366 @@ class XMLGenerator:
 
         return f"{palabra} CON {decimales:02d}/100 {currency_name}"
 
-    def _build_document_type_code(self, document_code):
+    def _build_document_type_code(self, parent, document_code):
         """Construir código de tipo de documento"""
         operation_type = "0101"  # Venta interna por defecto
-        return f'<cbc:InvoiceTypeCode listID="{operation_type}" listAgencyName="PE:SUNAT" listName="Tipo de Documento" listURI="urn:pe:gob:sunat:cpe:see:gem:catalogos:catalogo01" name="Tipo de Operacion" listSchemeURI="urn:pe:gob:sunat:cpe:see:gem:catalogos:catalogo51">{document_code}</cbc:InvoiceTypeCode>'
-
-    def _build_currency_code(self):
+        cbc(parent, 'InvoiceTypeCode', document_code, {
+            'listID': operation_type,
+            'listAgencyName': 'PE:SUNAT',
+            'listName': 'Tipo de Documento',
+            'listURI': 'urn:pe:gob:sunat:cpe:see:gem:catalogos:catalogo01',
+            'name': 'Tipo de Operacion',
+            'listSchemeURI': 'urn:pe:gob:sunat:cpe:see:gem:catalogos:catalogo51',
+        })
+
+    def _build_currency_code(self, parent):
         """Construir código de moneda"""
-        return f'<cbc:DocumentCurrencyCode listID="ISO 4217 Alpha" listName="Currency" listAgencyName="United Nations Economic Commission for Europe">{self.operation.currency}</cbc:DocumentCurrencyCode>'
-
-    def _build_signature(self):
-        """Construir bloque de firma SIN CDATA"""
-        return f'''<cac:Signature>
-    <cbc:ID>{self.company.ruc}</cbc:ID>
-    <cac:SignatoryParty>
-    <cac:PartyIdentification>
-    <cbc:ID>{self.company.ruc}</cbc:ID>
-    </cac:PartyIdentification>
-    <cac:PartyName>
-    <cbc:Name>{self.company.denomination}</cbc:Name>
-    </cac:PartyName>
-    </cac:SignatoryParty>
-    <cac:DigitalSignatureAttachment>
-    <cac:ExternalReference>
-    <cbc:URI>{self.company.ruc}</cbc:URI>
-    </cac:ExternalReference>
-    </cac:DigitalSignatureAttachment>
-    </cac:Signature>'''
-
-    def _build_supplier_party(self):
-        """Construir datos del emisor SIN CDATA"""
-        return f'''<cac:AccountingSupplierParty>
-    <cac:Party>
-    <cac:PartyIdentification>
-    <cbc:ID schemeID="6">{self.company.ruc}</cbc:ID>
-    </cac:PartyIdentification>
-    <cac:PartyName>
-    <cbc:Name>{self.company.denomination}</cbc:Name>
-    </cac:PartyName>
-    <cac:PartyLegalEntity>
-    <cbc:RegistrationName>{self.company.denomination}</cbc:RegistrationName>
-    <cac:RegistrationAddress>
-    <cbc:ID schemeName="Ubigeos" schemeAgencyName="PE:INEI">{self.company.ubigeo}</cbc:ID>
-    <cbc:AddressTypeCode listAgencyName="PE:SUNAT" listName="Establecimientos anexos">{self.company.establishment_code}</cbc:AddressTypeCode>
-    <cbc:CityName>{self.company.province}</cbc:CityName>
-    <cbc:CountrySubentity>{self.company.department}</cbc:CountrySubentity>
-    <cbc:District>{self.company.district}</cbc:District>
-    <cac:AddressLine>
-    <cbc:Line>{self.company.address}</cbc:Line>
-    </cac:AddressLine>
-    <cac:Country>
-    <cbc:IdentificationCode listID="ISO 3166-1" listAgencyName="United Nations Economic Commission for Europe" listName="Country">{self.company.country_code}</cbc:IdentificationCode>
-    </cac:Country>
-    </cac:RegistrationAddress>
-    </cac:PartyLegalEntity>
-    </cac:Party>
-    </cac:AccountingSupplierParty>'''
-
-    def _build_customer_party(self):
-        """Construir datos del cliente SIN CDATA"""
+        cbc(parent, 'DocumentCurrencyCode', self.operation.currency, {
+            'listID': 'ISO 4217 Alpha',
+            'listName': 'Currency',
+            'listAgencyName': 'United Nations Economic Commission for Europe',
+        })
+
+    def _build_signature(self, parent):
+        """Construir bloque de firma"""
+        signature = cac(parent, 'Signature')
+        cbc(signature, 'ID', self.company.ruc)
+        signatory = cac(signature, 'SignatoryParty')
+        cbc(cac(signatory, 'PartyIdentification'), 'ID', self.company.ruc)
+        cbc(cac(signatory, 'PartyName'), 'Name', self.company.denomination)
+        attachment = cac(signature, 'DigitalSignatureAttachment')
+        cbc(cac(attachment, 'ExternalReference'), 'URI', self.company.ruc)
+
+    def _build_supplier_party(self, parent):
+        """Construir datos del emisor"""
+        supplier = cac(parent, 'AccountingSupplierParty')
+        party = cac(supplier, 'Party')
+        cbc(cac(party, 'PartyIdentification'), 'ID', self.company.ruc, {'schemeID': '6'})
+        cbc(cac(party, 'PartyName'), 'Name', self.company.denomination)
+        legal_entity = cac(party, 'PartyLegalEntity')
+        cbc(legal_entity, 'RegistrationName', self.company.denomination)
+        address = cac(legal_entity, 'RegistrationAddress')
+        cbc(address, 'ID', self.company.ubigeo, {'schemeName': 'Ubigeos', 'schemeAgencyName': 'PE:INEI'})
+        cbc(address, 'AddressTypeCode', self.company.establishment_code, {
+            'listAgencyName': 'PE:SUNAT',
+            'listName': 'Establecimientos anexos',
+        })
+        cbc(address, 'CityName', self.company.province)
+        cbc(address, 'CountrySubentity', self.company.department)
+        cbc(address, 'District', self.company.district)
+        cbc(cac(address, 'AddressLine'), 'Line', self.company.address)
+        cbc(cac(address, 'Country'), 'IdentificationCode', self.company.country_code, {
+            'listID': 'ISO 3166-1',
+            'listAgencyName': 'United Nations Economic Commission for Europe',
+            'listName': 'Country',
+        })
+
+    def _build_customer_party(self, parent):
+        """Construir datos del cliente"""
         person = self.operation.person
 
         # Si no hay persona, usar "CLIENTES VARIOS"
         if not person:
-            return f'''<cac:AccountingCustomerParty>
-    <cac:Party>
-    <cac:PartyIdentification>
-    <cbc:ID schemeID="0" schemeName="Documento de Identidad" schemeAgencyName="PE:SUNAT" schemeURI="urn:pe:gob:sunat:cpe:see:gem:catalogos:catalogo06">00000000</cbc:ID>
-    </cac:PartyIdentification>
-    <cac:PartyLegalEntity>
-    <cbc:RegistrationName>CLIENTES VARIOS</cbc:RegistrationName>
-    </cac:PartyLegalEntity>
-    </cac:Party>
-    </cac:AccountingCustomerParty>'''
-
-        # Si hay persona, procesar normalmente
-        document_length = len(person.document)
-
-        if document_length == 8:
-            doc_type = '1'
-        elif document_length == 11:
-            doc_type = '6'
+            doc_type = '0'
+            document = '00000000'
+            full_name = 'CLIENTES VARIOS'
         else:
-            doc_type = person.person_type
-
-        return f'''<cac:AccountingCustomerParty>
-    <cac:Party>
-    <cac:PartyIdentification>
-    <cbc:ID schemeID="{doc_type}" schemeName="Documento de Identidad" schemeAgencyName="PE:SUNAT" schemeURI="urn:pe:gob:sunat:cpe:see:gem:catalogos:catalogo06">{person.document}</cbc:ID>
-    </cac:PartyIdentification>
-    <cac:PartyLegalEntity>
-    <cbc:RegistrationName>{person.full_name}</cbc:RegistrationName>
-    </cac:PartyLegalEntity>
-    </cac:Party>
-    </cac:AccountingCustomerParty>'''
-
-    def _build_payment_terms(self):
+            # Si hay persona, procesar normalmente
+            document_length = len(person.document)
+
+            if document_length == 8:
+                doc_type = '1'
+            elif document_length == 11:
+                doc_type = '6'
+            else:
+                doc_type = person.person_type
+            document = person.document
+            full_name = person.full_name
+
+        customer = cac(parent, 'AccountingCustomerParty')
+        party = cac(customer, 'Party')
+        cbc(cac(party, 'PartyIdentification'), 'ID', document, {
+            'schemeID': doc_type,
+            'schemeName': 'Documento de Identidad',
+            'schemeAgencyName': 'PE:SUNAT',
+            'schemeURI': 'urn:pe:gob:sunat:cpe:see:gem:catalogos:catalogo06',
+        })
+        cbc(cac(party, 'PartyLegalEntity'), 'RegistrationName', full_name)
+
+    def _add_payment_term(self, parent, means_id, amount_value=None, due_date=None):
+        """Agregar un bloque PaymentTerms (forma de pago o cuota)"""
+        terms = cac(parent, 'PaymentTerms')
+        cbc(terms, 'ID', 'FormaPago')
+        cbc(terms, 'PaymentMeansID', means_id)
+        if amount_value is not None:
+            amount(terms, 'Amount', self._format_decimal(amount_value), self.operation.currency)
+        if due_date is not None:
+            cbc(terms, 'PaymentDueDate', due_date.strftime('%Y-%m-%d'))
+        return terms
+
+    @property
+    def payment_schedule(self):
+        """Cronograma de pago de la operación (una consulta como máximo, compartida con GraphQL)"""
+        return PaymentSchedule.for_operation(self.operation)
+
+    def _build_payment_terms(self, parent):
         """Construir términos de pago - CONTADO o CRÉDITO según SUNAT"""
+        schedule = self.payment_schedule
 
-        # Obtener los pagos asociados a la operación
-        payments = Payment.objects.filter(
-            operation=self.operation,
-            is_enabled=True
-        ).order_by('payment_date')
-
-        if not payments.exists():
-            # Si no hay pagos registrados, asumir contado
-            return '''<cac:PaymentTerms>
-    <cbc:ID>FormaPago</cbc:ID>
-    <cbc:PaymentMeansID>Contado</cbc:PaymentMeansID>
-    </cac:PaymentTerms>'''
-
-        # Determinar si es contado o crédito basado en el primer pago
-        first_payment = payments.first()
-
-        if first_payment.payment_type == 'CN':  # CONTADO
-            return '''<cac:PaymentTerms>
-    <cbc:ID>FormaPago</cbc:ID>
-    <cbc:PaymentMeansID>Contado</cbc:PaymentMeansID>
-    </cac:PaymentTerms>'''
-
-        elif first_payment.payment_type == 'CR':  # CRÉDITO
-            # Para crédito necesitamos agregar las cuotas
-            payment_terms_xml = '''<cac:PaymentTerms>
-    <cbc:ID>FormaPago</cbc:ID>
-    <cbc:PaymentMeansID>Credito</cbc:PaymentMeansID>'''
-
-            # Calcular el monto total del crédito (suma de todas las cuotas)
-            # Usamos paid_amount porque es el monto real de cada cuota
-            total_credito = sum(p.paid_amount for p in payments if p.payment_type == 'CR')
-
-            # Si paid_amount está en 0 (cuotas pendientes), usar el total de la operación
-            if total_credito == 0:
-                total_credito = self.operation.total_amount
-
-            payment_terms_xml += f'''
-    <cbc:Amount currencyID="{self.operation.currency}">{self._format_decimal(total_credito)}</cbc:Amount>'''
-
-            payment_terms_xml += '''
-    </cac:PaymentTerms>'''
-
-            # Agregar las cuotas como PaymentTerms adicionales
-            cuota_number = 1
-            for payment in payments:
-                if payment.payment_type == 'CR':
-                    # Usar paid_amount para el monto de cada cuota
-                    cuota_amount = payment.paid_amount
-
-                    # Si paid_amount es 0 (pendiente), calcular proporcionalmente
-                    if cuota_amount == 0:
-                        # Contar total de cuotas
-                        total_cuotas = payments.filter(payment_type='CR').count()
-                        # Dividir el total entre las cuotas
-                        cuota_amount = self.operation.total_amount / total_cuotas
-
-                    payment_terms_xml += f'''
-    <cac:PaymentTerms>
-    <cbc:ID>FormaPago</cbc:ID>
-    <cbc:PaymentMeansID>Cuota{cuota_number:03d}</cbc:PaymentMeansID>
-    <cbc:Amount currencyID="{self.operation.currency}">{self._format_decimal(cuota_amount)}</cbc:Amount>
-    <cbc:PaymentDueDate>{payment.payment_date.strftime('%Y-%m-%d')}</cbc:PaymentDueDate>
-    </cac:PaymentTerms>'''
-                    cuota_number += 1
-
-            return payment_terms_xml
-
-        # Por defecto contado
-        return '''<cac:PaymentTerms>
-    <cbc:ID>FormaPago</cbc:ID>
-    <cbc:PaymentMeansID>Contado</cbc:PaymentMeansID>
-    </cac:PaymentTerms>'''
-
-    def _get_due_date_xml(self):
-        """Obtener fecha de vencimiento si es crédito"""
-
-        # Buscar si hay pagos a crédito
-        credit_payments = Payment.objects.filter(
-            operation=self.operation,
-            payment_type='CR',
-            is_enabled=True
-        ).order_by('payment_date')
-
-        if credit_payments.exists():
-            # La fecha de vencimiento es la fecha del último pago
-            last_payment = credit_payments.last()
-            return f'<cbc:DueDate>{last_payment.payment_date.strftime("%Y-%m-%d")}</cbc:DueDate>'
-
-        return ''  # No agregar DueDate si es contado
-
-    def _build_allowance_charge(self):
-        """Construir bloque de descuento global si existe"""
-        if not self.operation.global_discount or self.operation.global_discount == 0:
-            return ''
+        if not schedule.is_credit:
+            # Sin pagos registrados o primer pago al contado
+            self._add_payment_term(parent, 'Contado')
+            return
 
-        # Calcular base
-        base_amount = Decimal('0')
-        for detail in self.operation.operationdetail_set.all():
-            quantity = Decimal(str(detail.quantity))
-            unit_value = Decimal(str(detail.unit_value))
-            base_amount += quantity * unit_value
+        self._add_payment_term(parent, 'Credito', schedule.credit_total)
 
-        discount_amount = Decimal(str(self.operation.global_discount))
+        # Agregar las cuotas como PaymentTerms adicionales
+        for installment in schedule.installments:
+            self._add_payment_term(
+                parent, installment.means_id, installment.amount, installment.due_date
+            )
 
-        if base_amount > 0:
-            discount_factor = discount_amount / base_amount
-        else:
-            discount_factor = Decimal('0')
-
-        # SIN espacios al inicio de ninguna línea
-        return f'''<cac:AllowanceCharge>
-    <cbc:ChargeIndicator>false</cbc:ChargeIndicator>
-    <cbc:AllowanceChargeReasonCode listAgencyName="PE:SUNAT" listName="Cargo/descuento" listURI="urn:pe:gob:sunat:cpe:see:gem:catalogos:catalogo53">03</cbc:AllowanceChargeReasonCode>
-    <cbc:MultiplierFactorNumeric>{self._format_decimal(discount_factor, 5)}</cbc:MultiplierFactorNumeric>
-    <cbc:Amount currencyID="{self.operation.currency}">{self._format_decimal(discount_amount)}</cbc:Amount>
-    <cbc:BaseAmount currencyID="{self.operation.currency}">{self._format_decimal(base_amount)}</cbc:BaseAmount>
-    </cac:AllowanceCharge>'''
-
-    def _build_tax_total(self):
+    def _build_allowance_charge(self, parent):
+        """Construir bloque de descuento global si existe"""
+        computation = self.computation
+        if not computation.has_global_discount:
+            return
+
+        currency = self.operation.currency
+        allowance = cac(parent, 'AllowanceCharge')
+        cbc(allowance, 'ChargeIndicator', 'false')
+        cbc(allowance, 'AllowanceChargeReasonCode', '03', {
+            'listAgencyName': 'PE:SUNAT',
+            'listName': 'Cargo/descuento',
+            'listURI': 'urn:pe:gob:sunat:cpe:see:gem:catalogos:catalogo53',
+        })
+        cbc(allowance, 'MultiplierFactorNumeric', self._format_decimal(computation.discount_factor, 5))
+        amount(allowance, 'Amount', self._format_decimal(computation.global_discount), currency)
+        amount(allowance, 'BaseAmount', self._format_decimal(computation.discount_base), currency)
+
+    def _build_tax_total(self, parent):
         """Construir totales de impuestos"""
-        # Calcular suma de líneas sin descuento
-        base_sin_descuento = Decimal('0')
-        for detail in self.operation.operationdetail_set.all():
-            quantity = Decimal(str(detail.quantity))
-            unit_value = Decimal(str(detail.unit_value))
-            base_sin_descuento += quantity * unit_value
-
-        # CUANDO HAY DESCUENTO: IGV sobre monto SIN descuento
-        if self.operation.global_discount and self.operation.global_discount > 0:
-            taxable_amount = base_sin_descuento
-            # IGV sobre el monto SIN descuento
-            igv_amount = base_sin_descuento * Decimal('0.18')
-        else:
-            taxable_amount = Decimal(str(self.operation.total_taxable))
-            igv_amount = Decimal(str(self.operation.igv_amount))
-
-        return f'''<cac:TaxTotal>
-    <cbc:TaxAmount currencyID="{self.operation.currency}">{self._format_decimal(igv_amount)}</cbc:TaxAmount>
-    <cac:TaxSubtotal>
-    <cbc:TaxableAmount currencyID="{self.operation.currency}">{self._format_decimal(taxable_amount)}</cbc:TaxableAmount>
-    <cbc:TaxAmount currencyID="{self.operation.currency}">{self._format_decimal(igv_amount)}</cbc:TaxAmount>
-    <cac:TaxCategory>
-    <cac:TaxScheme>
-    <cbc:ID schemeName="Codigo de tributos" schemeAgencyName="PE:SUNAT" schemeURI="urn:pe:gob:sunat:cpe:see:gem:catalogos:catalogo05">1000</cbc:ID>
-    <cbc:Name>IGV</cbc:Name>
-    <cbc:TaxTypeCode>VAT</cbc:TaxTypeCode>
-    </cac:TaxScheme>
-    </cac:TaxCategory>
-    </cac:TaxSubtotal>
-    </cac:TaxTotal>'''
-
-    def _build_legal_monetary_total(self):
+        computation = self.computation
+        currency = self.operation.currency
+        igv_amount = self._format_decimal(computation.igv_amount)
+
+        tax_total = cac(parent, 'TaxTotal')
+        amount(tax_total, 'TaxAmount', igv_amount, currency)
+        subtotal = cac(tax_total, 'TaxSubtotal')
+        amount(subtotal, 'TaxableAmount', self._format_decimal(computation.taxable_amount), currency)
+        amount(subtotal, 'TaxAmount', igv_amount, currency)
+        scheme = cac(cac(subtotal, 'TaxCategory'), 'TaxScheme')
+        cbc(scheme, 'ID', '1000', {
+            'schemeName': 'Codigo de tributos',
+            'schemeAgencyName': 'PE:SUNAT',
+            'schemeURI': 'urn:pe:gob:sunat:cpe:see:gem:catalogos:catalogo05',
+        })
+        cbc(scheme, 'Name', 'IGV')
+        cbc(scheme, 'TaxTypeCode', 'VAT')
+
+    def _build_legal_monetary_total(self, parent):
         """Construir totales monetarios considerando descuentos"""
-        line_extension = Decimal('0')
-        for detail in self.operation.operationdetail_set.all():
-            quantity = Decimal(str(detail.quantity))
-            unit_value = Decimal(str(detail.unit_value))
-            line_extension += quantity * unit_value
-
-        if self.operation.global_discount and self.operation.global_discount > 0:
-            allowance_total = Decimal(str(self.operation.global_discount))
-            # IGV sobre monto SIN descuento
-            igv_sin_descuento = line_extension * Decimal('0.18')
-            # TaxInclusiveAmount = LineExtension + IGV
-            tax_inclusive = line_extension + igv_sin_descuento
-            # PayableAmount = TaxInclusiveAmount - AllowanceTotalAmount
-            payable = tax_inclusive - allowance_total
-        else:
-            allowance_total = Decimal('0')
-            tax_inclusive = Decimal(str(self.operation.total_amount))
-            payable = Decimal(str(self.operation.total_amount))
-
-        return f'''<cac:LegalMonetaryTotal>
-    <cbc:LineExtensionAmount currencyID="{self.operation.currency}">{self._format_decimal(line_extension)}</cbc:LineExtensionAmount>
-    <cbc:TaxInclusiveAmount currencyID="{self.operation.currency}">{self._format_decimal(tax_inclusive)}</cbc:TaxInclusiveAmount>
-    <cbc:AllowanceTotalAmount currencyID="{self.operation.currency}">{self._format_decimal(allowance_total)}</cbc:AllowanceTotalAmount>
-    <cbc:ChargeTotalAmount currencyID="{self.operation.currency}">0.00</cbc:ChargeTotalAmount>
-    <cbc:PrepaidAmount currencyID="{self.operation.currency}">0.00</cbc:PrepaidAmount>
-    <cbc:PayableAmount currencyID="{self.operation.currency}">{self._format_decimal(payable)}</cbc:PayableAmount>
-    </cac:LegalMonetaryTotal>'''
-
-    def _build_invoice_lines(self):
+        computation = self.computation
+        currency = self.operation.currency
+
+        total = cac(parent, 'LegalMonetaryTotal')
+        amount(total, 'LineExtensionAmount', self._format_decimal(computation.line_extension), currency)
+        amount(total, 'TaxInclusiveAmount', self._format_decimal(computation.tax_inclusive), currency)
+        amount(total, 'AllowanceTotalAmount', self._format_decimal(computation.allowance_total), currency)
+        amount(total, 'ChargeTotalAmount', '0.00', currency)
+        amount(total, 'PrepaidAmount', '0.00', currency)
+        amount(total, 'PayableAmount', self._format_decimal(computation.payable), currency)
+
+    def _build_invoice_lines(self, parent):
         """Construir líneas de detalle - SIN considerar descuento global"""
-        lines = ""
-        for index, detail in enumerate(self.operation.operationdetail_set.all(), 1):
-            quantity = Decimal(str(detail.quantity))
-            unit_value = Decimal(str(detail.unit_value))
+        currency = self.operation.currency
+        format_decimal = self._format_decimal
+        price_type_attrib = {
+            'listName': 'Tipo de Precio',
+            'listAgencyName': 'PE:SUNAT',
+            'listURI': 'urn:pe:gob:sunat:cpe:see:gem:catalogos:catalogo16',
+        }
 
+        # Cada línea se agrega directamente al árbol
+        for line in self.computation.lines:
             # Los valores de línea SIEMPRE sin descuento
-            total_value = quantity * unit_value
-            total_igv = total_value * Decimal('0.18')
-            unit_price_with_tax = unit_value * Decimal('1.18')
-
-            lines += f'''<cac:InvoiceLine>
-    <cbc:ID>{index}</cbc:ID>
-    <cbc:InvoicedQuantity unitCode="NIU">{self._format_decimal(quantity)}</cbc:InvoicedQuantity>
-    <cbc:LineExtensionAmount currencyID="{self.operation.currency}">{self._format_decimal(total_value)}</cbc:LineExtensionAmount>
-    <cac:PricingReference>
-    <cac:AlternativeConditionPrice>
-    <cbc:PriceAmount currencyID="{self.operation.currency}">{self._format_decimal(unit_price_with_tax)}</cbc:PriceAmount>
-    <cbc:PriceTypeCode listName="Tipo de Precio" listAgencyName="PE:SUNAT" listURI="urn:pe:gob:sunat:cpe:see:gem:catalogos:catalogo16">01</cbc:PriceTypeCode>
-    </cac:AlternativeConditionPrice>
-    </cac:PricingReference>
-    <cac:TaxTotal>
-    <cbc:TaxAmount currencyID="{self.operation.currency}">{self._format_decimal(total_igv)}</cbc:TaxAmount>
-    <cac:TaxSubtotal>
-    <cbc:TaxableAmount currencyID="{self.operation.currency}">{self._format_decimal(total_value)}</cbc:TaxableAmount>
-    <cbc:TaxAmount currencyID="{self.operation.currency}">{self._format_decimal(total_igv)}</cbc:TaxAmount>
-    <cac:TaxCategory>
-    <cbc:Percent>18.00</cbc:Percent>
-    <cbc:TaxExemptionReasonCode>10</cbc:TaxExemptionReasonCode>
-    <cac:TaxScheme>
-    <cbc:ID>1000</cbc:ID>
-    <cbc:Name>IGV</cbc:Name>
-    <cbc:TaxTypeCode>VAT</cbc:TaxTypeCode>
-    </cac:TaxScheme>
-    </cac:TaxCategory>
-    </cac:TaxSubtotal>
-    </cac:TaxTotal>
-    <cac:Item>
-    <cbc:Description>{detail.description}</cbc:Description>
-    <cac:SellersItemIdentification>
-    <cbc:ID>{detail.product.code if detail.product else "PROD001"}</cbc:ID>
-    </cac:SellersItemIdentification>
-    </cac:Item>
-    <cac:Price>
-    <cbc:PriceAmount currencyID="{self.operation.currency}">{self._format_decimal(unit_value)}</cbc:PriceAmount>
-    </cac:Price>
-    </cac:InvoiceLine>'''
-
-        return lines
+            total_value = format_decimal(line.total_value)
+            total_igv = format_decimal(line.total_igv)
+
+            invoice_line = cac(parent, 'InvoiceLine')
+            cbc(invoice_line, 'ID', line.index)
+            cbc(invoice_line, 'InvoicedQuantity', format_decimal(line.quantity), {'unitCode': 'NIU'})
+            amount(invoice_line, 'LineExtensionAmount', total_value, currency)
+
+            condition_price = cac(cac(invoice_line, 'PricingReference'), 'AlternativeConditionPrice')
+            amount(condition_price, 'PriceAmount', format_decimal(line.unit_price_with_tax), currency)
+            cbc(condition_price, 'PriceTypeCode', '01', price_type_attrib)
+
+            tax_total = cac(invoice_line, 'TaxTotal')
+            amount(tax_total, 'TaxAmount', total_igv, currency)
+            subtotal = cac(tax_total, 'TaxSubtotal')
+            amount(subtotal, 'TaxableAmount', total_value, currency)
+            amount(subtotal, 'TaxAmount', total_igv, currency)
+            category = cac(subtotal, 'TaxCategory')
+            cbc(category, 'Percent', '18.00')
+            cbc(category, 'TaxExemptionReasonCode', '10')
+            scheme = cac(category, 'TaxScheme')
+            cbc(scheme, 'ID', '1000')
+            cbc(scheme, 'Name', 'IGV')
+            cbc(scheme, 'TaxTypeCode', 'VAT')
+
+            item = cac(invoice_line, 'Item')
+            cbc(item, 'Description', line.description)
+            cbc(cac(item, 'SellersItemIdentification'), 'ID', line.product_code)
+
+            amount(cac(invoice_line, 'Price'), 'PriceAmount', format_decimal(line.unit_value), currency)
+
+
+class SigningResult:
+    """Resultado de la firma de un XML"""
+
+    __slots__ = (
+        'signed_path',
+        'signed_xml',
+        'digest_value',
+        'signature_value',
+        'certificate_fingerprint',
+    )
+
+    def __init__(self, signed_path, signed_xml, digest_value, signature_value, certificate_fingerprint):
+        self.signed_path = signed_path
+        self.signed_xml = signed_xml
+        # DigestValue es el código hash que se imprime en el comprobante
+        self.digest_value = digest_value
+        self.signature_value = signature_value
+        self.certificate_fingerprint = certificate_fingerprint
+
+
+class SigningKey:
+    """Clave privada y certificado de una empresa, leídos una sola vez"""
+
+    def __init__(self, cert_path, key_path):
+        self.cert_path = cert_path
+        self.key_path = key_path
+        self.mtimes = self.read_mtimes(cert_path, key_path)
+
+        with open(key_path, 'rb') as f:
+            self.key_pem = f.read()
+        with open(cert_path, 'rb') as f:
+            self.cert_pem = f.read()
+
+        # Certificado en base64 para X509Certificate
+        cert_lines = self.cert_pem.decode('utf-8').split('\n')
+        self.cert_base64 = ''.join([line for line in cert_lines if not line.startswith('-----')]).strip()
+
+        # Huella SHA-256 del certificado (DER)
+        self.certificate_fingerprint = hashlib.sha256(
+            base64.b64decode(''.join(self.cert_base64.split()))
+        ).hexdigest()
+
+        self._xmlsec_key = None
+        self._rsa_key = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def read_mtimes(cert_path, key_path):
+        """Fechas de modificación de los archivos (lanza FileNotFoundError si faltan)"""
+        return os.stat(cert_path).st_mtime_ns, os.stat(key_path).st_mtime_ns
+
+    @property
+    def xmlsec_key(self):
+        """Clave xmlsec con el certificado cargado (el contexto de firma la duplica)"""
+        if self._xmlsec_key is None:
+            import xmlsec
+            with self._lock:
+                if self._xmlsec_key is None:
+                    key = xmlsec.Key.from_memory(self.key_pem, xmlsec.KeyFormat.PEM)
+                    key.load_cert_from_memory(self.cert_pem, xmlsec.KeyFormat.PEM)
+                    self._xmlsec_key = key
+        return self._xmlsec_key
+
+    @property
+    def rsa_key(self):
+        """Clave RSA de PyCryptodome"""
+        if self._rsa_key is None:
+            from Crypto.PublicKey import RSA
+            with self._lock:
+                if self._rsa_key is None:
+                    self._rsa_key = RSA.import_key(self.key_pem)
+        return self._rsa_key
+
+
+class SigningKeyCache:
+    """
+    Caché por proceso de claves de firma por (RUC, ambiente).
+    Una entrada se vuelve a leer si cambia la fecha de modificación del
+    certificado o de la clave.
+    """
+
+    _keys = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_paths(cls, ruc, environment):
+        """Rutas del certificado y la clave de la empresa"""
+        cert_base_path = BillingFileManager.get_company_path(ruc, f'CERTIFICADOS/{environment}')
+        return (
+            os.path.join(cert_base_path, 'server.pem'),
+            os.path.join(cert_base_path, 'server_key.pem'),
+        )
+
+    @classmethod
+    def get(cls, ruc, environment):
+        """Obtener la clave de firma, cargándola si no está o si los archivos cambiaron"""
+        cache_key = (ruc, environment)
+        cert_path, key_path = cls.get_paths(ruc, environment)
+
+        try:
+            mtimes = SigningKey.read_mtimes(cert_path, key_path)
+        except FileNotFoundError:
+            cls.invalidate(ruc, environment)
+            cert_base_path = os.path.dirname(cert_path)
+            logger.error(f"Certificados no encontrados en: {cert_base_path}")
+            raise FileNotFoundError(f"Certificados no encontrados en: {cert_base_path}")
+
+        signing_key = cls._keys.get(cache_key)
+        if signing_key is not None and signing_key.mtimes == mtimes:
+            return signing_key
+
+        with cls._lock:
+            signing_key = cls._keys.get(cache_key)
+            if signing_key is None or signing_key.mtimes != mtimes:
+                signing_key = SigningKey(cert_path, key_path)
+                cls._keys[cache_key] = signing_key
+                logger.info(f"Certificados cargados en: {os.path.dirname(cert_path)}")
+        return signing_key
+
+    @classmethod
+    def warm(cls, companies):
+        """
+        Precargar las claves de varias empresas (p. ej. al iniciar un worker).
+        companies: iterable de (ruc, environment)
+        """
+        loaded = 0
+        for ruc, environment in companies:
+            try:
+                signing_key = cls.get(ruc, environment)
+                # Dejar también parseada la clave que se usará para firmar
+                try:
+                    signing_key.xmlsec_key
+                except ImportError:
+                    signing_key.rsa_key
+                loaded += 1
+            except Exception as e:
+                logger.warning(f"No se pudo precargar la clave de {ruc} ({environment}): {str(e)}")
+        return loaded
+
+    @classmethod
+    def invalidate(cls, ruc, environment=None):
+        with cls._lock:
+            for cache_key in list(cls._keys):
+                if cache_key[0] == ruc and (environment is None or cache_key[1] == environment):
+                    del cls._keys[cache_key]
 
 
 class XMLSigner:
@@ -560,40 +758,53 @@ class XMLSigner:
     def __init__(self, company):
         self.company = company
 
-    def sign_xml(self, xml_file_path):
-        """Firmar XML con certificado digital"""
+    def sign_xml(self, xml_file_path, document=None, persist=True):
+        """
+        Firmar XML con certificado digital.
+        Si se recibe el árbol ya construido (document) se firma directamente,
+        sin volver a leer y parsear el archivo.
+        Con persist=False no se escribe el archivo firmado (signed_path es la
+        ruta donde debe guardarse).
+
+        Returns:
+            SigningResult con la ruta y el contenido firmado, DigestValue,
+            SignatureValue y la huella del certificado
+        """
         try:
-            # Obtener certificados
-            cert_path, key_path = self._get_certificate_paths()
+            # Obtener certificados (caché por proceso)
+            signing_key = self._get_signing_key()
 
             # Intentar primero con xmlsec (más confiable)
             try:
                 import xmlsec
-                return self._sign_with_xmlsec(xml_file_path, cert_path, key_path)
+                return self._sign_with_xmlsec(xml_file_path, signing_key, document, persist)
             except ImportError:
                 logger.warning("xmlsec no instalado, instalando...")
                 import subprocess
                 import sys
                 subprocess.check_call([sys.executable, "-m", "pip", "install", "xmlsec"])
                 import xmlsec
-                return self._sign_with_xmlsec(xml_file_path, cert_path, key_path)
+                return self._sign_with_xmlsec(xml_file_path, signing_key, document, persist)
             except Exception as e:
                 logger.error(f"Error con xmlsec: {str(e)}, intentando método alternativo")
-                return self._sign_with_pycryptodome(xml_file_path, cert_path, key_path)
+                return self._sign_with_pycryptodome(xml_file_path, signing_key, document, persist)
 
         except Exception as e:
             logger.error(f"Error firmando XML: {str(e)}")
             raise
 
-    def _sign_with_xmlsec(self, xml_file_path, cert_path, key_path):
+    def _sign_with_xmlsec(self, xml_file_path, signing_key, document=None, persist=True):
         """Firmar con xmlsec - Método más confiable para SUNAT"""
         import xmlsec
 
         logger.info("Firmando con xmlsec...")
 
-        # Leer XML
-        with open(xml_file_path, 'rb') as f:
-            doc = etree.parse(f)
+        # Usar el árbol en memoria o leer XML
+        if document is not None:
+            doc = document
+        else:
+            with open(xml_file_path, 'rb') as f:
+                doc = etree.parse(f)
 
         # Buscar ExtensionContent donde va la firma
         namespaces = {'ext': 'urn:oasis:names:specification:ubl:schema:xsd:CommonExtensionComponents-2'}
@@ -634,10 +845,8 @@ class XMLSigner:
         # Crear contexto de firma
         ctx = xmlsec.SignatureContext()
 
-        # Cargar clave privada y certificado
-        key = xmlsec.Key.from_file(key_path, xmlsec.KeyFormat.PEM)
-        key.load_cert_from_file(cert_path, xmlsec.KeyFormat.PEM)
-        ctx.key = key
+        # Clave privada y certificado ya cargados
+        ctx.key = signing_key.xmlsec_key
 
         # FIRMAR
         ctx.sign(signature_node)
@@ -656,42 +865,38 @@ class XMLSigner:
             self.company.ruc, 'FIRMA', filename
         )
 
-        with open(signed_file_path, 'wb') as f:
-            f.write(signed_xml)
+        if persist:
+            BillingFileManager.write_artifact(signed_file_path, signed_xml)
 
-        # Verificar firma
-        self._verify_xmlsec_signature(signed_file_path)
+        # Verificar firma (sobre el árbol firmado, sin releer el archivo)
+        self._verify_xmlsec_signature(signed_file_path, doc)
 
         logger.info(f"XML firmado correctamente con xmlsec: {filename}")
-        return signed_file_path
+        return SigningResult(
+            signed_file_path,
+            signed_xml,
+            signature_node.findtext('.//{http://www.w3.org/2000/09/xmldsig#}DigestValue'),
+            signature_node.findtext('{http://www.w3.org/2000/09/xmldsig#}SignatureValue'),
+            signing_key.certificate_fingerprint
+        )
 
-    def _sign_with_pycryptodome(self, xml_file_path, cert_path, key_path):
+    def _sign_with_pycryptodome(self, xml_file_path, signing_key, document=None, persist=True):
         """Método alternativo usando PyCryptodome"""
         try:
-            from Crypto.PublicKey import RSA
             from Crypto.Signature import PKCS1_v1_5
             from Crypto.Hash import SHA1
-            from cryptography import x509
-            from cryptography.hazmat.backends import default_backend
-            import uuid
 
             logger.info("Firmando con PyCryptodome...")
 
-            # Leer XML
-            with open(xml_file_path, 'rb') as f:
-                xml_content = f.read()
-
-            # Leer clave privada con PyCryptodome
-            with open(key_path, 'r') as f:
-                private_key = RSA.import_key(f.read())
-
-            # Leer certificado con cryptography
-            with open(cert_path, 'rb') as f:
-                cert_data = f.read()
-                certificate = x509.load_pem_x509_certificate(cert_data, default_backend())
+            # Clave privada ya importada
+            private_key = signing_key.rsa_key
 
-            # Parsear XML
-            doc = etree.fromstring(xml_content)
+            # Usar el árbol en memoria o parsear XML
+            if document is not None:
+                doc = document.getroot()
+            else:
+                with open(xml_file_path, 'rb') as f:
+                    doc = etree.fromstring(f.read())
 
             # Namespace
             DSIG_NS = "http://www.w3.org/2000/09/xmldsig#"
@@ -763,9 +968,7 @@ class XMLSigner:
             x509_cert = etree.SubElement(x509_data, "X509Certificate")
 
             # Certificado en base64
-            cert_lines = cert_data.decode('utf-8').split('\n')
-            cert_content = ''.join([line for line in cert_lines if not line.startswith('-----')])
-            x509_cert.text = cert_content.strip()
+            x509_cert.text = signing_key.cert_base64
 
             # Guardar
             signed_xml = etree.tostring(doc, encoding='ISO-8859-1', xml_declaration=True, pretty_print=False)
@@ -773,23 +976,32 @@ class XMLSigner:
             filename = os.path.basename(xml_file_path)
             signed_file_path = BillingFileManager.get_file_path(self.company.ruc, 'FIRMA', filename)
 
-            with open(signed_file_path, 'wb') as f:
-                f.write(signed_xml)
+            if persist:
+                BillingFileManager.write_artifact(signed_file_path, signed_xml)
 
             logger.info(f"XML firmado con PyCryptodome: {filename}")
-            return signed_file_path
+            return SigningResult(
+                signed_file_path,
+                signed_xml,
+                doc_digest,
+                signature_value.text,
+                signing_key.certificate_fingerprint
+            )
 
         except ImportError:
             logger.error("PyCryptodome no instalado")
             raise Exception("No se pudo firmar el XML. Instale xmlsec o pycryptodome")
 
-    def _verify_xmlsec_signature(self, signed_file_path):
+    def _verify_xmlsec_signature(self, signed_file_path, document=None):
         """Verificar firma creada con xmlsec"""
         try:
             import xmlsec
 
-            with open(signed_file_path, 'rb') as f:
-                doc = etree.parse(f)
+            if document is not None:
+                doc = document
+            else:
+                with open(signed_file_path, 'rb') as f:
+                    doc = etree.parse(f)
 
             # Buscar nodo de firma
             signature_node = doc.find(".//{http://www.w3.org/2000/09/xmldsig#}Signature")
@@ -837,22 +1049,12 @@ class XMLSigner:
 
     def _get_certificate_paths(self):
         """Obtener rutas de certificados"""
-        mode = self.company.environment  # 'BETA' o 'PRODUCTION'
-
-        cert_base_path = BillingFileManager.get_company_path(
-            self.company.ruc,
-            f'CERTIFICADOS/{mode}'
-        )
+        signing_key = self._get_signing_key()
+        return signing_key.cert_path, signing_key.key_path
 
-        cert_path = os.path.join(cert_base_path, 'server.pem')
-        key_path = os.path.join(cert_base_path, 'server_key.pem')
-
-        if not os.path.exists(cert_path) or not os.path.exists(key_path):
-            logger.error(f"Certificados no encontrados en: {cert_base_path}")
-            raise FileNotFoundError(f"Certificados no encontrados en: {cert_base_path}")
-
-        logger.info(f"Certificados encontrados en: {cert_base_path}")
-        return cert_path, key_path
+    def _get_signing_key(self):
+        """Clave y certificado de la empresa ('BETA' o 'PRODUCTION') desde el caché del proceso"""
+        return SigningKeyCache.get(self.company.ruc, self.company.environment)
 
 
 class SunatConnector:
@@ -861,363 +1063,282 @@ class SunatConnector:
     def __init__(self, company):
         self.company = company
         self.config = BillingConfiguration()
-
-    def send_document(self, signed_xml_path, operation):
-        """Enviar documento a SUNAT"""
+        # Archivos pendientes de escribir (ruta, contenido) en modo en memoria
+        self.artifacts = []
+        self.defer_artifacts = False
+
+    def send_document(self, signed_xml_path, operation, signed_xml=None):
+        """
+        Enviar documento a SUNAT.
+        Si se recibe el XML firmado en memoria (signed_xml) el ZIP se arma en
+        memoria y los archivos (ZIP, respuesta, CDR) quedan en self.artifacts
+        para que el llamador los guarde al final.
+        """
         try:
-            # 1. Crear ZIP
-            zip_path = self._create_zip(signed_xml_path)
+            if signed_xml is not None:
+                self.defer_artifacts = True
 
-            # 2. Leer ZIP y convertir a base64
-            with open(zip_path, 'rb') as f:
-                zip_content = base64.b64encode(f.read()).decode()
-
-            # 3. Obtener solo el nombre del archivo
-            filename = os.path.basename(zip_path)
+            # 1. Crear el ZIP en memoria (el base64 va directo al sobre SOAP)
+            package = self._package(signed_xml_path, signed_xml)
+            filename = package.filename
 
             logger.info(f"Enviando archivo: {filename}")
 
-            # 4. Enviar usando SOAP
-            response_xml = self._send_soap_manual(filename, zip_content)
+            # 2. Enviar usando SOAP
+            response_xml = self._send_soap_manual(filename, package.content)
 
-            # 5. Procesar respuesta
+            # 3. Procesar respuesta
             return self._process_response_manual(response_xml, operation)
 
         except Exception as e:
+            if is_duplicate_submission(e) and self._recover_duplicate(operation, e):
+                return True
             logger.error(f"Error enviando documento a SUNAT: {str(e)}")
-            self._handle_error(operation, str(e))
+            if not isinstance(e, SunatUnavailable):
+                # Con el circuito abierto no se llegó a enviar: no cuenta como intento
+                self._handle_error(operation, str(e))
             raise
 
-    def _create_zip(self, xml_path):
-        """Crear ZIP del XML - EXACTAMENTE COMO PHP"""
-        xml_filename = os.path.basename(xml_path)
-        zip_filename = xml_filename.replace('.xml', '.zip')
-        zip_path = xml_path.replace('.xml', '.zip')
+    def prepare_request(self, signed_xml_path, signed_xml, key=None):
+        """
+        Armar el ZIP en memoria y la petición sendBill para el despachador
+        concurrente (los archivos quedan en self.artifacts).
+        """
+        self.defer_artifacts = True
+        package = self._package(signed_xml_path, signed_xml)
+        return DispatchRequest.send_bill(self.company, key, package.filename, package.content)
+
+    def handle_dispatch_result(self, result, operation):
+        """Procesar la respuesta de sendBill obtenida por el despachador concurrente"""
+        try:
+            if result.error:
+                raise result.exception or Exception(result.error)
+            return self._process_response_manual(result.response_text, operation)
 
-        # Si existe, eliminarlo
-        if os.path.exists(zip_path):
-            os.remove(zip_path)
+        except Exception as e:
+            if is_duplicate_submission(e) and self._recover_duplicate(operation, e):
+                return True
+            logger.error(f"Error enviando documento a SUNAT: {str(e)}")
+            if not isinstance(e, SunatUnavailable):
+                # Con el circuito abierto no se llegó a enviar: no cuenta como intento
+                self._handle_error(operation, str(e))
+            raise
 
-        # Crear nuevo ZIP
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            # Agregar solo el nombre del archivo, no la ruta completa
-            zipf.write(xml_path, xml_filename)
+    def _package(self, signed_xml_path, signed_xml=None):
+        """
+        Empaquetar el XML firmado (bytes en memoria o leído una vez del disco).
+        El ZIP solo se guarda junto al XML firmado si BILLING_ARCHIVE_ZIP.
+        """
+        if signed_xml is None:
+            package = SunatPackage.from_file(signed_xml_path)
+        else:
+            package = SunatPackage.from_xml(os.path.basename(signed_xml_path), signed_xml)
 
-        # Intentar cambiar permisos (como PHP hace chmod)
-        try:
-            os.chmod(zip_path, 0o777)
-        except:
-            pass
+        if is_zip_archiving_enabled():
+            self._save_artifact(package.archive_path(signed_xml_path), package.zip_bytes)
+        return package
 
-        logger.info(f"ZIP creado: {zip_filename}")
-        return zip_path
+    def _save_artifact(self, file_path, content):
+        """Guardar un archivo ahora o dejarlo pendiente si el envío es en memoria"""
+        if self.defer_artifacts:
+            self.artifacts.append((file_path, content))
+        else:
+            BillingFileManager.write_artifact(file_path, content)
 
     def _send_soap_manual(self, filename, zip_content):
         """Enviar SOAP manualmente como en PHP"""
-        # Configuración según ambiente
-        if self.company.environment == 'BETA':
-            wsdl_url = 'https://e-beta.sunat.gob.pe/ol-ti-itcpfegem-beta/billService?wsdl'
-            username = f"{self.company.ruc}MODDATOS"
-            password = "moddatos"
-        else:
-            wsdl_url = 'https://e-factura.sunat.gob.pe/ol-ti-itcpfegem/billService?wsdl'
-            username = f"{self.company.ruc}{self.company.sunat_username}"
-            password = self.company.sunat_password
-
-        # Construir XML SOAP exactamente como en PHP
-        soap_xml = f'''<?xml version="1.0" encoding="UTF-8"?>
-<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:ser="http://service.sunat.gob.pe" xmlns:wsse="http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-secext-1.0.xsd">
- <soapenv:Header>
-     <wsse:Security>
-         <wsse:UsernameToken>
-             <wsse:Username>{username}</wsse:Username>
-             <wsse:Password>{password}</wsse:Password>
-         </wsse:UsernameToken>
-     </wsse:Security>
- </soapenv:Header>
- <soapenv:Body>
-     <ser:sendBill>
-         <fileName>{filename}</fileName>
-         <contentFile>{zip_content}</contentFile>
-     </ser:sendBill>
- </soapenv:Body>
-</soapenv:Envelope>'''
+        username, password = get_credentials(self.company)
+        soap_xml = build_envelope(SEND_BILL, username, password, [
+            ('fileName', filename),
+            ('contentFile', zip_content),
+        ])
 
         logger.info(f"Enviando a SUNAT {self.company.environment}")
         logger.info(f"   Usuario: {username}")
         logger.info(f"   Archivo: {filename}")
 
-        # Headers para la petición
-        headers = {
-            'Content-Type': 'text/xml; charset=utf-8',
-            'SOAPAction': '""',
-            'Accept': 'text/xml',
-            'Cache-Control': 'no-cache',
-            'Pragma': 'no-cache',
-            'Content-Length': str(len(soap_xml))
-        }
+        # Sesión keep-alive del ambiente (reutiliza la conexión TLS)
+        return post_envelope(self.company.environment, soap_xml)
 
-        # URL del servicio (sin ?wsdl)
-        service_url = wsdl_url.replace('?wsdl', '')
+    def _process_response_manual(self, response_xml, operation):
+        """Procesar la respuesta de sendBill y registrar el CDR en la operación"""
+        logger.info("Procesando respuesta de SUNAT...")
 
         try:
-            # Enviar petición
-            response = requests.post(
-                service_url,
-                data=soap_xml.encode('utf-8'),
-                headers=headers,
-                timeout=60,
-                verify=True
-            )
+            response = parse_soap_response(response_xml)
 
-            logger.info(f"Respuesta HTTP: {response.status_code}")
+            if response.is_fault:
+                raise SunatResponseError(f"Error SUNAT: {response.faultstring or response.faultcode}")
 
-            if response.status_code == 200:
-                return response.text
-            else:
-                # Intentar obtener el mensaje de error del SOAP Fault
-                if 'soap' in response.text.lower() and 'fault' in response.text.lower():
-                    try:
-                        fault_tree = etree.fromstring(response.text.encode('utf-8'))
-                        fault_code = fault_tree.find('.//{http://schemas.xmlsoap.org/soap/envelope/}faultcode')
-                        fault_string = fault_tree.find('.//{http://schemas.xmlsoap.org/soap/envelope/}faultstring')
-
-                        error_msg = f"SOAP Fault - Code: {fault_code.text if fault_code is not None else 'Unknown'}, "
-                        error_msg += f"Message: {fault_string.text if fault_string is not None else 'Unknown'}"
-                        raise Exception(error_msg)
-                    except:
-                        raise Exception(f"Error HTTP {response.status_code}: {response.text[:500]}")
-                else:
-                    raise Exception(f"Error HTTP {response.status_code}: {response.text[:500]}")
-
-        except requests.exceptions.Timeout:
-            raise Exception("Timeout al conectar con SUNAT")
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"Error de conexión: {str(e)}")
+            cdr_content = response.cdr_bytes()
+            if cdr_content is None:
+                raise SunatResponseError("Formato de respuesta no reconocido")
 
-    def _process_response_manual(self, response_xml, operation):
-        """Procesar respuesta SOAP manual - Versión simplificada"""
-        try:
-            logger.info("Procesando respuesta de SUNAT...")
+            logger.info(f"CDR decodificado, tamaño: {len(cdr_content)} bytes")
+            cdr = parse_cdr(cdr_content)
 
-            # Guardar respuesta para análisis
+        except SunatResponseError:
+            # Guardar la respuesta para análisis solo si no se pudo interpretar
             debug_file = f"sunat_response_{operation.serial}_{operation.number}.xml"
             debug_path = os.path.join(settings.MEDIA_ROOT, 'electronic_billing', self.company.ruc, 'LOGS', debug_file)
-            os.makedirs(os.path.dirname(debug_path), exist_ok=True)
-            with open(debug_path, 'w', encoding='utf-8') as f:
-                f.write(response_xml)
-            logger.info(f"Respuesta guardada en: {debug_path}")
+            BillingFileManager.ensure_company_folders(self.company.ruc)
+            self._save_artifact(debug_path, response_xml)
+            logger.error(f"Respuesta no interpretable guardada en: {debug_path}")
+            raise
 
-            # Buscar applicationResponse de forma simple con regex
-            import re
-            import base64
+        return self._register_cdr(operation, cdr_content, cdr)
 
-            # Patrón para encontrar applicationResponse
-            pattern = r'<applicationResponse>([^<]+)</applicationResponse>'
-            match = re.search(pattern, response_xml)
+    def _register_cdr(self, operation, cdr_content, cdr):
+        """Guardar el CDR y registrar en la operación el estado que indica"""
+        # Guardar CDR
+        if operation.signed_xml_file_path:
+            cdr_filename = f"R-{os.path.basename(operation.signed_xml_file_path).replace('.xml', '.zip')}"
+        else:
+            cdr_filename = f"R-{self.company.ruc}-{operation.document.code}-{operation.serial}-{operation.number}.zip"
+        cdr_path = BillingFileManager.get_file_path(
+            self.company.ruc, 'CDR', cdr_filename
+        )
+        self._save_artifact(cdr_path, cdr_content)
+        logger.info(f"CDR guardado en: {cdr_path}")
 
-            if not match:
-                # Intentar con namespace
-                pattern = r'<\w+:applicationResponse>([^<]+)</\w+:applicationResponse>'
-                match = re.search(pattern, response_xml)
+        values = {
+            'sunat_response_code': cdr.response_code,
+            'sunat_response_description': cdr.full_description() or 'Procesado por SUNAT',
+            'cdr_file_path': cdr_path,
+        }
+        if cdr.is_accepted:
+            # Errores de envíos anteriores (p. ej. timeout antes de recuperar el CDR)
+            values['sunat_error_code'] = None
+            values['sunat_error_description'] = None
+
+        logger.info(f"Código SUNAT: {cdr.response_code} ({cdr.reference_id})")
+        logger.info(f"Descripción: {cdr.description}")
+
+        if cdr.billing_status == 'ACCEPTED':
+            logger.info("Documento ACEPTADO por SUNAT")
+        elif cdr.billing_status == 'ACCEPTED_WITH_OBSERVATIONS':
+            logger.info(f"Documento ACEPTADO CON OBSERVACIONES: {len(cdr.notes)} notas")
+        else:
+            logger.warning(f"Documento RECHAZADO: {cdr.response_code} - {cdr.description}")
 
-            if match:
-                app_response_text = match.group(1).strip()
-                logger.info(f"ApplicationResponse encontrado, longitud: {len(app_response_text)}")
+        transition(operation, cdr.billing_status, **values)
+        return True
 
-                # Decodificar base64
-                try:
-                    cdr_content = base64.b64decode(app_response_text)
-                    logger.info(f"CDR decodificado, tamaño: {len(cdr_content)} bytes")
-                except Exception as e:
-                    logger.error(f"Error decodificando base64: {str(e)}")
-                    raise Exception(f"Error decodificando respuesta: {str(e)}")
-
-                # Guardar CDR
-                cdr_filename = f"R-{os.path.basename(operation.signed_xml_file_path).replace('.xml', '.zip')}"
-                cdr_path = BillingFileManager.get_file_path(
-                    self.company.ruc, 'CDR', cdr_filename
-                )
-
-                with open(cdr_path, 'wb') as f:
-                    f.write(cdr_content)
-                logger.info(f"CDR guardado en: {cdr_path}")
+    def status_cdr_request(self, operation, key=None):
+        """Petición getStatusCdr del comprobante (para el despachador)"""
+        return DispatchRequest.get_status_cdr(
+            self.company, key, operation.document.code, operation.serial, operation.number
+        )
 
-                # Procesar CDR ZIP
-                import zipfile
-                from lxml import etree
+    def fetch_cdr(self, operation):
+        """
+        Consultar con getStatusCdr el CDR de un comprobante ya registrado en SUNAT.
+
+        Returns:
+            True si SUNAT devolvió el CDR (la operación queda con su estado),
+            False si el comprobante no existe en SUNAT
+        """
+        request = self.status_cdr_request(operation)
+        response_text = post_envelope(self.company.environment, request.build(), consult=True)
+        return self._process_status_cdr(response_text, operation)
+
+    def handle_status_cdr_result(self, result, operation):
+        """Procesar la respuesta de getStatusCdr obtenida por el despachador"""
+        if result.error:
+            raise result.exception or Exception(result.error)
+        return self._process_status_cdr(result.response_text, operation)
+
+    def _process_status_cdr(self, response_text, operation):
+        response = parse_soap_response(response_text)
+        if response.is_fault:
+            raise SunatResponseError(f"Error SUNAT: {response.faultstring or response.faultcode}")
+
+        cdr_content = response.cdr_bytes('content')
+        if cdr_content is None:
+            logger.info(f"getStatusCdr {operation}: {response.statusCode} - {response.statusMessage}")
+            return False
 
-                try:
-                    with zipfile.ZipFile(cdr_path, 'r') as zip_ref:
-                        xml_files = [f for f in zip_ref.namelist() if f.endswith('.xml')]
-
-                        if xml_files:
-                            with zip_ref.open(xml_files[0]) as xml_file:
-                                cdr_content_xml = xml_file.read()
-
-                                # Buscar ResponseCode con regex simple
-                                code_pattern = r'<(?:\w+:)?ResponseCode>(\d+)</(?:\w+:)?ResponseCode>'
-                                code_match = re.search(code_pattern, cdr_content_xml.decode('utf-8'))
-
-                                desc_pattern = r'<(?:\w+:)?Description>([^<]+)</(?:\w+:)?Description>'
-                                desc_match = re.search(desc_pattern, cdr_content_xml.decode('utf-8'))
-
-                                if code_match:
-                                    response_code = code_match.group(1)
-                                    response_desc = desc_match.group(1) if desc_match else 'Procesado por SUNAT'
-
-                                    operation.sunat_response_code = response_code
-                                    operation.sunat_response_description = response_desc
-                                    operation.cdr_file_path = cdr_path
-
-                                    logger.info(f"Código SUNAT: {response_code}")
-                                    logger.info(f"Descripción: {response_desc}")
-
-                                    # Extraer hash
-                                    if operation.signed_xml_file_path:
-                                        try:
-                                            with open(operation.signed_xml_file_path, 'r') as f:
-                                                signed_content = f.read()
-                                            hash_pattern = r'<(?:\w+:)?DigestValue>([^<]+)</(?:\w+:)?DigestValue>'
-                                            hash_match = re.search(hash_pattern, signed_content)
-                                            if hash_match:
-                                                operation.hash_code = hash_match.group(1)
-                                        except:
-                                            pass
-
-                                    # Determinar estado
-                                    if response_code == '0':
-                                        operation.billing_status = 'ACCEPTED'
-                                        logger.info("Documento ACEPTADO por SUNAT")
-                                    elif response_code.startswith('0'):
-                                        operation.billing_status = 'ACCEPTED_WITH_OBSERVATIONS'
-                                        logger.info(f"Documento ACEPTADO CON OBSERVACIONES: {response_code}")
-                                    else:
-                                        operation.billing_status = 'REJECTED'
-                                        logger.warning(f"Documento RECHAZADO: {response_code} - {response_desc}")
-
-                                    operation.save()
-                                    return True
-                                else:
-                                    # Si no hay código, asumir aceptado
-                                    logger.warning("No se encontró ResponseCode, asumiendo aceptado")
-                                    operation.billing_status = 'ACCEPTED'
-                                    operation.sunat_response_code = '0'
-                                    operation.sunat_response_description = 'Aceptado por SUNAT'
-                                    operation.cdr_file_path = cdr_path
-                                    operation.save()
-                                    return True
-                        else:
-                            logger.error("No hay archivos XML en el CDR")
-                            # Aún así, marcar como aceptado si llegamos aquí
-                            operation.billing_status = 'ACCEPTED'
-                            operation.sunat_response_code = '0'
-                            operation.sunat_response_description = 'Procesado por SUNAT'
-                            operation.cdr_file_path = cdr_path
-                            operation.save()
-                            return True
-
-                except zipfile.BadZipFile:
-                    logger.error("CDR no es un ZIP válido")
-                    # Intentar procesarlo como XML directo
-                    try:
-                        # Buscar ResponseCode directamente en el contenido
-                        code_pattern = r'<(?:\w+:)?ResponseCode>(\d+)</(?:\w+:)?ResponseCode>'
-                        code_match = re.search(code_pattern, cdr_content.decode('utf-8'))
-
-                        if code_match:
-                            operation.billing_status = 'ACCEPTED' if code_match.group(1) == '0' else 'REJECTED'
-                            operation.sunat_response_code = code_match.group(1)
-                            operation.sunat_response_description = 'Procesado por SUNAT'
-                            operation.save()
-                            return True
-                    except:
-                        pass
-
-                    # Si todo falla, asumir aceptado
-                    operation.billing_status = 'ACCEPTED'
-                    operation.sunat_response_code = '0'
-                    operation.sunat_response_description = 'Procesado por SUNAT (CDR no estándar)'
-                    operation.save()
-                    return True
-            else:
-                # Verificar si hay SOAP Fault
-                if 'Fault' in response_xml and 'faultstring' in response_xml:
-                    fault_pattern = r'<faultstring>([^<]+)</faultstring>'
-                    fault_match = re.search(fault_pattern, response_xml)
-                    if fault_match:
-                        error_msg = f"Error SUNAT: {fault_match.group(1)}"
-                        logger.error(error_msg)
-                        raise Exception(error_msg)
-
-                # Si no hay error y llegamos hasta aquí con HTTP 200, asumir éxito
-                if 'HTTP/1.1 200' in str(response_xml) or len(response_xml) < 1000:
-                    logger.warning("Respuesta corta o no estándar, pero HTTP 200 - asumiendo éxito")
-                    operation.billing_status = 'ACCEPTED'
-                    operation.sunat_response_code = '0'
-                    operation.sunat_response_description = 'Aceptado por SUNAT (respuesta no estándar)'
-                    operation.save()
-                    return True
-
-                logger.error("No se pudo procesar la respuesta de SUNAT")
-                logger.error(f"Primeros 500 caracteres: {response_xml[:500]}")
-                raise Exception("Formato de respuesta no reconocido")
+        logger.info(f"CDR recuperado con getStatusCdr para {operation}")
+        return self._register_cdr(operation, cdr_content, parse_cdr(cdr_content))
 
-        except Exception as e:
-            logger.error(f"Error procesando respuesta: {str(e)}")
-
-            # Si hay cualquier error pero fue HTTP 200, marcar como aceptado
-            if "200" in str(response_xml)[:100]:
-                logger.info("HTTP 200 recibido, marcando como aceptado a pesar del error de parsing")
-                operation.billing_status = 'ACCEPTED'
-                operation.sunat_response_code = '0'
-                operation.sunat_response_description = f'Aceptado (error parsing: {str(e)[:100]})'
-                operation.save()
+    def _recover_duplicate(self, operation, error):
+        """SUNAT ya registró el documento: recuperar su CDR en lugar de reenviarlo"""
+        logger.warning(f"{operation} ya fue informado a SUNAT ({str(error)}), consultando CDR...")
+        try:
+            if self.fetch_cdr(operation):
                 return True
-
-            raise
+            logger.error(f"SUNAT indica duplicado pero no devolvió el CDR de {operation}")
+        except Exception as e:
+            logger.error(f"No se pudo recuperar el CDR de {operation}: {str(e)}")
+        return False
 
     def _handle_error(self, operation, error_message):
         """Manejar errores de envío"""
-        operation.billing_status = 'ERROR'
-        operation.sunat_error_description = error_message
-        operation.retry_count = (operation.retry_count or 0) + 1
-        operation.last_retry_at = django_timezone.now()
-        operation.save()
+        transition(
+            operation, 'ERROR',
+            sunat_error_description=error_message,
+            retry_count=(operation.retry_count or 0) + 1,
+            last_retry_at=django_timezone.now(),
+        )
 
 
 class BillingService:
     """Servicio principal de facturación electrónica"""
 
-    def __init__(self, operation_id):
+    def __init__(self, operation_id, operation=None):
         from operations.models import Operation
-        self.operation = Operation.objects.get(id=operation_id)
+        # Se puede recibir la operación ya cargada (procesamiento por lote)
+        self.operation = operation if operation is not None else Operation.objects.get(id=operation_id)
         self.company = self.operation.company
 
-    def process_electronic_billing(self):
-        """Procesar facturación electrónica completa"""
+    def process_electronic_billing(self, regenerate=False):
+        """
+        Procesar facturación electrónica completa.
+
+        Un reintento retoma desde el último punto de control válido (envío o
+        firma) sin volver a generar ni firmar; con regenerate=True se hace
+        siempre el circuito completo.
+        """
         try:
             logger.info(f"Iniciando facturación para: {self.operation}")
 
             # 1. Validar datos
             self._validate_data()
 
-            # 2. Generar XML
-            xml_generator = XMLGenerator(self.operation, self.company)
-            xml_path = xml_generator.generate_xml()
+            checkpoint = BillingCheckpoint(self.operation)
+            signing = None if regenerate else checkpoint.signed()
 
-            # 3. Firmar XML
-            signer = XMLSigner(self.company)
-            signed_xml_path = signer.sign_xml(xml_path)
-            self.operation.signed_xml_file_path = signed_xml_path
-            self.operation.save()
+            if signing is not None:
+                # XML firmado aún válido: solo falta enviarlo
+                success = self._send_signed(SunatConnector(self.company), signing)
+            elif getattr(settings, 'BILLING_IN_MEMORY_PIPELINE', True):
+                success = self._process_in_memory(checkpoint, regenerate)
+            else:
+                # 2. Generar XML (o retomar el ya generado)
+                generated = None if regenerate else checkpoint.generated()
+                if generated is not None:
+                    xml_path, _, document = generated
+                else:
+                    xml_generator = XMLGenerator(self.operation, self.company)
+                    xml_path = xml_generator.generate_xml()
+                    document = xml_generator.document
+                    checkpoint.record_generated(xml_generator.xml_content)
 
-            # 4. Enviar a SUNAT
-            self.operation.billing_status = 'PROCESSING'
-            self.operation.save()
+                self._preflight(document)
 
-            connector = SunatConnector(self.company)
-            success = connector.send_document(signed_xml_path, self.operation)
+                # 3. Firmar XML (sobre el árbol en memoria)
+                signer = XMLSigner(self.company)
+                signing = signer.sign_xml(xml_path, document=document)
+                signed_xml_path = signing.signed_path
+                self.operation.signed_xml_file_path = signed_xml_path
+                self.operation.hash_code = signing.digest_value
+                checkpoint.record_signed(signing.signed_xml)
+
+                # 4. Enviar a SUNAT
+                transition(self.operation, 'PROCESSING', fields=SUBMISSION_FIELDS)
+
+                connector = SunatConnector(self.company)
+                success = connector.send_document(signed_xml_path, self.operation)
 
             if success:
                 logger.info(f"Facturación completada exitosamente: {self.operation}")
@@ -1227,11 +1348,297 @@ class BillingService:
                 return False
 
         except Exception as e:
-            logger.error(f"Error crítico en facturación: {str(e)}")
-            self.operation.billing_status = 'ERROR'
-            self.operation.sunat_error_description = str(e)
-            self.operation.save()
-            return False
+            return self._handle_failure(e)
+
+    @classmethod
+    def process_batch(cls, operation_ids, dispatcher=None):
+        """
+        Facturar un lote de operaciones.
+
+        El XML se genera por lote (número de consultas constante), la firma
+        se reparte entre varios procesos con SigningPool y los envíos a SUNAT
+        se despachan en paralelo con SunatDispatcher; las respuestas se
+        registran después, fuera del event loop.
+
+        Returns:
+            Diccionario con resultados: 'success' y 'failed'
+        """
+        results = {
+            'success': [],
+            'failed': []
+        }
+
+        # 1 y 2. Generar, validar y firmar (salvo los que ya tienen un XML firmado válido)
+        signed_documents, operation_ids = cls.resume_batch(operation_ids)
+        signed_documents += cls.sign_batch(operation_ids, results)
+
+        # 3. Preparar los envíos (ZIP en memoria y sobre SOAP)
+        submissions = []
+        for service, item, signing, artifacts in signed_documents:
+            try:
+                connector, request = service.prepare_submission(signing)
+            except Exception as e:
+                service._handle_failure(e)
+                BillingFileManager.persist_artifacts(artifacts)
+                results['failed'].append({'id': item['id'], 'document': item['document'], 'error': str(e)})
+                continue
+
+            submissions.append((service, item, connector, artifacts, request))
+
+        # 4. Enviar a SUNAT en paralelo (límite global y por RUC)
+        dispatcher = dispatcher or SunatDispatcher()
+        dispatched = dispatcher.dispatch([submission[4] for submission in submissions])
+
+        # 5. Registrar las respuestas
+        for (service, item, connector, artifacts, _), result in zip(submissions, dispatched):
+            if service.complete_submission(connector, result, artifacts):
+                results['success'].append({'id': item['id'], 'document': item['document']})
+            else:
+                results['failed'].append({
+                    'id': item['id'],
+                    'document': item['document'],
+                    'error': service.operation.sunat_error_description or result.error
+                })
+
+        logger.info(f"Facturación por lote completada: {len(results['success'])} exitosas, "
+                    f"{len(results['failed'])} fallidas")
+
+        return results
+
+    @classmethod
+    def resume_batch(cls, operation_ids):
+        """
+        Separar del lote las operaciones cuyo XML firmado sigue siendo válido
+        (punto de control): se envían sin volver a generar ni firmar.
+
+        Returns:
+            (lista de (service, item, signing, artifacts) como sign_batch,
+            ids que hay que generar y firmar)
+        """
+        from django.db.models import Prefetch
+        from operations.models import Operation, OperationDetail
+
+        if not checkpoints_enabled():
+            return [], list(operation_ids)
+
+        operations = Operation.objects.filter(
+            id__in=operation_ids,
+            signed_xml_hash__isnull=False
+        ).select_related(
+            'company', 'person', 'document'
+        ).prefetch_related(
+            Prefetch('operationdetail_set', queryset=OperationDetail.objects.select_related('product')),
+            'payment_set',
+        )
+
+        resumed = []
+        for operation in operations:
+            signing = BillingCheckpoint(operation).signed()
+            if signing is None:
+                continue
+            service = cls(operation.id, operation=operation)
+            try:
+                service._validate_data()
+            except Exception:
+                # El circuito completo registra el error
+                continue
+            resumed.append((service, {
+                'id': operation.id,
+                'operation': operation,
+                'document': f"{operation.serial}-{operation.number}",
+            }, signing, []))
+
+        resumed_ids = {item['id'] for _, item, _, _ in resumed}
+        if resumed:
+            logger.info(f"Lote: {len(resumed)} operaciones retoman desde el XML firmado")
+        return resumed, [operation_id for operation_id in operation_ids if operation_id not in resumed_ids]
+
+    @classmethod
+    def sign_batch(cls, operation_ids, results):
+        """
+        Generar y firmar un lote sin enviarlo: XML por lote, validación y
+        firma en paralelo con SigningPool. Las operaciones que fallan quedan
+        registradas (estado y results['failed']) con sus archivos guardados.
+
+        Returns:
+            Lista de (service, item, signing, artifacts) de las firmadas;
+            artifacts son los archivos (XML y firmado) aún sin escribir
+        """
+        from operations.services.signing_pool import SigningJob, SigningPool
+
+        generated = XMLGenerator.generate_batch(operation_ids, persist=False)
+        for item in generated['failed']:
+            cls(item['id'], operation=item['operation'])._handle_failure(Exception(item['error']))
+            results['failed'].append({'id': item['id'], 'document': item['document'], 'error': item['error']})
+
+        # 1. Validar datos y XML antes de firmar
+        pending = {}
+        jobs = []
+        for item in generated['success']:
+            service = cls(item['id'], operation=item['operation'])
+            try:
+                service._validate_data()
+                service._preflight(item['tree'])
+            except Exception as e:
+                service._handle_failure(e)
+                BillingFileManager.persist_artifacts([(item['xml_file_path'], item['xml_content'])])
+                results['failed'].append({'id': item['id'], 'document': item['document'], 'error': str(e)})
+                continue
+
+            pending[item['id']] = (service, item)
+            jobs.append(SigningJob(
+                item['id'],
+                service.company.ruc,
+                service.company.environment,
+                os.path.basename(item['xml_file_path']),
+                item['tree']
+            ))
+
+        # 2. Firmar en paralelo
+        signed_documents = []
+        for signed in SigningPool.sign_batch(jobs):
+            service, item = pending[signed['key']]
+            artifacts = [(item['xml_file_path'], item['xml_content'])]
+
+            if signed['error']:
+                service._handle_failure(Exception(signed['error']))
+                BillingFileManager.persist_artifacts(artifacts)
+                results['failed'].append({'id': item['id'], 'document': item['document'], 'error': signed['error']})
+                continue
+
+            signing = signed['result']
+            artifacts.append((signing.signed_path, signing.signed_xml))
+            checkpoint = BillingCheckpoint(service.operation)
+            checkpoint.record_generated(item['xml_content'])
+            checkpoint.record_signed(signing.signed_xml)
+            signed_documents.append((service, item, signing, artifacts))
+
+        return signed_documents
+
+    def send_signed(self, signing, artifacts=()):
+        """
+        Enviar a SUNAT un XML ya firmado (SigningResult, p. ej. del pool de firma).
+        artifacts son archivos pendientes que se guardan junto con los del envío.
+        """
+        connector = SunatConnector(self.company)
+        try:
+            success = self._send_signed(connector, signing)
+            if success:
+                logger.info(f"Facturación completada exitosamente: {self.operation}")
+            return success
+        except Exception as e:
+            return self._handle_failure(e)
+        finally:
+            BillingFileManager.persist_artifacts(list(artifacts) + connector.artifacts)
+
+    def prepare_submission(self, signing):
+        """
+        Registrar el XML firmado y armar la petición sendBill para el despachador.
+
+        Returns:
+            (connector, DispatchRequest)
+        """
+        self.operation.signed_xml_file_path = signing.signed_path
+        self.operation.hash_code = signing.digest_value
+        transition(self.operation, 'PROCESSING', fields=SUBMISSION_FIELDS)
+
+        connector = SunatConnector(self.company)
+        request = connector.prepare_request(signing.signed_path, signing.signed_xml, key=self.operation.id)
+        logger.info(f"Envío preparado: {request.fields[0][1]} ({self.operation})")
+        return connector, request
+
+    def complete_submission(self, connector, result, artifacts=()):
+        """Registrar en la operación la respuesta (DispatchResult) de SUNAT"""
+        try:
+            success = connector.handle_dispatch_result(result, self.operation)
+            if success:
+                logger.info(f"Facturación completada exitosamente: {self.operation}")
+            return success
+        except Exception as e:
+            return self._handle_failure(e)
+        finally:
+            BillingFileManager.persist_artifacts(list(artifacts) + connector.artifacts)
+
+    def _handle_failure(self, error):
+        """Registrar el fallo de facturación en la operación"""
+        try:
+            if isinstance(error, StaleTransition):
+                # Otro proceso cambió la operación: no se pisa su estado
+                logger.warning(str(error))
+                return False
+
+            if isinstance(error, SunatUnavailable):
+                # No se envió: vuelve a la cola sin consumir reintentos
+                logger.warning(f"{self.operation} queda pendiente: {str(error)}")
+                transition(
+                    self.operation, 'PENDING',
+                    sunat_error_description=str(error),
+                    next_attempt_at=unavailable_until(error.retry_after)
+                )
+                return False
+
+            if isinstance(error, UBLValidationError):
+                # Rechazo local: no se envía a SUNAT ni se consume un reintento
+                logger.error(f"XML inválido, no se envía a SUNAT: {self.operation} - {error.errors[0]['message']}")
+                transition(
+                    self.operation, 'INVALID', sunat_error_code='XSD', sunat_error_description=error.format()
+                )
+                return False
+
+            logger.error(f"Error crítico en facturación: {str(error)}")
+            transition(self.operation, 'ERROR', sunat_error_description=str(error))
+        except StaleTransition as e:
+            logger.warning(str(e))
+        return False
+
+    def _process_in_memory(self, checkpoint=None, regenerate=False):
+        """
+        Generar, firmar, comprimir y enviar sin pasar por disco.
+        Cada etapa entrega bytes a la siguiente; los archivos (XML, FIRMA,
+        ZIP, respuesta y CDR) se guardan al final con BillingFileManager,
+        incluso si el envío falla, en línea o en segundo plano según
+        BILLING_ASYNC_ARTIFACTS.
+        """
+        artifacts = []
+        connector = SunatConnector(self.company)
+        checkpoint = checkpoint or BillingCheckpoint(self.operation)
+        try:
+            # 2. Generar XML (o retomar el ya generado si sigue siendo válido)
+            generated = None if regenerate else checkpoint.generated()
+            if generated is not None:
+                xml_path, _, document = generated
+            else:
+                xml_generator = XMLGenerator(self.operation, self.company)
+                xml_path = xml_generator.generate_xml(commit=False, persist=False)
+                document = xml_generator.document
+                artifacts.append((xml_path, xml_generator.xml_content))
+                checkpoint.record_generated(xml_generator.xml_content)
+
+            self._preflight(document)
+
+            # 3. Firmar XML (sobre el árbol en memoria)
+            signer = XMLSigner(self.company)
+            signing = signer.sign_xml(xml_path, document=document, persist=False)
+            artifacts.append((signing.signed_path, signing.signed_xml))
+            checkpoint.record_signed(signing.signed_xml)
+
+            # 4. Enviar a SUNAT
+            return self._send_signed(connector, signing)
+        finally:
+            BillingFileManager.persist_artifacts(artifacts + connector.artifacts)
+
+    def _send_signed(self, connector, signing):
+        """Registrar el XML firmado y su hash en una sola escritura y enviarlo desde memoria"""
+        self.operation.signed_xml_file_path = signing.signed_path
+        self.operation.hash_code = signing.digest_value
+        transition(self.operation, 'PROCESSING', fields=SUBMISSION_FIELDS)
+
+        return connector.send_document(signing.signed_path, self.operation, signed_xml=signing.signed_xml)
+
+    def _preflight(self, document):
+        """Validar el XML contra el XSD antes de firmar (si BILLING_XSD_VALIDATION)"""
+        if xsd_validation_enabled():
+            UBLValidator.check(document)
 
     def _validate_data(self):
         """Validar datos necesarios para facturación"""
@@ -0,0 +1,170 @@
+# operations/services/billing_state.py
+"""
+Transiciones de estado de facturación.
+
+Todo cambio de billing_status (junto con los campos que lo acompañan) se
+aplica con un solo UPDATE condicional:
+
+    UPDATE operations_operation
+    SET <solo las columnas cambiadas>, billing_status_at = ahora, updated_at = ahora
+    WHERE id = <operación> AND billing_status IN (<estado(s) esperado(s)>)
+
+A diferencia de operation.save() no reescribe las demás columnas (totales,
+rutas de anulación, etc.) ni pisa un cambio hecho por otro proceso: si el
+demonio, un worker de Celery o el sistema web ya movió la operación a otro
+estado el UPDATE no afecta filas y se lanza StaleTransition.
+
+Los pasos a ERROR o REJECTED programan next_attempt_at con la política de
+reintentos de la empresa (retry_policy).
+
+Cada cambio de estado se registra en BillingStatusTransition con el tiempo
+que la operación permaneció en el estado anterior (se desactiva con
+BILLING_TRANSITION_LOG = False).
+
+transition_many aplica el mismo cambio a un grupo (boletas de un resumen,
+reservas vencidas) con un UPDATE condicional y registra el historial con un
+solo bulk_create.
+"""
+import logging
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from operations.services.retry_policy import RETRY_STATUSES, next_attempt_at
+
+logger = logging.getLogger(__name__)
+
+
+class StaleTransition(Exception):
+    """La operación ya no está en el estado esperado: otro proceso la cambió"""
+
+    def __init__(self, operation, expected, status):
+        self.operation = operation
+        self.expected = expected
+        self.status = status
+        super().__init__(f"La operación {operation} ya no está en {'/'.join(expected)} "
+                         f"(no se pasó a {status or 'sin cambio de estado'})")
+
+
+def is_log_enabled():
+    return getattr(settings, 'BILLING_TRANSITION_LOG', True)
+
+
+def transition(operation, status=None, expected=None, fields=(), **values):
+    """
+    Aplicar un cambio de estado (y/o de campos) a una operación.
+
+    Args:
+        operation: Operation; también se actualiza en memoria
+        status: nuevo billing_status (None: solo se guardan campos, con la
+            misma condición sobre el estado)
+        expected: estado o estados previos admitidos; por defecto el que la
+            operación tiene en memoria
+        fields: campos ya asignados en la operación que también se guardan
+        values: campos a asignar y guardar
+
+    Returns:
+        La operación
+
+    Raises:
+        StaleTransition: si la operación ya no está en el estado esperado
+    """
+    from operations.models import Operation, BillingStatusTransition
+
+    if expected is None:
+        expected = (operation.billing_status,)
+    elif isinstance(expected, str):
+        expected = (expected,)
+    else:
+        expected = tuple(expected)
+
+    now = timezone.now()
+    previous = expected[0] if len(expected) == 1 else operation.billing_status
+    status_changed = status is not None and status != previous
+
+    changes = {name: getattr(operation, name) for name in fields}
+    changes.update(values)
+    if status is not None:
+        changes['billing_status'] = status
+    if status in RETRY_STATUSES and 'next_attempt_at' not in changes:
+        # Toda falla programa su reintento según la política de la empresa
+        changes['next_attempt_at'] = next_attempt_at(
+            operation.company, changes.get('retry_count', operation.retry_count), now
+        )
+    if status_changed:
+        changes['billing_status_at'] = now
+    changes['updated_at'] = now
+
+    updated = Operation.objects.filter(pk=operation.pk, billing_status__in=expected).update(**changes)
+    if not updated:
+        raise StaleTransition(operation, expected, status)
+
+    previous_at = operation.billing_status_at
+    for name, value in changes.items():
+        setattr(operation, name, value)
+
+    if status_changed:
+        logger.debug(f"Operación {operation}: {previous} -> {status}")
+        if is_log_enabled():
+            BillingStatusTransition.objects.create(
+                operation_id=operation.pk,
+                from_status=previous,
+                to_status=status,
+                duration=(now - previous_at).total_seconds() if previous_at else None,
+            )
+
+    return operation
+
+
+def transition_many(queryset, status, expected, **values):
+    """
+    Aplicar un cambio de estado a las operaciones del queryset que siguen en
+    el estado esperado (las demás se omiten sin error).
+
+    A diferencia de transition(), next_attempt_at no se calcula: el llamador
+    lo indica para los estados de reintento (p. ej. uno para todo el resumen).
+
+    Args:
+        queryset: operaciones candidatas
+        status: nuevo billing_status
+        expected: estado o estados previos admitidos
+        values: campos a asignar (admite expresiones F)
+
+    Returns:
+        Ids de las operaciones que cambiaron de estado
+    """
+    from operations.models import Operation, BillingStatusTransition
+
+    expected = (expected,) if isinstance(expected, str) else tuple(expected)
+    now = timezone.now()
+    changes = dict(values, billing_status=status, billing_status_at=now, updated_at=now)
+    lock_of = ('self',) if connection.features.has_select_for_update_of else ()
+
+    with transaction.atomic():
+        # Las filas quedan bloqueadas hasta el UPDATE: el historial corresponde
+        # exactamente a las operaciones que cambiaron
+        rows = list(
+            queryset.filter(billing_status__in=expected).order_by().select_for_update(of=lock_of).values_list(
+                'id', 'billing_status', 'billing_status_at'
+            )
+        )
+        if not rows:
+            return []
+        ids = [operation_id for operation_id, _, _ in rows]
+        Operation.objects.filter(id__in=ids, billing_status__in=expected).update(**changes)
+
+        if is_log_enabled():
+            BillingStatusTransition.objects.bulk_create([
+                BillingStatusTransition(
+                    operation_id=operation_id,
+                    from_status=previous,
+                    to_status=status,
+                    duration=(now - previous_at).total_seconds() if previous_at else None,
+                )
+                for operation_id, previous, previous_at in rows
+                if previous != status
+            ])
+
+    logger.debug(f"{len(ids)} operaciones: {'/'.join(expected)} -> {status}")
+    return ids
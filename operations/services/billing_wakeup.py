@@ -0,0 +1,114 @@
+# operations/services/billing_wakeup.py
+"""
+Aviso al demonio de facturación cuando hay trabajo nuevo.
+
+Al confirmarse la transacción de una operación nueva o de una anulación
+(CreateOperation, CancelOperation) se agrega un aviso a una lista de Redis
+(BILLING_WAKEUP_KEY, en la conexión del caché 'billing'). Entre ciclos el
+demonio espera en esa lista con BRPOP usando --interval como tiempo máximo:
+un documento nuevo se envía en menos de un segundo en lugar de esperar
+hasta el siguiente ciclo, y un demonio sin trabajo no recorre las tablas.
+
+Se usa una lista y no pub/sub: los avisos emitidos mientras el demonio
+procesa un ciclo (o se reinicia) quedan en la lista y no se pierden. Los
+avisos se agrupan: un ciclo atiende todos los que estén en cola.
+
+Sin Redis (o con BILLING_WAKEUP_ENABLED = False) no se avisa y el demonio
+vuelve a esperar el intervalo completo.
+"""
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# Avisos que se guardan como máximo (uno basta para despertar al demonio)
+MAX_PENDING_EVENTS = 1000
+
+
+def is_enabled():
+    return getattr(settings, 'BILLING_WAKEUP_ENABLED', True)
+
+
+def wakeup_key():
+    return getattr(settings, 'BILLING_WAKEUP_KEY', 'billing:wakeup')
+
+
+def _client():
+    """Cliente Redis del caché 'billing' o None si no hay Redis"""
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection('billing')
+    except Exception as e:
+        logger.debug(f"Aviso de facturación sin Redis: {str(e)}")
+        return None
+
+
+def notify(reason, operation_id=None):
+    """Publicar un aviso de trabajo nuevo (nunca lanza excepciones)"""
+    if not is_enabled():
+        return False
+    client = _client()
+    if client is None:
+        return False
+    try:
+        event = json.dumps({'reason': reason, 'operation_id': operation_id, 'at': time.time()})
+        pipe = client.pipeline()
+        pipe.lpush(wakeup_key(), event)
+        pipe.ltrim(wakeup_key(), 0, MAX_PENDING_EVENTS - 1)
+        pipe.execute()
+        return True
+    except Exception as e:
+        logger.warning(f"No se pudo avisar al demonio de facturación: {str(e)}")
+        return False
+
+
+def notify_on_commit(reason, operation_id=None):
+    """Publicar el aviso cuando se confirme la transacción en curso"""
+    if is_enabled():
+        transaction.on_commit(lambda: notify(reason, operation_id))
+
+
+def wait(timeout):
+    """
+    Esperar un aviso hasta timeout segundos.
+
+    Returns:
+        Lista de avisos recibidos (vacía si se cumplió el tiempo). Sin Redis
+        simplemente espera timeout segundos.
+    """
+    client = _client() if is_enabled() else None
+    if client is None:
+        time.sleep(timeout)
+        return []
+
+    try:
+        item = client.brpop(wakeup_key(), timeout=max(1, int(timeout)))
+    except Exception as e:
+        logger.warning(f"Espera de avisos sin Redis ({str(e)}), se usa el intervalo")
+        time.sleep(timeout)
+        return []
+
+    if item is None:
+        return []
+
+    # Agrupar los demás avisos en cola: un solo ciclo los atiende a todos
+    raw = [item[1]]
+    try:
+        pipe = client.pipeline()
+        pipe.lrange(wakeup_key(), 0, -1)
+        pipe.delete(wakeup_key())
+        raw += pipe.execute()[0]
+    except Exception:
+        pass
+
+    events = []
+    for value in raw:
+        try:
+            events.append(json.loads(value))
+        except (TypeError, ValueError):
+            continue
+    return events
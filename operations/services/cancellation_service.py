@@ -4,7 +4,6 @@
 # operations/services/cancellation_service.py
 import base64
 import os
-import zipfile
 import requests
 from decimal import Decimal
 from lxml import etree
@@ -13,6 +12,13 @@ from django.utils import timezone
 import logging
 from datetime import datetime
 
+from operations.services.summary_service import (
+    CONDITION_VOID, build_summary_xml, customer_doc_type, customer_document, format_decimal,
+    reserve_summary_correlative, send_summary, summary_identifier, summary_line
+)
+from operations.services.sunat_http import get_session
+from operations.services.sunat_response import parse_soap_response
+from operations.services.sunat_soap import GET_STATUS, SOAP_HEADERS, build_envelope, get_credentials, get_service_url
 from operations.views import get_peru_date
 
 logger = logging.getLogger(__name__)
@@ -221,88 +227,20 @@ class CancellationService:
     def _generate_summary_xml(self, reason_code, description):
         """Generar XML de Resumen Diario (para Boletas) - CORREGIDO"""
         current_date = get_peru_date()
-        correlative = self._get_next_cancellation_correlative('RC')
+        correlative = reserve_summary_correlative(self.company, current_date)
+        summary_id = summary_identifier(current_date, correlative)
 
-        filename = f"{self.company.ruc}-RC-{current_date.strftime('%Y%m%d')}-{correlative:05d}"
-
-        # Calcular totales
-        total_amount = Decimal(str(self.operation.total_amount))
-        taxable_amount = Decimal(str(self.operation.total_taxable))
-        igv_amount = Decimal(str(self.operation.igv_amount))
+        filename = f"{self.company.ruc}-{summary_id}"
 
         # Estado: 3 = Anulado
-        status = '3'
+        line = summary_line(
+            self.operation, 1, CONDITION_VOID,
+            payments=[('01', Decimal(str(self.operation.total_amount)))]
+        )
+        xml_content = build_summary_xml(self.company, summary_id, self.operation.emit_date, current_date, [line])
 
-        # ⚠️ CORRECCIÓN: Cerrar correctamente las etiquetas XML
-        xml_content = f'''<?xml version="1.0" encoding="ISO-8859-1"?>
-<SummaryDocuments xmlns="urn:sunat:names:specification:ubl:peru:schema:xsd:SummaryDocuments-1" xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2" xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2" xmlns:ext="urn:oasis:names:specification:ubl:schema:xsd:CommonExtensionComponents-2" xmlns:sac="urn:sunat:names:specification:ubl:peru:schema:xsd:SunatAggregateComponents-1" xmlns:ds="http://www.w3.org/2000/09/xmldsig#">
-<ext:UBLExtensions>
-<ext:UBLExtension>
-<ext:ExtensionContent></ext:ExtensionContent>
-</ext:UBLExtension>
-</ext:UBLExtensions>
-<cbc:UBLVersionID>2.0</cbc:UBLVersionID>
-<cbc:CustomizationID>1.1</cbc:CustomizationID>
-<cbc:ID>RC-{current_date.strftime('%Y%m%d')}-{correlative:05d}</cbc:ID>
-<cbc:ReferenceDate>{self.operation.emit_date}</cbc:ReferenceDate>
-<cbc:IssueDate>{current_date}</cbc:IssueDate>
-<cac:Signature>
-<cbc:ID>{self.company.ruc}</cbc:ID>
-<cac:SignatoryParty>
-<cac:PartyIdentification>
-<cbc:ID>{self.company.ruc}</cbc:ID>
-</cac:PartyIdentification>
-<cac:PartyName>
-<cbc:Name>{self.company.denomination}</cbc:Name>
-</cac:PartyName>
-</cac:SignatoryParty>
-<cac:DigitalSignatureAttachment>
-<cac:ExternalReference>
-<cbc:URI>{self.company.ruc}</cbc:URI>
-</cac:ExternalReference>
-</cac:DigitalSignatureAttachment>
-</cac:Signature>
-<cac:AccountingSupplierParty>
-<cbc:CustomerAssignedAccountID>{self.company.ruc}</cbc:CustomerAssignedAccountID>
-<cbc:AdditionalAccountID>6</cbc:AdditionalAccountID>
-<cac:Party>
-<cac:PartyLegalEntity>
-<cbc:RegistrationName>{self.company.denomination}</cbc:RegistrationName>
-</cac:PartyLegalEntity>
-</cac:Party>
-</cac:AccountingSupplierParty>
-<sac:SummaryDocumentsLine>
-<cbc:LineID>1</cbc:LineID>
-<cbc:DocumentTypeCode>03</cbc:DocumentTypeCode>
-<cbc:ID>{self.operation.serial}-{self.operation.number}</cbc:ID>
-<cac:AccountingCustomerParty>
-<cbc:CustomerAssignedAccountID>{self._get_customer_document()}</cbc:CustomerAssignedAccountID>
-<cbc:AdditionalAccountID>{self._get_customer_doc_type()}</cbc:AdditionalAccountID>
-</cac:AccountingCustomerParty>
-<cac:Status>
-<cbc:ConditionCode>{status}</cbc:ConditionCode>
-</cac:Status>
-<sac:TotalAmount currencyID="{self.operation.currency}">{self._format_decimal(total_amount)}</sac:TotalAmount>
-<sac:BillingPayment>
-<cbc:PaidAmount currencyID="{self.operation.currency}">{self._format_decimal(total_amount)}</cbc:PaidAmount>
-<cbc:InstructionID>01</cbc:InstructionID>
-</sac:BillingPayment>
-<cac:TaxTotal>
-<cbc:TaxAmount currencyID="{self.operation.currency}">{self._format_decimal(igv_amount)}</cbc:TaxAmount>
-<cac:TaxSubtotal>
-<cbc:TaxableAmount currencyID="{self.operation.currency}">{self._format_decimal(taxable_amount)}</cbc:TaxableAmount>
-<cbc:TaxAmount currencyID="{self.operation.currency}">{self._format_decimal(igv_amount)}</cbc:TaxAmount>
-<cac:TaxCategory>
-<cac:TaxScheme>
-<cbc:ID>1000</cbc:ID>
-<cbc:Name>IGV</cbc:Name>
-<cbc:TaxTypeCode>VAT</cbc:TaxTypeCode>
-</cac:TaxScheme>
-</cac:TaxCategory>
-</cac:TaxSubtotal>
-</cac:TaxTotal>
-</sac:SummaryDocumentsLine>
-</SummaryDocuments>'''
+        # El correlativo queda registrado en la operación (serie RC compartida con los resúmenes de boletas)
+        self.operation.low_number = correlative
 
         # Guardar XML
         xml_path = self.file_manager.get_file_path(
@@ -333,51 +271,14 @@ class CancellationService:
         Obtener documento del cliente de forma segura
         Returns '00000000' para clientes varios o sin documento
         """
-        try:
-            if (self.operation.person and
-                    hasattr(self.operation.person, 'document') and
-                    self.operation.person.document and
-                    self.operation.person.document.strip()):
-
-                doc = self.operation.person.document.strip()
-                # Validar que no sea una cadena vacía o solo ceros
-                if doc and doc != "0" * len(doc):
-                    return doc
-        except (AttributeError, TypeError):
-            pass
-
-        # Valor por defecto para clientes varios
-        return "00000000"
+        return customer_document(self.operation)
 
     def _get_customer_doc_type(self):
         """
         Obtener tipo de documento del cliente de forma segura
         Returns '0' para clientes varios o sin documento específico
         """
-        try:
-            document = self._get_customer_document()
-
-            # Si es el documento por defecto, retornar tipo 0
-            if document == "00000000":
-                return "0"
-
-            # Determinar por longitud
-            if len(document) == 8:
-                return "1"  # DNI
-            elif len(document) == 11:
-                return "6"  # RUC
-
-            # Intentar obtener del person_type si existe
-            if (self.operation.person and
-                    hasattr(self.operation.person, 'person_type') and
-                    self.operation.person.person_type):
-                return str(self.operation.person.person_type)
-
-        except (AttributeError, TypeError, ValueError):
-            pass
-
-        # Valor por defecto
-        return "0"
+        return customer_doc_type(self.operation)
 
     def _get_person_doc_type(self):
         """Obtener tipo de documento del cliente"""
@@ -385,11 +286,7 @@ class CancellationService:
 
     def _format_decimal(self, value, decimals=2):
         """Formatear decimal"""
-        if value is None:
-            return f"0.{'0' * decimals}"
-        if not isinstance(value, Decimal):
-            value = Decimal(str(value))
-        return format(value, f'.{decimals}f')
+        return format_decimal(value, decimals)
 
     def _get_next_cancellation_correlative(self, prefix):
         """Obtener próximo correlativo de anulación"""
@@ -422,7 +319,7 @@ class CancellationService:
         from .billing_service import XMLSigner
 
         signer = XMLSigner(self.company)
-        signed_path = signer.sign_xml(xml_path)
+        signed_path = signer.sign_xml(xml_path).signed_path
 
         # Mover a carpeta BAJA/FIRMA
         filename = os.path.basename(signed_path)
@@ -447,77 +344,7 @@ class CancellationService:
     def _send_summary_to_sunat(self, signed_xml_path):
         """Enviar resumen/baja a SUNAT y obtener ticket"""
         try:
-            # Crear ZIP
-            zip_path = self._create_zip(signed_xml_path)
-
-            # Leer contenido
-            with open(zip_path, 'rb') as f:
-                zip_content = base64.b64encode(f.read()).decode()
-
-            filename = os.path.basename(zip_path)
-
-            # Configuración según ambiente
-            if self.company.environment == 'BETA':
-                wsdl_url = 'https://e-beta.sunat.gob.pe/ol-ti-itcpfegem-beta/billService'
-                username = f"{self.company.ruc}MODDATOS"
-                password = "moddatos"
-            else:
-                wsdl_url = 'https://e-factura.sunat.gob.pe/ol-ti-itcpfegem/billService'
-                username = f"{self.company.ruc}{self.company.sunat_username}"
-                password = self.company.sunat_password
-
-            # Construir SOAP para sendSummary
-            soap_xml = f'''<?xml version="1.0" encoding="UTF-8"?>
-<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:ser="http://service.sunat.gob.pe" xmlns:wsse="http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-secext-1.0.xsd">
-<soapenv:Header>
-<wsse:Security>
-<wsse:UsernameToken>
-<wsse:Username>{username}</wsse:Username>
-<wsse:Password>{password}</wsse:Password>
-</wsse:UsernameToken>
-</wsse:Security>
-</soapenv:Header>
-<soapenv:Body>
-<ser:sendSummary>
-<fileName>{filename}</fileName>
-<contentFile>{zip_content}</contentFile>
-</ser:sendSummary>
-</soapenv:Body>
-</soapenv:Envelope>'''
-
-            headers = {
-                'Content-Type': 'text/xml; charset=utf-8',
-                'SOAPAction': '""',
-            }
-
-            logger.info(f"Enviando resumen/baja a SUNAT: {filename}")
-
-            response = requests.post(
-                wsdl_url,
-                data=soap_xml.encode('utf-8'),
-                headers=headers,
-                timeout=60,
-                verify=True
-            )
-
-            if response.status_code == 200:
-                # Extraer ticket de la respuesta
-                import re
-                ticket_pattern = r'<ticket>([^<]+)</ticket>'
-                match = re.search(ticket_pattern, response.text)
-
-                if match:
-                    ticket = match.group(1)
-                    logger.info(f"Ticket recibido: {ticket}")
-                    return ticket
-                else:
-                    logger.error("No se encontró ticket en la respuesta")
-                    logger.error(f"Respuesta: {response.text[:500]}")
-                    raise Exception("No se recibió ticket de SUNAT")
-            else:
-                logger.error(f"Error HTTP {response.status_code}: {response.text[:500]}")
-                raise Exception(f"Error enviando a SUNAT: HTTP {response.status_code}")
-
+            return send_summary(self.company, signed_xml_path)
         except Exception as e:
             logger.error(f"Error enviando resumen/baja: {str(e)}")
             raise
@@ -527,38 +354,10 @@ class CancellationService:
         try:
             logger.info(f"Consultando estado del ticket: {ticket}")
 
-            # Configuración según ambiente
-            if self.company.environment == 'BETA':
-                wsdl_url = 'https://e-beta.sunat.gob.pe/ol-ti-itcpfegem-beta/billService'
-                username = f"{self.company.ruc}MODDATOS"
-                password = "moddatos"
-            else:
-                wsdl_url = 'https://e-factura.sunat.gob.pe/ol-ti-itcpfegem/billService'
-                username = f"{self.company.ruc}{self.company.sunat_username}"
-                password = self.company.sunat_password
-
             # SOAP para getStatus
-            soap_xml = f'''<?xml version="1.0" encoding="UTF-8"?>
-    <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:ser="http://service.sunat.gob.pe" xmlns:wsse="http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-secext-1.0.xsd">
-    <soapenv:Header>
-    <wsse:Security>
-    <wsse:UsernameToken>
-    <wsse:Username>{username}</wsse:Username>
-    <wsse:Password>{password}</wsse:Password>
-    </wsse:UsernameToken>
-    </wsse:Security>
-    </soapenv:Header>
-    <soapenv:Body>
-    <ser:getStatus>
-    <ticket>{ticket}</ticket>
-    </ser:getStatus>
-    </soapenv:Body>
-    </soapenv:Envelope>'''
-
-            headers = {
-                'Content-Type': 'text/xml; charset=utf-8',
-                'SOAPAction': '""',
-            }
+            wsdl_url = get_service_url(self.company.environment)
+            username, password = get_credentials(self.company)
+            soap_xml = build_envelope(GET_STATUS, username, password, [('ticket', ticket)])
 
             # Esperar antes del primer intento para dar tiempo al ticket
             import time
@@ -567,34 +366,31 @@ class CancellationService:
             # Aumentar reintentos de 3 a 5
             max_attempts = 5
 
+            # Sesión keep-alive del ambiente para todas las consultas
+            session = get_session(self.company.environment)
+
             for attempt in range(max_attempts):
                 try:
-                    response = requests.post(
+                    response = session.post(
                         wsdl_url,
-                        data=soap_xml.encode('utf-8'),
-                        headers=headers,
+                        data=soap_xml,
+                        headers=SOAP_HEADERS,
                         timeout=60,
                         verify=True
                     )
 
                     if response.status_code == 200:
                         # Buscar statusCode
-                        import re
-                        status_pattern = r'<statusCode>([^<]+)</statusCode>'
-                        match = re.search(status_pattern, response.text)
+                        status = parse_soap_response(response.content)
+                        status_code = status.statusCode
 
-                        if match:
-                            status_code = match.group(1)
+                        if status_code:
                             logger.info(f"Estado del ticket: {status_code}")
 
                             if status_code == '0':  # Procesado correctamente
-                                # Buscar CDR en content
-                                content_pattern = r'<content>([^<]+)</content>'
-                                content_match = re.search(content_pattern, response.text)
-
-                                if content_match:
-                                    cdr_base64 = content_match.group(1)
-                                    self._process_cancellation_cdr(cdr_base64)
+                                # CDR en content
+                                if status.content:
+                                    self._process_cancellation_cdr(status.content)
 
                                 self.operation.billing_status = 'CANCELLED'
                                 self.operation.save()
@@ -611,9 +407,7 @@ class CancellationService:
                                 continue
 
                             elif status_code == '99':  # Error
-                                message_pattern = r'<statusMessage>([^<]+)</statusMessage>'
-                                message_match = re.search(message_pattern, response.text)
-                                error_msg = message_match.group(1) if message_match else f"Error código {status_code}"
+                                error_msg = status.statusMessage or f"Error código {status_code}"
 
                                 logger.error(f"Error en SUNAT: {error_msg}")
 
@@ -735,21 +529,6 @@ class CancellationService:
         except Exception as e:
             logger.error(f"Error procesando CDR de anulación: {str(e)}")
 
-    def _create_zip(self, xml_path):
-        """Crear ZIP del XML"""
-        xml_filename = os.path.basename(xml_path)
-        zip_filename = xml_filename.replace('.xml', '.zip')
-        zip_path = xml_path.replace('.xml', '.zip')
-
-        if os.path.exists(zip_path):
-            os.remove(zip_path)
-
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            zipf.write(xml_path, xml_filename)
-
-        logger.info(f"ZIP creado: {zip_filename}")
-        return zip_path
-
 
 # Función helper para anular múltiples documentos
 def bulk_cancel_documents(operation_ids, reason_code='01', description='Anulación masiva'):
@@ -0,0 +1,164 @@
+# operations/services/daemon_pool.py
+"""
+Pool de trabajadores del demonio de facturación (billing_daemon --workers).
+
+Cada fase del ciclo (envíos nuevos, reintentos, resúmenes diarios,
+anulaciones y tickets) tiene su propia cola. N hilos toman las tareas de
+las colas por turno (round-robin): una fase con mucho atraso no deja
+esperando a las demás y los envíos, reintentos, anulaciones y consultas de
+tickets avanzan a la vez.
+
+En lugar de pausas fijas entre documentos cada fase tiene un limitador de
+ritmo (tareas por segundo); las llamadas a SUNAT además pasan por el
+circuito y el limitador AIMD de sunat_circuit.
+
+Cada hilo usa su propia conexión a la base de datos: se renuevan las
+vencidas antes de cada tarea y se cierran al terminar el hilo.
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+from django.db import close_old_connections, connection
+
+logger = logging.getLogger(__name__)
+
+# Tareas por segundo de cada fase, equivalente a las pausas fijas anteriores
+# (1 s entre envíos y tickets, 2 s entre reintentos y anulaciones)
+PHASE_RATES = {
+    'pending': 1.0,
+    'retry': 0.5,
+    'summary': None,
+    'cancellation': 0.5,
+    'ticket': 1.0,
+}
+
+
+def phase_rates(rate=None, workers=1):
+    """
+    Ritmo de cada fase: rate fija el mismo valor para todas; si no, el ritmo
+    por defecto escala con la cantidad de hilos
+    """
+    if rate:
+        return {phase: rate for phase in PHASE_RATES}
+    workers = max(1, workers)
+    return {phase: default * workers if default else None for phase, default in PHASE_RATES.items()}
+
+
+class PhaseRateLimiter:
+    """Espaciar las tareas de una fase (None = sin límite)"""
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def acquire(self):
+        """Esperar el turno de la siguiente tarea"""
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class PhaseWorkerPool:
+    """
+    Pool acotado de hilos con una cola por fase.
+
+    Uso:
+        pool = PhaseWorkerPool(4, phase_rates(workers=4))
+        pool.submit('pending', handler, operation)
+        pool.join()   # esperar a que se vacíen todas las colas
+        pool.close()  # al terminar el demonio
+    """
+
+    def __init__(self, workers, rates=None):
+        self.workers = max(1, workers)
+        rates = rates if rates is not None else PHASE_RATES
+        self.queues = {phase: deque() for phase in PHASE_RATES}
+        self.limiters = {phase: PhaseRateLimiter(rates.get(phase)) for phase in PHASE_RATES}
+        self.condition = threading.Condition()
+        self.queued = 0
+        self.active = 0
+        self.cursor = 0
+        self.closed = False
+        self.threads = [
+            threading.Thread(target=self._work, name=f'billing-worker-{index + 1}', daemon=True)
+            for index in range(self.workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, phase, fn, *args):
+        """Encolar una tarea en la cola de su fase"""
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("El pool de trabajadores está cerrado")
+            self.queues[phase].append((fn, args))
+            self.queued += 1
+            self.condition.notify()
+
+    def size(self, phase=None):
+        """Tareas en cola (de una fase o de todas)"""
+        with self.condition:
+            if phase is None:
+                return self.queued
+            return len(self.queues[phase])
+
+    def join(self):
+        """Esperar a que se vacíen las colas y terminen las tareas en curso"""
+        with self.condition:
+            while self.queued or self.active:
+                self.condition.wait()
+
+    def close(self):
+        """Terminar las tareas encoladas y detener los hilos"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+
+    def _next(self):
+        """Siguiente tarea por turno entre las fases (con el lock tomado)"""
+        phases = list(self.queues)
+        for offset in range(len(phases)):
+            phase = phases[(self.cursor + offset) % len(phases)]
+            if self.queues[phase]:
+                self.cursor = (self.cursor + offset + 1) % len(phases)
+                self.queued -= 1
+                self.active += 1
+                fn, args = self.queues[phase].popleft()
+                return phase, fn, args
+        return None
+
+    def _work(self):
+        try:
+            while True:
+                with self.condition:
+                    task = self._next()
+                    while task is None:
+                        if self.closed:
+                            return
+                        self.condition.wait()
+                        task = self._next()
+
+                phase, fn, args = task
+                try:
+                    self.limiters[phase].acquire()
+                    close_old_connections()
+                    fn(*args)
+                except Exception as e:
+                    logger.error(f"Error en tarea de la fase {phase}: {str(e)}", exc_info=True)
+                finally:
+                    with self.condition:
+                        self.active -= 1
+                        self.condition.notify_all()
+        finally:
+            connection.close()
@@ -0,0 +1,180 @@
+# operations/services/fair_scheduler.py
+"""
+Reparto justo de la facturación entre empresas.
+
+En lugar de tomar los documentos más antiguos de todas las empresas (una
+empresa que importa miles de ventas dejaba esperando a las demás hasta
+vaciar su atraso), el lote se arma así:
+
+1. Clases de prioridad por tipo de documento (BILLING_DOCUMENT_PRIORITY):
+   primero facturas, luego notas y al final boletas, que SUNAT admite
+   informar más tarde en el resumen diario.
+2. Dentro de cada clase, round-robin ponderado por empresa: en cada vuelta
+   cada empresa aporta hasta Company.billing_weight documentos, los más
+   antiguos primero.
+3. Cada empresa tiene un tope de documentos en curso
+   (BILLING_COMPANY_IN_FLIGHT, 0 = sin tope), contando las reservas vigentes
+   del demonio y de Celery (billing_lease). El tope también vale para el
+   task de Celery.
+
+Los candidatos se leen en una sola consulta, con ROW_NUMBER() por empresa,
+así que ninguna empresa aporta más que el tamaño del lote.
+"""
+import logging
+from collections import OrderedDict, deque
+
+from django.conf import settings
+from django.db.models import Case, Count, F, IntegerField, Value, When, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DOCUMENT_PRIORITY = {'01': 0, '07': 1, '08': 1, '03': 2}
+
+
+def document_priority():
+    return getattr(settings, 'BILLING_DOCUMENT_PRIORITY', DEFAULT_DOCUMENT_PRIORITY)
+
+
+def in_flight_cap():
+    return getattr(settings, 'BILLING_COMPANY_IN_FLIGHT', 100)
+
+
+def priority_expression():
+    """Clase de prioridad (menor = antes) según el código de documento"""
+    priorities = document_priority()
+    lowest = max(priorities.values(), default=0) + 1
+    return Case(
+        *[When(document__code=code, then=Value(priority)) for code, priority in priorities.items()],
+        default=Value(lowest),
+        output_field=IntegerField()
+    )
+
+
+def in_flight(company_ids):
+    """Documentos con reserva vigente por empresa"""
+    from operations.models import Operation
+
+    if not company_ids:
+        return {}
+    rows = Operation.objects.filter(
+        company_id__in=company_ids,
+        lease_expires_at__gt=timezone.now()
+    ).order_by().values('company_id').annotate(count=Count('id')).values_list('company_id', 'count')
+    return dict(rows)
+
+
+def company_slots(company_id):
+    """Documentos que la empresa aún puede poner en curso (None = sin tope)"""
+    cap = in_flight_cap()
+    if not cap:
+        return None
+    return max(0, cap - in_flight([company_id]).get(company_id, 0))
+
+
+class FairScheduler:
+    """
+    Elegir un lote justo entre empresas.
+
+    Uso:
+        ids = FairScheduler(limit).select(queryset)
+    """
+
+    def __init__(self, limit, cap=None):
+        self.limit = limit
+        self.cap = in_flight_cap() if cap is None else cap
+
+    def select(self, queryset):
+        """
+        Returns:
+            Ids de operaciones del queryset en el orden en que conviene procesarlas
+        """
+        from users.models import Company
+
+        if self.limit <= 0:
+            return []
+
+        rows = list(
+            queryset.order_by().annotate(
+                priority=priority_expression()
+            ).annotate(
+                rank=Window(
+                    RowNumber(),
+                    partition_by=[F('company_id')],
+                    order_by=[F('priority').asc(), F('created_at').asc(), F('id').asc()]
+                )
+            ).filter(
+                rank__lte=self.limit
+            ).order_by(
+                'priority', 'created_at', 'id'
+            ).values_list('id', 'company_id', 'priority')
+        )
+        if not rows:
+            return []
+
+        company_ids = {company_id for _, company_id, _ in rows}
+        weights = dict(Company.objects.filter(id__in=company_ids).values_list('id', 'billing_weight'))
+        if self.cap:
+            busy = in_flight(company_ids)
+            slots = {company_id: self.cap - busy.get(company_id, 0) for company_id in company_ids}
+        else:
+            slots = {company_id: self.limit for company_id in company_ids}
+
+        # Clase -> empresa -> ids; las empresas quedan en el orden de su documento más antiguo
+        classes = OrderedDict()
+        for operation_id, company_id, priority in rows:
+            classes.setdefault(priority, OrderedDict()).setdefault(company_id, deque()).append(operation_id)
+
+        selected = []
+        for priority in sorted(classes):
+            buckets = classes[priority]
+            while buckets and len(selected) < self.limit:
+                for company_id in list(buckets):
+                    queue = buckets[company_id]
+                    take = min(max(1, weights.get(company_id) or 1), slots[company_id], self.limit - len(selected))
+                    for _ in range(max(0, take)):
+                        if not queue:
+                            break
+                        selected.append(queue.popleft())
+                        slots[company_id] -= 1
+                    if not queue or slots[company_id] <= 0:
+                        del buckets[company_id]
+                    if len(selected) >= self.limit:
+                        break
+
+        saturated = [company_id for company_id, free in slots.items() if free <= 0]
+        if saturated:
+            logger.info(f"Empresas con el tope de documentos en curso ({self.cap}): {saturated}")
+        return selected
+
+
+def claim_fair(queryset, limit, owner=None):
+    """
+    Reservar hasta limit operaciones del queryset repartidas entre empresas.
+
+    Si otro proceso ganó parte de los candidatos se vuelve a repartir entre
+    los que siguen libres (como billing_lease.claim).
+
+    Returns:
+        Operaciones reservadas, en el orden del reparto
+    """
+    from operations.services.billing_lease import CLAIM_ATTEMPTS, available, claim
+
+    claimed = []
+    order = []
+    for attempt in range(CLAIM_ATTEMPTS):
+        ids = FairScheduler(limit - len(claimed)).select(queryset.filter(available()))
+        if not ids:
+            break
+        order += ids
+        claimed += claim(queryset.filter(id__in=ids), len(ids), owner=owner)
+        if len(claimed) >= limit:
+            break
+    return in_order(claimed, order)
+
+
+def in_order(operations, ids):
+    """Ordenar operaciones (p. ej. las reservadas) según la lista de ids"""
+    position = {operation_id: index for index, operation_id in enumerate(ids)}
+    return sorted(operations, key=lambda operation: position.get(operation.id, len(position)))
@@ -0,0 +1,137 @@
+# operations/services/invoice_computation.py
+"""
+Cálculo único de importes de un comprobante para la generación del XML UBL.
+
+Se recorre una sola vez el detalle de la operación (una consulta con el
+producto unido, o el caché de prefetch si ya viene cargado) y se guardan los
+valores por línea, los subtotales por tipo de afectación, la base del
+descuento global y los totales a pagar.
+"""
+from decimal import Decimal
+
+IGV_RATE = Decimal('0.18')
+IGV_FACTOR = Decimal('1.18')
+ZERO = Decimal('0')
+
+
+def to_decimal(value):
+    """Convertir a Decimal sin volver a pasar por str() si ya lo es"""
+    if value is None:
+        return ZERO
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
+
+
+def get_operation_details(operation):
+    """
+    Obtener el detalle de la operación en una sola consulta.
+    Si el detalle ya fue cargado con prefetch_related se reutiliza el caché.
+    """
+    prefetched = getattr(operation, '_prefetched_objects_cache', {})
+    if 'operationdetail_set' in prefetched:
+        return list(operation.operationdetail_set.all())
+    return list(operation.operationdetail_set.select_related('product'))
+
+
+class InvoiceLineValues:
+    """Valores calculados de una línea del comprobante (siempre sin descuento global)"""
+
+    __slots__ = (
+        'index',
+        'description',
+        'product_code',
+        'affectation_code',
+        'quantity',
+        'unit_value',
+        'total_value',
+        'total_igv',
+        'unit_price_with_tax',
+    )
+
+    def __init__(self, index, detail):
+        quantity = to_decimal(detail.quantity)
+        unit_value = to_decimal(detail.unit_value)
+        total_value = quantity * unit_value
+
+        self.index = index
+        self.description = detail.description
+        self.product_code = detail.product.code if detail.product else "PROD001"
+        # El código del tipo de afectación es la PK, no requiere join
+        self.affectation_code = str(detail.type_affectation_id or 10)
+        self.quantity = quantity
+        self.unit_value = unit_value
+        self.total_value = total_value
+        self.total_igv = total_value * IGV_RATE
+        self.unit_price_with_tax = unit_value * IGV_FACTOR
+
+
+class InvoiceComputation:
+    """Importes del comprobante calculados en una sola pasada"""
+
+    __slots__ = (
+        'lines',
+        'subtotals_by_affectation',
+        'discount_base',
+        'global_discount',
+        'discount_factor',
+        'taxable_amount',
+        'igv_amount',
+        'line_extension',
+        'tax_inclusive',
+        'allowance_total',
+        'payable',
+    )
+
+    def __init__(self, operation, details):
+        lines = []
+        subtotals = {}
+        base = ZERO
+
+        for index, detail in enumerate(details, 1):
+            line = InvoiceLineValues(index, detail)
+            lines.append(line)
+            base += line.total_value
+
+            subtotal = subtotals.get(line.affectation_code)
+            if subtotal is None:
+                subtotals[line.affectation_code] = [line.total_value, line.total_igv]
+            else:
+                subtotal[0] += line.total_value
+                subtotal[1] += line.total_igv
+
+        global_discount = to_decimal(operation.global_discount)
+
+        self.lines = lines
+        self.subtotals_by_affectation = {
+            code: (taxable, igv) for code, (taxable, igv) in subtotals.items()
+        }
+        self.discount_base = base
+        self.line_extension = base
+        self.global_discount = global_discount
+        self.discount_factor = global_discount / base if base > 0 else ZERO
+
+        if global_discount > 0:
+            # CUANDO HAY DESCUENTO: IGV sobre monto SIN descuento
+            self.taxable_amount = base
+            self.igv_amount = base * IGV_RATE
+            self.allowance_total = global_discount
+            # TaxInclusiveAmount = LineExtension + IGV
+            self.tax_inclusive = base + self.igv_amount
+            # PayableAmount = TaxInclusiveAmount - AllowanceTotalAmount
+            self.payable = self.tax_inclusive - global_discount
+        else:
+            self.taxable_amount = to_decimal(operation.total_taxable)
+            self.igv_amount = to_decimal(operation.igv_amount)
+            self.allowance_total = ZERO
+            self.tax_inclusive = to_decimal(operation.total_amount)
+            self.payable = self.tax_inclusive
+
+    @classmethod
+    def from_operation(cls, operation):
+        """Construir el cálculo a partir de la operación (una consulta como máximo)"""
+        return cls(operation, get_operation_details(operation))
+
+    @property
+    def has_global_discount(self):
+        return self.global_discount != 0
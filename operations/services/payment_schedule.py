@@ -0,0 +1,90 @@
+# operations/services/payment_schedule.py
+"""
+Forma de pago (Contado / Crédito) de una operación.
+
+Los pagos de la operación se cargan una sola vez (o se toman del caché de
+prefetch_related('payment_set')) y a partir de ellos se calcula la forma de
+pago, las cuotas con su monto proporcional y la fecha de vencimiento. El
+resultado queda guardado en la instancia de la operación para que lo usen
+tanto el generador de XML como el campo payment_set de GraphQL.
+"""
+
+CASH = 'Contado'
+CREDIT = 'Credito'
+
+
+class PaymentInstallment:
+    """Cuota de un pago a crédito"""
+
+    __slots__ = ('number', 'amount', 'due_date', 'payment')
+
+    def __init__(self, number, amount, due_date, payment):
+        self.number = number
+        self.amount = amount
+        self.due_date = due_date
+        self.payment = payment
+
+    @property
+    def means_id(self):
+        return f'Cuota{self.number:03d}'
+
+
+class PaymentSchedule:
+    """Cronograma de pago de una operación"""
+
+    __slots__ = ('payments', 'enabled_payments', 'form', 'credit_total', 'installments', 'due_date')
+
+    def __init__(self, operation, payments):
+        # Todos los pagos (incluye anulados) tal como los lista GraphQL
+        self.payments = payments
+
+        enabled = [p for p in payments if p.is_enabled]
+        enabled.sort(key=lambda p: p.payment_date)
+        self.enabled_payments = enabled
+
+        credit_payments = [p for p in enabled if p.payment_type == 'CR']
+
+        # La fecha de vencimiento es la fecha de la última cuota
+        self.due_date = credit_payments[-1].payment_date if credit_payments else None
+
+        # Contado o crédito se determina por el primer pago
+        if not enabled or enabled[0].payment_type != 'CR':
+            self.form = CASH
+            self.credit_total = None
+            self.installments = []
+            return
+
+        self.form = CREDIT
+
+        # paid_amount es el monto real de cada cuota; en 0 si está pendiente
+        credit_total = sum(p.paid_amount for p in credit_payments)
+        if credit_total == 0:
+            credit_total = operation.total_amount
+        self.credit_total = credit_total
+
+        # Las cuotas pendientes se llenan dividiendo el total entre las cuotas
+        total_cuotas = len(credit_payments)
+        installments = []
+        for number, payment in enumerate(credit_payments, 1):
+            amount = payment.paid_amount
+            if amount == 0:
+                amount = operation.total_amount / total_cuotas
+            installments.append(PaymentInstallment(number, amount, payment.payment_date, payment))
+        self.installments = installments
+
+    @property
+    def is_credit(self):
+        return self.form == CREDIT
+
+    @classmethod
+    def for_operation(cls, operation, refresh=False):
+        """
+        Obtener el cronograma de la operación (una consulta como máximo).
+        Se guarda en la instancia; refresh=True lo vuelve a calcular.
+        """
+        schedule = getattr(operation, '_payment_schedule', None)
+        if schedule is None or refresh:
+            # payment_set.all() reutiliza el caché de prefetch si existe
+            schedule = cls(operation, list(operation.payment_set.all()))
+            operation._payment_schedule = schedule
+        return schedule
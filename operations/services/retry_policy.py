@@ -0,0 +1,68 @@
+# operations/services/retry_policy.py
+"""
+Política de reintentos de facturación.
+
+En cada falla se calcula Operation.next_attempt_at y el demonio solo toma
+las operaciones que ya vencieron (índice billing_status + next_attempt_at):
+
+- Error o rechazo: retroceso exponencial por empresa,
+      Company.retry_interval_minutes * 2 ** (intentos - 1)
+  hasta BILLING_RETRY_MAX_MINUTES, con una variación al azar de
+  +/- BILLING_RETRY_JITTER (20 %).
+- SUNAT no disponible (circuito abierto): no consume intentos; se reparte
+  entre una y dos esperas del circuito para que, al volver SUNAT, los
+  documentos acumulados no se reenvíen todos en el mismo segundo.
+"""
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+# Estados que se reintentan según next_attempt_at
+RETRY_STATUSES = ('ERROR', 'REJECTED')
+
+
+def base_interval_minutes(company):
+    default = getattr(settings, 'BILLING_RETRY_INTERVAL_MINUTES', 30)
+    return max(1, getattr(company, 'retry_interval_minutes', None) or default)
+
+
+def retry_delay(company, retry_count):
+    """Segundos hasta el siguiente intento, sin variación"""
+    exponent = min(max(0, (retry_count or 1) - 1), 16)
+    minutes = base_interval_minutes(company) * 2 ** exponent
+    return min(minutes, getattr(settings, 'BILLING_RETRY_MAX_MINUTES', 24 * 60)) * 60
+
+
+def with_jitter(seconds):
+    jitter = getattr(settings, 'BILLING_RETRY_JITTER', 0.2)
+    return seconds * random.uniform(1 - jitter, 1 + jitter)
+
+
+def next_attempt_at(company, retry_count, now=None):
+    """Próximo intento después de una falla (retry_count ya incrementado)"""
+    now = now or timezone.now()
+    return now + timedelta(seconds=with_jitter(retry_delay(company, retry_count)))
+
+
+def unavailable_until(retry_after, now=None):
+    """Próximo intento cuando SUNAT no está disponible (circuito abierto)"""
+    now = now or timezone.now()
+    return now + timedelta(seconds=retry_after + random.uniform(0, retry_after))
+
+
+def due(now=None):
+    """Filtro de operaciones cuyo próximo intento ya venció (o sin programar)"""
+    now = now or timezone.now()
+    return Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now)
+
+
+def due_after(minutes, now=None):
+    """
+    Como due(), pero las operaciones sin next_attempt_at (anteriores a la
+    política de reintentos) esperan minutes desde el último intento.
+    """
+    now = now or timezone.now()
+    return due(now) & ~Q(next_attempt_at__isnull=True, last_retry_at__gte=now - timedelta(minutes=minutes))
@@ -0,0 +1,131 @@
+# operations/services/signing_pool.py
+"""
+Firma en paralelo de lotes de XML con un ProcessPoolExecutor.
+
+La firma (C14N + RSA-SHA1) consume CPU; en un lote grande (por ejemplo el
+atraso acumulado tras una caída de SUNAT) se reparte entre varios procesos
+para usar todos los núcleos. Cada proceso mantiene su propio caché de claves
+de firma (SigningKeyCache), así que el PEM se lee una vez por proceso.
+
+Los árboles lxml no se pueden enviar a otro proceso: se serializan a bytes
+antes de despachar y cada proceso vuelve a parsearlos. Cada resultado trae
+el SigningResult (bytes firmados, DigestValue, SignatureValue y huella).
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+# key identifica el documento en el resultado (normalmente el id de la operación)
+SigningJob = namedtuple('SigningJob', ['key', 'ruc', 'environment', 'filename', 'xml'])
+
+
+def _init_worker():
+    """Inicializar Django en el proceso firmador (necesario con spawn)"""
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+def sign_job(job):
+    """
+    Firmar un documento. Se ejecuta dentro del proceso firmador.
+
+    Returns:
+        Diccionario con key, result (SigningResult) y error
+    """
+    from users.models import Company
+    from operations.services.billing_service import XMLSigner
+
+    try:
+        document = etree.ElementTree(etree.fromstring(job.xml))
+
+        # El firmador solo necesita el RUC y el ambiente de la empresa
+        signer = XMLSigner(Company(ruc=job.ruc, environment=job.environment))
+        # Solo se usa el nombre del archivo para la ruta del XML firmado
+        result = signer.sign_xml(job.filename, document=document, persist=False)
+        return {'key': job.key, 'result': result, 'error': None}
+    except Exception as e:
+        logger.error(f"Error firmando {job.filename}: {str(e)}")
+        return {'key': job.key, 'result': None, 'error': str(e)}
+
+
+class SigningPool:
+    """Pool de procesos firmadores (uno por proceso padre, se crea al primer uso)"""
+
+    _executor = None
+    _pid = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_workers(cls):
+        return getattr(settings, 'BILLING_SIGNING_WORKERS', 0) or os.cpu_count() or 1
+
+    @classmethod
+    def _get_executor(cls):
+        with cls._lock:
+            # Un pool heredado por fork no es utilizable en el hijo
+            if cls._executor is None or cls._pid != os.getpid():
+                start_method = getattr(settings, 'BILLING_SIGNING_START_METHOD', 'spawn')
+                cls._executor = ProcessPoolExecutor(
+                    max_workers=cls.get_workers(),
+                    mp_context=multiprocessing.get_context(start_method),
+                    initializer=_init_worker,
+                )
+                cls._pid = os.getpid()
+                logger.info(f"Pool de firma iniciado con {cls.get_workers()} procesos ({start_method})")
+            return cls._executor
+
+    @classmethod
+    def sign_batch(cls, jobs):
+        """
+        Firmar un lote de documentos en paralelo.
+
+        Args:
+            jobs: lista de SigningJob; xml puede ser bytes o un árbol lxml
+
+        Returns:
+            Lista de resultados de sign_job en el mismo orden que jobs
+        """
+        jobs = [
+            job if isinstance(job.xml, bytes) else job._replace(xml=etree.tostring(job.xml))
+            for job in jobs
+        ]
+        if not jobs:
+            return []
+
+        # Un solo documento no justifica el costo de despachar a otro proceso
+        if len(jobs) == 1:
+            return [sign_job(jobs[0])]
+
+        try:
+            executor = cls._get_executor()
+        except (AssertionError, OSError) as e:
+            # P. ej. procesos daemon que no pueden tener hijos
+            logger.warning(f"No se pudo iniciar el pool de firma ({str(e)}), firmando en el proceso actual")
+            return [sign_job(job) for job in jobs]
+
+        chunksize = max(1, len(jobs) // (cls.get_workers() * 4))
+        try:
+            return list(executor.map(sign_job, jobs, chunksize=chunksize))
+        except Exception as e:
+            # BrokenProcessPool u otros: descartar el pool y firmar aquí
+            logger.error(f"Error en el pool de firma: {str(e)}, firmando en el proceso actual")
+            cls.shutdown()
+            return [sign_job(job) for job in jobs]
+
+    @classmethod
+    def shutdown(cls):
+        with cls._lock:
+            if cls._executor is not None and cls._pid == os.getpid():
+                cls._executor.shutdown(wait=False, cancel_futures=True)
+            cls._executor = None
+            cls._pid = None
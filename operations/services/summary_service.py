@@ -0,0 +1,649 @@
+# operations/services/summary_service.py
+"""
+Resumen Diario (RC) de boletas.
+
+En lugar de enviar cada boleta con sendBill, las boletas pendientes de una
+empresa se agrupan por fecha de emisión en resúmenes de hasta
+BILLING_SUMMARY_MAX_LINES líneas (SUNAT admite 500). Cada boleta se genera
+y firma igual que en el envío individual (su hash va en la representación
+impresa), pero a SUNAT solo viaja el resumen: se firma una vez, se envía con
+sendSummary y el ticket se consulta con getStatus. El resultado del ticket
+(CDR del resumen) se aplica a todas las boletas del resumen con un solo
+UPDATE.
+
+El modo se activa con BILLING_BOLETA_SUMMARY; con el modo activo el demonio
+y las tareas de Celery dejan de enviar boletas con sendBill.
+
+Las funciones de armado del XML también las usa CancellationService para
+el resumen de anulación (ConditionCode 3).
+"""
+import logging
+import os
+import time
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F, Max
+from django.utils import timezone
+from lxml import etree
+
+from operations.services.billing_state import transition_many
+from operations.services.retry_policy import RETRY_STATUSES, due, next_attempt_at, unavailable_until
+from operations.services.sunat_circuit import SunatUnavailable
+from operations.services.sunat_package import SunatPackage, is_archiving_enabled as is_zip_archiving_enabled
+from operations.services.sunat_response import SunatResponseError, parse_cdr, parse_soap_response
+from operations.services.sunat_soap import GET_STATUS, SEND_SUMMARY, build_envelope, get_credentials, post_envelope
+
+logger = logging.getLogger(__name__)
+
+# Estado de la línea del resumen (catálogo 19)
+CONDITION_ADD = '1'
+CONDITION_MODIFY = '2'
+CONDITION_VOID = '3'
+
+# Líneas por resumen admitidas por SUNAT
+SUNAT_SUMMARY_MAX_LINES = 500
+
+
+def format_decimal(value, decimals=2):
+    """Formatear decimal"""
+    if value is None:
+        return f"0.{'0' * decimals}"
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return format(value, f'.{decimals}f')
+
+
+def customer_document(operation):
+    """
+    Obtener documento del cliente de forma segura
+    Returns '00000000' para clientes varios o sin documento
+    """
+    try:
+        if (operation.person and
+                hasattr(operation.person, 'document') and
+                operation.person.document and
+                operation.person.document.strip()):
+
+            doc = operation.person.document.strip()
+            # Validar que no sea una cadena vacía o solo ceros
+            if doc and doc != "0" * len(doc):
+                return doc
+    except (AttributeError, TypeError):
+        pass
+
+    # Valor por defecto para clientes varios
+    return "00000000"
+
+
+def customer_doc_type(operation):
+    """
+    Obtener tipo de documento del cliente de forma segura
+    Returns '0' para clientes varios o sin documento específico
+    """
+    try:
+        document = customer_document(operation)
+
+        # Si es el documento por defecto, retornar tipo 0
+        if document == "00000000":
+            return "0"
+
+        # Determinar por longitud
+        if len(document) == 8:
+            return "1"  # DNI
+        elif len(document) == 11:
+            return "6"  # RUC
+
+        # Intentar obtener del person_type si existe
+        if (operation.person and
+                hasattr(operation.person, 'person_type') and
+                operation.person.person_type):
+            return str(operation.person.person_type)
+
+    except (AttributeError, TypeError, ValueError):
+        pass
+
+    # Valor por defecto
+    return "0"
+
+
+def summary_identifier(issue_date, correlative):
+    """ID del resumen: RC-AAAAMMDD-NNNNN"""
+    return f"RC-{issue_date.strftime('%Y%m%d')}-{correlative:05d}"
+
+
+def reserve_summary_correlative(company, issue_date):
+    """
+    Reservar el próximo correlativo de resumen diario de la empresa para la fecha.
+
+    La serie RC es la misma para los resúmenes de boletas y los de anulación;
+    el contador (SummaryCorrelative) se bloquea con SELECT FOR UPDATE, así que
+    dos procesos nunca obtienen el mismo número. Si un envío falla el número
+    queda sin usar (SUNAT solo exige que no se repita).
+    """
+    from operations.models import Operation, SummaryCorrelative
+
+    with transaction.atomic():
+        counter, _ = SummaryCorrelative.objects.select_for_update().get_or_create(
+            company=company, issue_date=issue_date
+        )
+        # Los números ya usados antes de existir el contador siguen ocupados
+        summaries = Operation.objects.filter(
+            company=company, summary_date=issue_date
+        ).aggregate(last=Max('summary_number'))['last']
+        cancellations = Operation.objects.filter(
+            company=company, cancellation_date=issue_date, document__code='03'
+        ).aggregate(last=Max('low_number'))['last']
+
+        counter.last_number = max(counter.last_number, summaries or 0, cancellations or 0) + 1
+        counter.save(update_fields=['last_number', 'updated_at'])
+
+    return counter.last_number
+
+
+def summary_payments(operation):
+    """Importes por tipo de operación de la boleta (gravada, exonerada, inafecta, gratuita)"""
+    payments = [
+        ('01', operation.total_taxable),
+        ('02', operation.total_exempt),
+        ('03', operation.total_unaffected),
+        ('05', operation.total_free),
+    ]
+    return [(instruction, amount) for instruction, amount in payments if amount] or [('01', Decimal('0'))]
+
+
+def summary_line(operation, line_id, condition_code, payments=None):
+    """Línea (sac:SummaryDocumentsLine) de una boleta"""
+    currency = operation.currency
+    total_amount = Decimal(str(operation.total_amount))
+    taxable_amount = Decimal(str(operation.total_taxable))
+    igv_amount = Decimal(str(operation.igv_amount))
+
+    billing_payments = '\n'.join(f'''<sac:BillingPayment>
+<cbc:PaidAmount currencyID="{currency}">{format_decimal(amount)}</cbc:PaidAmount>
+<cbc:InstructionID>{instruction}</cbc:InstructionID>
+</sac:BillingPayment>''' for instruction, amount in (payments or summary_payments(operation)))
+
+    return f'''<sac:SummaryDocumentsLine>
+<cbc:LineID>{line_id}</cbc:LineID>
+<cbc:DocumentTypeCode>{operation.document.code if operation.document else '03'}</cbc:DocumentTypeCode>
+<cbc:ID>{operation.serial}-{operation.number}</cbc:ID>
+<cac:AccountingCustomerParty>
+<cbc:CustomerAssignedAccountID>{customer_document(operation)}</cbc:CustomerAssignedAccountID>
+<cbc:AdditionalAccountID>{customer_doc_type(operation)}</cbc:AdditionalAccountID>
+</cac:AccountingCustomerParty>
+<cac:Status>
+<cbc:ConditionCode>{condition_code}</cbc:ConditionCode>
+</cac:Status>
+<sac:TotalAmount currencyID="{currency}">{format_decimal(total_amount)}</sac:TotalAmount>
+{billing_payments}
+<cac:TaxTotal>
+<cbc:TaxAmount currencyID="{currency}">{format_decimal(igv_amount)}</cbc:TaxAmount>
+<cac:TaxSubtotal>
+<cbc:TaxableAmount currencyID="{currency}">{format_decimal(taxable_amount)}</cbc:TaxableAmount>
+<cbc:TaxAmount currencyID="{currency}">{format_decimal(igv_amount)}</cbc:TaxAmount>
+<cac:TaxCategory>
+<cac:TaxScheme>
+<cbc:ID>1000</cbc:ID>
+<cbc:Name>IGV</cbc:Name>
+<cbc:TaxTypeCode>VAT</cbc:TaxTypeCode>
+</cac:TaxScheme>
+</cac:TaxCategory>
+</cac:TaxSubtotal>
+</cac:TaxTotal>
+</sac:SummaryDocumentsLine>'''
+
+
+def build_summary_xml(company, summary_id, reference_date, issue_date, lines):
+    """XML del resumen diario (SummaryDocuments) con las líneas ya armadas"""
+    denomination = escape(company.denomination or '')
+    return f'''<?xml version="1.0" encoding="ISO-8859-1"?>
+<SummaryDocuments xmlns="urn:sunat:names:specification:ubl:peru:schema:xsd:SummaryDocuments-1" xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2" xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2" xmlns:ext="urn:oasis:names:specification:ubl:schema:xsd:CommonExtensionComponents-2" xmlns:sac="urn:sunat:names:specification:ubl:peru:schema:xsd:SunatAggregateComponents-1" xmlns:ds="http://www.w3.org/2000/09/xmldsig#">
+<ext:UBLExtensions>
+<ext:UBLExtension>
+<ext:ExtensionContent></ext:ExtensionContent>
+</ext:UBLExtension>
+</ext:UBLExtensions>
+<cbc:UBLVersionID>2.0</cbc:UBLVersionID>
+<cbc:CustomizationID>1.1</cbc:CustomizationID>
+<cbc:ID>{summary_id}</cbc:ID>
+<cbc:ReferenceDate>{reference_date}</cbc:ReferenceDate>
+<cbc:IssueDate>{issue_date}</cbc:IssueDate>
+<cac:Signature>
+<cbc:ID>{company.ruc}</cbc:ID>
+<cac:SignatoryParty>
+<cac:PartyIdentification>
+<cbc:ID>{company.ruc}</cbc:ID>
+</cac:PartyIdentification>
+<cac:PartyName>
+<cbc:Name>{denomination}</cbc:Name>
+</cac:PartyName>
+</cac:SignatoryParty>
+<cac:DigitalSignatureAttachment>
+<cac:ExternalReference>
+<cbc:URI>{company.ruc}</cbc:URI>
+</cac:ExternalReference>
+</cac:DigitalSignatureAttachment>
+</cac:Signature>
+<cac:AccountingSupplierParty>
+<cbc:CustomerAssignedAccountID>{company.ruc}</cbc:CustomerAssignedAccountID>
+<cbc:AdditionalAccountID>6</cbc:AdditionalAccountID>
+<cac:Party>
+<cac:PartyLegalEntity>
+<cbc:RegistrationName>{denomination}</cbc:RegistrationName>
+</cac:PartyLegalEntity>
+</cac:Party>
+</cac:AccountingSupplierParty>
+''' + '\n'.join(lines) + '''
+</SummaryDocuments>'''
+
+
+def send_summary(company, signed_xml_path):
+    """
+    Enviar un resumen o comunicación de baja firmado con sendSummary.
+
+    Returns:
+        Ticket de SUNAT
+    """
+    from operations.services.billing_service import BillingFileManager
+
+    # Crear ZIP en memoria (se guarda solo si BILLING_ARCHIVE_ZIP)
+    package = SunatPackage.from_file(signed_xml_path)
+    if is_zip_archiving_enabled():
+        BillingFileManager.write_artifact(package.archive_path(signed_xml_path), package.zip_bytes)
+
+    username, password = get_credentials(company)
+    soap_xml = build_envelope(SEND_SUMMARY, username, password, [
+        ('fileName', package.filename),
+        ('contentFile', package.content),
+    ])
+
+    logger.info(f"Enviando resumen/baja a SUNAT: {package.filename}")
+
+    response_text = post_envelope(company.environment, soap_xml)
+    response = parse_soap_response(response_text)
+    if response.is_fault:
+        raise SunatResponseError(f"Error SUNAT: {response.faultstring or response.faultcode}")
+
+    if not response.ticket:
+        logger.error("No se encontró ticket en la respuesta")
+        logger.error(f"Respuesta: {response_text[:500]}")
+        raise Exception("No se recibió ticket de SUNAT")
+
+    logger.info(f"Ticket recibido: {response.ticket}")
+    return response.ticket
+
+
+class BoletaSummaryService:
+    """Envío de boletas por Resumen Diario, por empresa"""
+
+    # Estados de las boletas que esperan ir en un resumen
+    PENDING_STATUSES = ('PENDING', 'ERROR')
+
+    def __init__(self, company):
+        self.company = company
+        from .billing_service import BillingFileManager
+        self.file_manager = BillingFileManager
+
+    @staticmethod
+    def is_enabled():
+        return getattr(settings, 'BILLING_BOLETA_SUMMARY', False)
+
+    @staticmethod
+    def max_lines():
+        return max(1, min(getattr(settings, 'BILLING_SUMMARY_MAX_LINES', SUNAT_SUMMARY_MAX_LINES),
+                          SUNAT_SUMMARY_MAX_LINES))
+
+    @classmethod
+    def handles(cls, operation):
+        """La operación es una boleta que se informa por resumen diario y no con sendBill"""
+        return cls.is_enabled() and operation.document is not None and operation.document.code == '03'
+
+    @classmethod
+    def pending_operations(cls, company=None, max_retries=None):
+        """Boletas pendientes de informar en un resumen"""
+        from operations.models import Operation
+
+        operations = Operation.objects.filter(
+            billing_status__in=cls.PENDING_STATUSES,
+            operation_type='S',
+            company__is_billing=True,
+            document__code='03',
+            emit_date__isnull=False
+        ).filter(
+            due()  # Solo las que no esperan un reintento programado
+        )
+        if company is not None:
+            operations = operations.filter(company=company)
+        if max_retries is not None:
+            operations = operations.filter(retry_count__lt=max_retries)
+        return operations
+
+    @classmethod
+    def submit_all(cls, max_retries=None):
+        """
+        Enviar los resúmenes de todas las empresas con boletas pendientes.
+
+        Returns:
+            Diccionario con resultados: 'success' (un elemento por resumen
+            enviado, con su ticket) y 'failed'
+        """
+        from users.models import Company
+
+        results = {
+            'success': [],
+            'failed': []
+        }
+
+        company_ids = set(cls.pending_operations(max_retries=max_retries).values_list('company_id', flat=True))
+        for company in Company.objects.filter(id__in=company_ids):
+            company_results = cls(company).submit_pending(max_retries=max_retries)
+            results['success'].extend(company_results['success'])
+            results['failed'].extend(company_results['failed'])
+
+        return results
+
+    def submit_pending(self, max_retries=None):
+        """Agrupar las boletas pendientes de la empresa en resúmenes y enviarlos"""
+        results = {
+            'success': [],
+            'failed': []
+        }
+
+        # Un solo proceso arma los resúmenes de la empresa (correlativo RC del día)
+        if not self._acquire_lock():
+            logger.info(f"Resúmenes de {self.company.ruc} en proceso en otro worker")
+            return results
+
+        try:
+            # Un resumen por fecha de emisión (ReferenceDate) y hasta max_lines boletas
+            groups = {}
+            for operation_id, emit_date in self.pending_operations(self.company, max_retries).order_by(
+                    'emit_date', 'serial', 'number').values_list('id', 'emit_date'):
+                groups.setdefault(emit_date, []).append(operation_id)
+
+            limit = self.max_lines()
+            for reference_date, operation_ids in groups.items():
+                for start in range(0, len(operation_ids), limit):
+                    chunk = operation_ids[start:start + limit]
+                    try:
+                        summary = self.submit(chunk, reference_date)
+                        if summary is not None:
+                            results['success'].append(summary)
+                    except SunatUnavailable as e:
+                        # Las boletas volvieron a PENDING; el resto espera al siguiente ciclo
+                        results['failed'].append({'reference_date': str(reference_date), 'count': len(chunk),
+                                                  'error': str(e)})
+                        return results
+                    except Exception as e:
+                        logger.error(f"Error en resumen diario de {self.company.ruc} ({reference_date}): {str(e)}")
+                        results['failed'].append({'reference_date': str(reference_date), 'count': len(chunk),
+                                                  'error': str(e)})
+        finally:
+            self._release_lock()
+
+        return results
+
+    def submit(self, operation_ids, reference_date):
+        """
+        Generar y firmar las boletas, armar el resumen, firmarlo y enviarlo.
+
+        Returns:
+            Diccionario con el resumen enviado: 'company', 'summary', 'ticket',
+            'count' y 'failed' (boletas que no se pudieron firmar), o None si
+            otro proceso tomó todas las boletas
+        """
+        from operations.models import Operation
+        from operations.services.billing_checkpoint import CHECKPOINT_FIELDS
+        from operations.services.billing_lease import claim, release, worker_id
+        from operations.services.billing_service import BillingService
+        from operations.views import get_peru_date
+
+        # Reservar las boletas que siguen pendientes (otro proceso pudo tomarlas):
+        # si este proceso se detiene, reclaim_expired las devuelve a la cola
+        owner = worker_id()
+        claimed = claim(
+            Operation.objects.filter(id__in=operation_ids, billing_status__in=self.PENDING_STATUSES),
+            len(operation_ids), owner=owner
+        )
+        if not claimed:
+            return None
+        chunk = Operation.objects.filter(id__in=[operation.id for operation in claimed])
+
+        try:
+            try:
+                operation_ids = transition_many(chunk, 'PROCESSING', expected=self.PENDING_STATUSES)
+
+                # 1. Cada boleta se genera y firma (hash de la representación impresa),
+                #    salvo las que ya tienen un XML firmado válido
+                batch = {
+                    'success': [],
+                    'failed': []
+                }
+                operations = []
+                signed, operation_ids = BillingService.resume_batch(operation_ids)
+                signed += BillingService.sign_batch(operation_ids, batch)
+                for service, item, signing, artifacts in signed:
+                    service.operation.signed_xml_file_path = signing.signed_path
+                    service.operation.hash_code = signing.digest_value
+                    operations.append(service.operation)
+                    self.file_manager.persist_artifacts(artifacts)
+
+                if not operations:
+                    raise Exception(f"Ninguna boleta del resumen se pudo firmar ({len(batch['failed'])} con error)")
+                Operation.objects.bulk_update(operations, ['signed_xml_file_path', 'hash_code'] + CHECKPOINT_FIELDS)
+
+                # 2. Resumen con una línea por boleta
+                issue_date = get_peru_date()
+                correlative = reserve_summary_correlative(self.company, issue_date)
+                summary_id = summary_identifier(issue_date, correlative)
+                operations.sort(key=lambda operation: (operation.serial or '', operation.number or 0))
+                lines = [
+                    summary_line(operation, line_id, CONDITION_ADD)
+                    for line_id, operation in enumerate(operations, start=1)
+                ]
+                xml_path = self._write_summary_xml(
+                    summary_id, build_summary_xml(self.company, summary_id, reference_date, issue_date, lines)
+                )
+
+                # El correlativo queda reservado antes del envío
+                ids = [operation.id for operation in operations]
+                summaries = Operation.objects.filter(id__in=ids)
+                summaries.update(summary_number=correlative, summary_date=issue_date, summary_ticket=None)
+
+                # 3. Firmar y enviar el resumen (una sola llamada para todas las boletas)
+                signed_xml_path = self._sign_summary_xml(xml_path)
+                ticket = send_summary(self.company, signed_xml_path)
+            except Exception as e:
+                # Las boletas que quedaron en PROCESSING vuelven a la cola
+                self._handle_failure(chunk, e)
+                raise
+
+            transition_many(
+                summaries, 'SENT', expected='PROCESSING',
+                summary_ticket=ticket,
+                sunat_error_code=None,
+                sunat_error_description=None,
+                last_retry_at=timezone.now()
+            )
+        finally:
+            release(claimed, owner=owner)
+
+        logger.info(f"Resumen {summary_id} enviado con {len(ids)} boletas. Ticket: {ticket}")
+
+        return {
+            'company': self.company,
+            'summary': summary_id,
+            'ticket': ticket,
+            'count': len(ids),
+            'failed': batch['failed']
+        }
+
+    def check_ticket(self, ticket):
+        """
+        Consultar el ticket de un resumen y aplicar el resultado a todas sus boletas.
+
+        Returns:
+            Estado aplicado a las boletas, o None si SUNAT aún procesa el ticket
+        """
+        from operations.models import Operation
+
+        username, password = get_credentials(self.company)
+        envelope = build_envelope(GET_STATUS, username, password, [('ticket', ticket)])
+        status = parse_soap_response(post_envelope(self.company.environment, envelope))
+
+        if status.is_fault:
+            raise SunatResponseError(f"Error SUNAT: {status.faultstring or status.faultcode}")
+
+        logger.info(f"Estado del ticket {ticket}: {status.statusCode}")
+        if status.statusCode == '98':
+            return None
+
+        operations = Operation.objects.filter(company=self.company, summary_ticket=ticket, billing_status='SENT')
+
+        cdr_content = status.cdr_bytes('content')
+        if cdr_content is None:
+            error = status.statusMessage or f"Error código {status.statusCode}"
+            updated = transition_many(
+                operations, 'ERROR', expected='SENT',
+                next_attempt_at=self._next_attempt(operations),
+                sunat_error_description=error,
+                retry_count=F('retry_count') + 1,
+                last_retry_at=timezone.now()
+            )
+            logger.error(f"Resumen con ticket {ticket} sin CDR ({error}): {len(updated)} boletas con error")
+            return 'ERROR'
+
+        cdr = parse_cdr(cdr_content)
+
+        summary = operations.values('summary_date', 'summary_number').first()
+        if summary and summary['summary_number']:
+            cdr_filename = f"R-{self.company.ruc}-{summary_identifier(summary['summary_date'], summary['summary_number'])}.zip"
+        else:
+            cdr_filename = f"R-{self.company.ruc}-{ticket}.zip"
+        cdr_path = self.file_manager.get_file_path(self.company.ruc, 'RESUMEN/CDR', cdr_filename)
+        self.file_manager.ensure_company_folders(self.company.ruc)
+        self.file_manager.write_artifact(cdr_path, cdr_content)
+
+        fields = {
+            'sunat_response_code': cdr.response_code,
+            'sunat_response_description': cdr.full_description() or 'Procesado por SUNAT',
+            'cdr_file_path': cdr_path,
+        }
+        if cdr.is_accepted:
+            fields.update(sunat_error_code=None, sunat_error_description=None)
+        else:
+            fields.update(sunat_error_code=cdr.response_code, sunat_error_description=cdr.description)
+        if cdr.billing_status in RETRY_STATUSES:
+            fields['next_attempt_at'] = self._next_attempt(operations)
+
+        updated = transition_many(operations, cdr.billing_status, expected='SENT', **fields)
+        logger.info(f"Resumen {cdr.reference_id} ({ticket}): {cdr.response_code} - {cdr.description}. "
+                    f"{len(updated)} boletas en {cdr.billing_status}")
+        return cdr.billing_status
+
+    def poll_ticket(self, ticket, attempts=None, delay=None):
+        """Consultar el ticket hasta que SUNAT lo procese (o se agoten los intentos)"""
+        attempts = attempts or getattr(settings, 'BILLING_SUMMARY_POLL_ATTEMPTS', 5)
+        delay = delay if delay is not None else getattr(settings, 'BILLING_SUMMARY_POLL_DELAY', 5)
+
+        for attempt in range(attempts):
+            time.sleep(delay)
+            status = self.check_ticket(ticket)
+            if status is not None:
+                return status
+            logger.info(f"⏳ Ticket {ticket} aún en proceso ({attempt + 1}/{attempts})")
+        return None
+
+    @classmethod
+    def pending_tickets(cls):
+        """(empresa, ticket) de los resúmenes enviados que esperan respuesta"""
+        from operations.models import Operation
+        from users.models import Company
+
+        rows = Operation.objects.filter(
+            billing_status='SENT',
+            document__code='03'
+        ).exclude(
+            summary_ticket__isnull=True
+        ).exclude(
+            summary_ticket=''
+        ).order_by().values_list('company_id', 'summary_ticket').distinct()
+
+        rows = list(rows)
+        companies = Company.objects.in_bulk({company_id for company_id, _ in rows})
+        return [(companies[company_id], ticket) for company_id, ticket in rows if company_id in companies]
+
+    def _handle_failure(self, operations, error):
+        """El resumen no llegó a SUNAT: las boletas vuelven a la cola"""
+        if isinstance(error, SunatUnavailable):
+            # No se envió: sin consumir reintentos
+            transition_many(operations, 'PENDING', expected='PROCESSING',
+                            next_attempt_at=unavailable_until(error.retry_after),
+                            sunat_error_description=str(error))
+            return
+
+        transition_many(
+            operations, 'ERROR', expected='PROCESSING',
+            next_attempt_at=self._next_attempt(operations),
+            sunat_error_description=str(error),
+            retry_count=F('retry_count') + 1,
+            last_retry_at=timezone.now()
+        )
+
+    def _next_attempt(self, operations):
+        """Próximo intento del grupo según el mayor número de intentos (con el de esta falla)"""
+        retries = operations.aggregate(retries=Max('retry_count'))['retries'] or 0
+        return next_attempt_at(self.company, retries + 1)
+
+    def _write_summary_xml(self, summary_id, xml_content):
+        filename = f"{self.company.ruc}-{summary_id}"
+        xml_path = self.file_manager.get_file_path(self.company.ruc, 'RESUMEN/XML', f"{filename}.xml")
+
+        os.makedirs(os.path.dirname(xml_path), exist_ok=True)
+        with open(xml_path, 'w', encoding='iso-8859-1') as f:
+            f.write(xml_content)
+
+        try:
+            with open(xml_path, 'rb') as f:
+                etree.parse(f)
+        except etree.XMLSyntaxError as e:
+            raise ValueError(f"XML de resumen no es válido: {str(e)}")
+
+        logger.info(f"XML de resumen generado: {filename}.xml")
+        return xml_path
+
+    def _sign_summary_xml(self, xml_path):
+        from .billing_service import XMLSigner
+
+        signed_path = XMLSigner(self.company).sign_xml(xml_path).signed_path
+
+        # Mover a carpeta RESUMEN/FIRMA
+        final_path = self.file_manager.get_file_path(
+            self.company.ruc, 'RESUMEN/FIRMA', os.path.basename(signed_path)
+        )
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        if signed_path != final_path:
+            os.replace(signed_path, final_path)
+
+        return final_path
+
+    def _lock_key(self):
+        return f'summary:lock:{self.company.id}'
+
+    def _acquire_lock(self):
+        try:
+            return caches['billing'].add(self._lock_key(), os.getpid(), timeout=getattr(
+                settings, 'BILLING_TASK_TIMEOUT_SECONDS', 300))
+        except Exception as e:
+            logger.warning(f"Resumen diario sin Redis ({str(e)}), se continúa sin bloqueo")
+            return True
+
+    def _release_lock(self):
+        try:
+            caches['billing'].delete(self._lock_key())
+        except Exception:
+            pass
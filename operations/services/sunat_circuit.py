@@ -0,0 +1,239 @@
+# operations/services/sunat_circuit.py
+"""
+Circuito (circuit breaker) y limitador de ritmo adaptativo para SUNAT.
+
+Circuito por ambiente, compartido entre el demonio y los workers de Celery
+(estado en el caché 'billing' de Redis):
+
+- Cerrado: las llamadas pasan; cada timeout, error de conexión, HTTP 5xx o
+  SOAP Fault de indisponibilidad suma una falla consecutiva.
+- Abierto: con SUNAT_BREAKER_FAILURES fallas seguidas las llamadas se
+  cortan de inmediato con SunatUnavailable durante SUNAT_BREAKER_COOLDOWN
+  segundos, sin esperar el timeout ni consumir reintentos del documento.
+- Semiabierto: terminada la espera pasa una sola llamada de prueba; si
+  responde el circuito se cierra, si falla se vuelve a abrir.
+
+El limitador (AIMD) espacia las llamadas de cada proceso: sube el ritmo de
+a poco mientras la latencia está por debajo del objetivo y lo reduce a la
+mitad ante una falla o una respuesta lenta.
+
+Si Redis no está disponible el circuito queda cerrado (no bloquea envíos).
+"""
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+
+class SunatUnavailable(Exception):
+    """El circuito del ambiente está abierto: no se llama a SUNAT"""
+
+    def __init__(self, environment, retry_after):
+        self.environment = environment
+        self.retry_after = max(1, int(retry_after))
+        super().__init__(f"SUNAT {environment} no disponible (circuito abierto), "
+                         f"reintentar en {self.retry_after} segundos")
+
+
+def _cache():
+    return caches['billing']
+
+
+class CircuitBreaker:
+    """Circuito de un ambiente (BETA / PRODUCTION)"""
+
+    def __init__(self, environment):
+        self.environment = environment
+        prefix = f'sunat:breaker:{environment}'
+        self.opened_key = f'{prefix}:opened_until'
+        self.failures_key = f'{prefix}:failures'
+        self.probe_key = f'{prefix}:probe'
+
+    @staticmethod
+    def is_enabled():
+        return getattr(settings, 'SUNAT_BREAKER_ENABLED', True)
+
+    @property
+    def threshold(self):
+        return getattr(settings, 'SUNAT_BREAKER_FAILURES', 5)
+
+    @property
+    def cooldown(self):
+        return getattr(settings, 'SUNAT_BREAKER_COOLDOWN', 60)
+
+    def _opened_until(self):
+        try:
+            return _cache().get(self.opened_key)
+        except Exception as e:
+            logger.warning(f"Circuito SUNAT sin Redis ({str(e)}), se considera cerrado")
+            return None
+
+    def state(self):
+        """'closed', 'open' o 'half_open'"""
+        if not self.is_enabled():
+            return 'closed'
+        opened_until = self._opened_until()
+        if opened_until is None:
+            return 'closed'
+        return 'open' if time.time() < opened_until else 'half_open'
+
+    def is_open(self):
+        """Abierto o semiabierto con la prueba en curso: no conviene enviar ahora"""
+        state = self.state()
+        if state == 'half_open':
+            try:
+                return _cache().get(self.probe_key) is not None
+            except Exception:
+                return False
+        return state == 'open'
+
+    def retry_after(self):
+        """Segundos hasta que el circuito admita una llamada de prueba"""
+        opened_until = self._opened_until()
+        if opened_until is None:
+            return 0
+        return max(0, opened_until - time.time()) or self.cooldown
+
+    def before_call(self):
+        """Lanzar SunatUnavailable si la llamada no debe salir"""
+        state = self.state()
+        if state == 'closed':
+            return
+        if state == 'half_open':
+            try:
+                # add es atómico: una sola llamada de prueba entre todos los procesos
+                if _cache().add(self.probe_key, os.getpid(), timeout=self.cooldown * 2):
+                    logger.info(f"Circuito SUNAT {self.environment} semiabierto: enviando llamada de prueba")
+                    return
+            except Exception:
+                return
+            raise SunatUnavailable(self.environment, self.cooldown)
+        raise SunatUnavailable(self.environment, self.retry_after())
+
+    def record_success(self):
+        if not self.is_enabled():
+            return
+        try:
+            cache = _cache()
+            if cache.get(self.opened_key) is not None:
+                cache.delete_many([self.opened_key, self.probe_key])
+                logger.info(f"Circuito SUNAT {self.environment} cerrado")
+            cache.delete(self.failures_key)
+        except Exception as e:
+            logger.warning(f"No se pudo actualizar el circuito SUNAT: {str(e)}")
+
+    def record_failure(self):
+        if not self.is_enabled():
+            return
+        try:
+            cache = _cache()
+            opened_until = cache.get(self.opened_key)
+            if opened_until is not None and time.time() >= opened_until:
+                # Falló la llamada de prueba
+                self._open(cache, 'falló la llamada de prueba')
+                return
+
+            if cache.add(self.failures_key, 1, timeout=self.cooldown * 10):
+                failures = 1
+            else:
+                failures = cache.incr(self.failures_key)
+
+            if failures >= self.threshold and opened_until is None:
+                self._open(cache, f'{failures} fallas consecutivas')
+        except Exception as e:
+            logger.warning(f"No se pudo actualizar el circuito SUNAT: {str(e)}")
+
+    def _open(self, cache, reason):
+        cache.set(self.opened_key, time.time() + self.cooldown, timeout=self.cooldown * 10)
+        cache.delete_many([self.probe_key, self.failures_key])
+        logger.warning(f"Circuito SUNAT {self.environment} abierto por {self.cooldown} segundos ({reason})")
+
+    def reset(self):
+        try:
+            _cache().delete_many([self.opened_key, self.failures_key, self.probe_key])
+        except Exception as e:
+            logger.warning(f"No se pudo reiniciar el circuito SUNAT: {str(e)}")
+
+
+class AdaptiveRateLimiter:
+    """Limitador AIMD de llamadas a SUNAT (uno por ambiente y proceso)"""
+
+    _limiters = {}
+    _pid = None
+    _lock = threading.Lock()
+
+    def __init__(self, environment):
+        self.environment = environment
+        self.cache_key = f'sunat:rate:{environment}'
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+        self.published_at = 0.0
+
+        # Un proceso nuevo arranca con el ritmo que aprendieron los demás
+        try:
+            shared = _cache().get(self.cache_key)
+        except Exception:
+            shared = None
+        self.rate = self._clamp(shared or getattr(settings, 'SUNAT_RATE_INITIAL', 10.0))
+
+    @classmethod
+    def get(cls, environment):
+        with cls._lock:
+            if cls._pid != os.getpid():
+                cls._limiters = {}
+                cls._pid = os.getpid()
+            limiter = cls._limiters.get(environment)
+            if limiter is None:
+                limiter = cls._limiters[environment] = cls(environment)
+            return limiter
+
+    @staticmethod
+    def is_enabled():
+        return getattr(settings, 'SUNAT_RATE_LIMIT_ENABLED', True)
+
+    @staticmethod
+    def _clamp(rate):
+        return min(getattr(settings, 'SUNAT_RATE_MAX', 50.0), max(getattr(settings, 'SUNAT_RATE_MIN', 0.5), rate))
+
+    def acquire(self):
+        """Esperar el turno de la siguiente llamada (llamadas por segundo = rate)"""
+        if not self.is_enabled():
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + 1.0 / self.rate
+        if slot > now:
+            time.sleep(slot - now)
+
+    def record(self, latency=None, failure=False):
+        """Ajustar el ritmo con el resultado de una llamada"""
+        if not self.is_enabled():
+            return
+        target = getattr(settings, 'SUNAT_RATE_TARGET_LATENCY', 5.0)
+        with self.lock:
+            previous = self.rate
+            if failure or (latency is not None and latency > target):
+                # Disminución multiplicativa
+                self.rate = self._clamp(self.rate * getattr(settings, 'SUNAT_RATE_DECREASE', 0.5))
+            else:
+                # Aumento aditivo
+                self.rate = self._clamp(self.rate + getattr(settings, 'SUNAT_RATE_INCREASE', 1.0))
+            decreased = self.rate < previous
+            publish = decreased or time.monotonic() - self.published_at > 10
+            if publish:
+                self.published_at = time.monotonic()
+            rate = self.rate
+
+        if decreased:
+            logger.info(f"Ritmo SUNAT {self.environment} reducido a {rate:.1f} llamadas/s")
+        if publish:
+            try:
+                _cache().set(self.cache_key, rate, timeout=3600)
+            except Exception:
+                pass
@@ -0,0 +1,182 @@
+# operations/services/sunat_dispatcher.py
+"""
+Despachador concurrente de llamadas a billService de SUNAT.
+
+El envío es la etapa más lenta del circuito (latencia de red y de SUNAT),
+no consume CPU. En lugar de enviar un documento a la vez, el despachador
+mantiene varias llamadas en vuelo con asyncio y dos límites:
+
+- SUNAT_DISPATCH_CONCURRENCY: llamadas simultáneas en total.
+- SUNAT_DISPATCH_PER_COMPANY: llamadas simultáneas por RUC, para no
+  saturar las credenciales SOL de una misma empresa.
+
+Las llamadas HTTP usan la sesión keep-alive de sunat_http dentro de un pool
+de hilos (run_in_executor) y pasan por el circuito y el limitador de ritmo
+de sunat_circuit. Las corrutinas nunca tocan el ORM: reciben las
+peticiones ya armadas y devuelven los resultados para que el llamador
+actualice las operaciones.
+"""
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from operations.services.sunat_soap import (
+    GET_STATUS, GET_STATUS_CDR, SEND_BILL, SEND_SUMMARY, build_envelope, get_credentials, post_envelope
+)
+
+logger = logging.getLogger(__name__)
+
+
+class DispatchRequest:
+    """Llamada a billService ya armada (no depende de modelos)"""
+
+    __slots__ = ('key', 'ruc', 'environment', 'operation', 'username', 'password', 'fields')
+
+    def __init__(self, key, ruc, environment, operation, username, password, fields):
+        # key identifica la llamada en el resultado (normalmente el id de la operación)
+        self.key = key
+        self.ruc = ruc
+        self.environment = environment
+        self.operation = operation
+        self.username = username
+        self.password = password
+        self.fields = fields
+
+    @classmethod
+    def _for_company(cls, company, key, operation, fields):
+        username, password = get_credentials(company)
+        return cls(key, company.ruc, company.environment, operation, username, password, fields)
+
+    @classmethod
+    def send_bill(cls, company, key, filename, zip_content):
+        """sendBill de un comprobante (ZIP en base64, p. ej. SunatPackage.content)"""
+        return cls._for_company(company, key, SEND_BILL, [('fileName', filename), ('contentFile', zip_content)])
+
+    @classmethod
+    def send_summary(cls, company, key, filename, zip_content):
+        """sendSummary de un resumen o comunicación de baja (ZIP en base64)"""
+        return cls._for_company(company, key, SEND_SUMMARY, [('fileName', filename), ('contentFile', zip_content)])
+
+    @classmethod
+    def get_status(cls, company, key, ticket):
+        """getStatus de un ticket"""
+        return cls._for_company(company, key, GET_STATUS, [('ticket', ticket)])
+
+    @classmethod
+    def get_status_cdr(cls, company, key, document_code, serial, number):
+        """getStatusCdr de un comprobante (billConsultService)"""
+        return cls._for_company(company, key, GET_STATUS_CDR, [
+            ('rucComprobante', company.ruc),
+            ('tipoComprobante', document_code),
+            ('serieComprobante', serial),
+            ('numeroComprobante', number),
+        ])
+
+    def build(self):
+        """Sobre SOAP en bytes"""
+        return build_envelope(self.operation, self.username, self.password, self.fields)
+
+    def __repr__(self):
+        return f"<DispatchRequest {self.operation} {self.ruc} {self.key}>"
+
+
+class DispatchResult:
+    """Respuesta (o error) de una llamada despachada"""
+
+    __slots__ = ('key', 'request', 'response_text', 'error', 'exception', 'elapsed')
+
+    def __init__(self, request, response_text=None, exception=None, elapsed=0.0):
+        self.key = request.key
+        self.request = request
+        self.response_text = response_text
+        # La excepción se conserva para distinguir p. ej. SunatUnavailable
+        self.exception = exception
+        self.error = str(exception) if exception is not None else None
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class SunatDispatcher:
+    """
+    Ejecutar un lote de llamadas a SUNAT en paralelo con límite global y por RUC.
+
+    Uso:
+        results = SunatDispatcher().dispatch(requests)
+    """
+
+    def __init__(self, max_concurrency=None, per_company=None, timeout=60):
+        self.max_concurrency = max(1, max_concurrency or getattr(settings, 'SUNAT_DISPATCH_CONCURRENCY', 10))
+        self.per_company = max(1, per_company or getattr(settings, 'SUNAT_DISPATCH_PER_COMPANY', 2))
+        self.timeout = timeout
+
+    def dispatch(self, requests):
+        """
+        Ejecutar las llamadas y esperar a que terminen todas.
+
+        Returns:
+            Lista de DispatchResult en el mismo orden que requests
+        """
+        requests = list(requests)
+        if not requests:
+            return []
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.dispatch_async(requests))
+
+        # Ya hay un event loop en este hilo: ejecutar el lote en otro hilo
+        results = []
+        worker = threading.Thread(target=lambda: results.extend(asyncio.run(self.dispatch_async(requests))))
+        worker.start()
+        worker.join()
+        return results
+
+    async def dispatch_async(self, requests):
+        """Versión asíncrona de dispatch"""
+        loop = asyncio.get_running_loop()
+        global_limit = asyncio.Semaphore(self.max_concurrency)
+        company_limits = {}
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='sunat-dispatch') as executor:
+            results = await asyncio.gather(*[
+                self._run(loop, executor, global_limit, company_limits, request)
+                for request in requests
+            ])
+
+        failed = sum(1 for result in results if not result.ok)
+        logger.info(f"Despacho SUNAT: {len(results)} llamadas en {time.monotonic() - started:.2f}s "
+                    f"({failed} con error, concurrencia {self.max_concurrency}/{self.per_company} por RUC)")
+        return results
+
+    async def _run(self, loop, executor, global_limit, company_limits, request):
+        company_limit = company_limits.get(request.ruc)
+        if company_limit is None:
+            company_limit = company_limits[request.ruc] = asyncio.Semaphore(self.per_company)
+
+        # Primero el cupo del RUC: una empresa con muchos documentos no ocupa
+        # cupos globales mientras espera el suyo
+        async with company_limit:
+            async with global_limit:
+                return await loop.run_in_executor(executor, self._call, request)
+
+    def _call(self, request):
+        """Llamada bloqueante (se ejecuta en un hilo del pool)"""
+        started = time.monotonic()
+        try:
+            response_text = post_envelope(
+                request.environment, request.build(), timeout=self.timeout,
+                consult=request.operation == GET_STATUS_CDR
+            )
+            return DispatchResult(request, response_text=response_text, elapsed=time.monotonic() - started)
+        except Exception as e:
+            logger.error(f"Error en {request.operation} ({request.ruc}, {request.key}): {str(e)}")
+            return DispatchResult(request, exception=e, elapsed=time.monotonic() - started)
@@ -0,0 +1,103 @@
+# operations/services/sunat_http.py
+"""
+Sesiones HTTP reutilizables para los servicios web de SUNAT.
+
+Cada proceso mantiene una requests.Session por ambiente (BETA / PRODUCTION)
+con un pool de conexiones keep-alive, de modo que los envíos consecutivos
+reutilizan la conexión TLS en lugar de negociarla para cada documento.
+
+Los reintentos del adaptador son solo de conexión: un POST que llegó a
+SUNAT nunca se repite automáticamente (sendBill no es idempotente).
+
+Las sesiones no se comparten entre procesos: tras un fork (workers prefork
+de Celery) el hijo descarta las heredadas y crea las suyas.
+"""
+import logging
+import os
+import threading
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+_sessions = {}
+_sessions_pid = None
+_lock = threading.Lock()
+
+
+def _build_session(environment):
+    """Crear la sesión de un ambiente con el adaptador ajustado"""
+    pool_size = getattr(settings, 'SUNAT_HTTP_POOL_SIZE', 10)
+    retry = Retry(
+        total=None,
+        connect=getattr(settings, 'SUNAT_HTTP_CONNECT_RETRIES', 3),
+        read=0,
+        status=0,
+        other=0,
+        redirect=0,
+        backoff_factor=getattr(settings, 'SUNAT_HTTP_RETRY_BACKOFF', 0.5),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=retry,
+        pool_block=False,
+    )
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Connection': 'keep-alive'})
+
+    logger.info(f"Sesión HTTP SUNAT creada para {environment} (pool {pool_size}, pid {os.getpid()})")
+    return session
+
+
+def get_session(environment):
+    """Obtener la sesión HTTP del ambiente para el proceso actual"""
+    global _sessions_pid
+
+    pid = os.getpid()
+    session = _sessions.get(environment) if _sessions_pid == pid else None
+    if session is not None:
+        return session
+
+    with _lock:
+        if _sessions_pid != pid:
+            # Sesiones heredadas de otro proceso: sus sockets no son de este
+            _sessions.clear()
+            _sessions_pid = pid
+        session = _sessions.get(environment)
+        if session is None:
+            session = _build_session(environment)
+            _sessions[environment] = session
+        return session
+
+
+def reset_sessions():
+    """Cerrar y descartar las sesiones del proceso"""
+    global _sessions_pid
+
+    with _lock:
+        if _sessions_pid == os.getpid():
+            for session in _sessions.values():
+                session.close()
+        _sessions.clear()
+        _sessions_pid = None
+
+
+def _after_fork_in_child():
+    """En el hijo no se cierran los sockets del padre, solo se olvidan"""
+    global _lock, _sessions_pid
+
+    _lock = threading.Lock()
+    _sessions.clear()
+    _sessions_pid = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
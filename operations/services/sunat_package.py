@@ -0,0 +1,64 @@
+# operations/services/sunat_package.py
+"""
+Empaquetado en memoria de los XML firmados que se envían a SUNAT.
+
+SUNAT recibe el XML firmado dentro de un ZIP codificado en base64. El ZIP se
+arma en un BytesIO a partir de los bytes firmados y el base64 se inserta
+tal cual en el sobre SOAP, sin escribir ni releer el ZIP en disco.
+
+El ZIP solo se guarda (junto al XML firmado) si BILLING_ARCHIVE_ZIP está
+activo; SUNAT no lo exige y siempre se puede reconstruir desde el XML.
+"""
+import base64
+import io
+import os
+import zipfile
+
+from django.conf import settings
+
+
+def is_archiving_enabled():
+    """Guardar el ZIP enviado en disco (BILLING_ARCHIVE_ZIP)"""
+    return getattr(settings, 'BILLING_ARCHIVE_ZIP', False)
+
+
+class SunatPackage:
+    """ZIP (deflate) de un XML firmado listo para sendBill / sendSummary"""
+
+    __slots__ = ('filename', 'zip_bytes', '_content')
+
+    def __init__(self, filename, zip_bytes):
+        self.filename = filename
+        self.zip_bytes = zip_bytes
+        self._content = None
+
+    @classmethod
+    def from_xml(cls, xml_filename, xml_content):
+        """
+        Crear el paquete desde los bytes del XML firmado.
+
+        Args:
+            xml_filename: nombre del XML dentro del ZIP (RUC-TIPO-SERIE-NUMERO.xml)
+            xml_content: bytes del XML firmado
+        """
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            zipf.writestr(xml_filename, xml_content)
+        return cls(xml_filename.replace('.xml', '.zip'), buffer.getvalue())
+
+    @classmethod
+    def from_file(cls, xml_path):
+        """Crear el paquete leyendo una sola vez el XML firmado del disco"""
+        with open(xml_path, 'rb') as f:
+            return cls.from_xml(os.path.basename(xml_path), f.read())
+
+    @property
+    def content(self):
+        """ZIP en base64 (bytes ASCII, se inserta directo en el sobre SOAP)"""
+        if self._content is None:
+            self._content = base64.b64encode(self.zip_bytes)
+        return self._content
+
+    def archive_path(self, xml_path):
+        """Ruta del ZIP junto al XML firmado"""
+        return os.path.join(os.path.dirname(xml_path), self.filename)
@@ -0,0 +1,182 @@
+# operations/services/sunat_response.py
+"""
+Lectura de las respuestas SOAP de billService y de los CDR de SUNAT.
+
+Las respuestas se recorren con lxml.etree.iterparse sobre los bytes
+recibidos: solo se conservan los campos que interesan (applicationResponse,
+ticket, statusCode, content, faultcode/faultstring) y cada elemento se
+libera al terminar de leerlo, de modo que un CDR o una respuesta de
+resumen grande se procesa con memoria acotada.
+
+El CDR (ZIP con el ApplicationResponse UBL) se abre desde memoria y se lee
+en flujo desde el propio ZIP, sin escribirlo ni decodificarlo a texto.
+
+Una respuesta que no se puede interpretar lanza SunatResponseError; nunca
+se asume que el documento fue aceptado.
+"""
+import base64
+import io
+import zipfile
+
+from lxml import etree
+
+from operations.services.ubl_writer import CAC, CBC
+
+# Campos de la respuesta SOAP (sin namespace en las respuestas de SUNAT)
+SOAP_FIELDS = ('applicationResponse', 'ticket', 'statusCode', 'statusMessage', 'content', 'faultcode', 'faultstring')
+
+
+class SunatResponseError(Exception):
+    """La respuesta de SUNAT no tiene el formato esperado"""
+
+
+class SunatResponse:
+    """Campos de una respuesta SOAP de billService"""
+
+    __slots__ = SOAP_FIELDS
+
+    def __init__(self, **fields):
+        for name in SOAP_FIELDS:
+            setattr(self, name, fields.get(name))
+
+    @property
+    def is_fault(self):
+        return self.faultstring is not None or self.faultcode is not None
+
+    def cdr_bytes(self, field='applicationResponse'):
+        """CDR (ZIP) decodificado de applicationResponse o de content (getStatus)"""
+        value = getattr(self, field)
+        if not value:
+            return None
+        try:
+            return base64.b64decode(value)
+        except (ValueError, TypeError) as e:
+            raise SunatResponseError(f"Error decodificando el CDR: {str(e)}")
+
+
+class CDRResult:
+    """Resultado de un CDR (ApplicationResponse de SUNAT)"""
+
+    __slots__ = ('response_code', 'description', 'notes', 'reference_id', 'document_id')
+
+    def __init__(self, response_code, description=None, notes=None, reference_id=None, document_id=None):
+        self.response_code = response_code
+        self.description = description
+        # Observaciones (cbc:Note), p. ej. "4252 - El dato ingresado ..."
+        self.notes = notes or []
+        # Documento al que responde (serie-número)
+        self.reference_id = reference_id
+        self.document_id = document_id
+
+    @property
+    def code(self):
+        try:
+            return int(self.response_code)
+        except (TypeError, ValueError):
+            return None
+
+    @property
+    def is_accepted(self):
+        """0 = aceptado; 4000 en adelante son observaciones (también aceptado)"""
+        return self.code == 0 or (self.code is not None and self.code >= 4000)
+
+    @property
+    def billing_status(self):
+        """Estado de facturación que corresponde al CDR"""
+        if not self.is_accepted:
+            return 'REJECTED'
+        if self.notes or self.code != 0:
+            return 'ACCEPTED_WITH_OBSERVATIONS'
+        return 'ACCEPTED'
+
+    def full_description(self):
+        """Descripción con las observaciones, para guardar en la operación"""
+        description = self.description or ''
+        if self.notes:
+            description = f"{description}\nObservaciones:\n" + '\n'.join(self.notes)
+        return description.strip()
+
+    def __repr__(self):
+        return f"<CDRResult {self.response_code} {self.reference_id}>"
+
+
+def _iterparse(source, tags):
+    return etree.iterparse(source, events=('end',), tag=tags, huge_tree=True,
+                           resolve_entities=False, no_network=True)
+
+
+def parse_soap_response(response):
+    """
+    Leer una respuesta SOAP de sendBill, sendSummary, getStatus o getStatusCdr.
+
+    Args:
+        response: bytes o texto de la respuesta
+
+    Returns:
+        SunatResponse
+    """
+    if isinstance(response, str):
+        response = response.encode('utf-8')
+
+    fields = {}
+    tags = [f'{{*}}{name}' for name in SOAP_FIELDS]
+    try:
+        for _, element in _iterparse(io.BytesIO(response), tags):
+            name = etree.QName(element).localname
+            if name not in fields:
+                fields[name] = (element.text or '').strip()
+            element.clear()
+    except etree.XMLSyntaxError as e:
+        raise SunatResponseError(f"Respuesta de SUNAT no es XML válido: {str(e)}")
+
+    return SunatResponse(**fields)
+
+
+def parse_cdr(cdr_content):
+    """
+    Leer el CDR (ZIP) devuelto por SUNAT.
+
+    Returns:
+        CDRResult
+    """
+    try:
+        with zipfile.ZipFile(io.BytesIO(cdr_content), 'r') as zip_ref:
+            xml_files = [name for name in zip_ref.namelist() if name.lower().endswith('.xml')]
+            if not xml_files:
+                raise SunatResponseError("El CDR no contiene un XML")
+            with zip_ref.open(xml_files[0]) as xml_file:
+                return _parse_application_response(xml_file)
+    except zipfile.BadZipFile:
+        raise SunatResponseError("El CDR no es un ZIP válido")
+
+
+def _parse_application_response(source):
+    values = {'notes': []}
+    tags = [f'{CBC}ResponseCode', f'{CBC}Description', f'{CBC}ReferenceID', f'{CBC}Note', f'{CBC}ID']
+
+    try:
+        for _, element in _iterparse(source, tags):
+            name = etree.QName(element).localname
+            parent = element.getparent()
+            parent_tag = parent.tag if parent is not None else None
+            text = (element.text or '').strip()
+
+            if parent_tag == f'{CAC}Response':
+                # Primer cac:Response (el del documento)
+                key = {'ResponseCode': 'response_code', 'Description': 'description',
+                       'ReferenceID': 'reference_id'}.get(name)
+                if key and key not in values:
+                    values[key] = text
+            elif name == 'Note' and parent is not None and parent.getparent() is None:
+                values['notes'].append(text)
+            elif name == 'ID' and parent_tag == f'{CAC}DocumentReference' and 'document_id' not in values:
+                values['document_id'] = text
+
+            element.clear()
+    except etree.XMLSyntaxError as e:
+        raise SunatResponseError(f"CDR no es XML válido: {str(e)}")
+
+    if not values.get('response_code'):
+        raise SunatResponseError("El CDR no contiene ResponseCode")
+
+    return CDRResult(**values)
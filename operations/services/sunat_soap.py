@@ -0,0 +1,224 @@
+# operations/services/sunat_soap.py
+"""
+Piezas comunes de las llamadas SOAP a billService de SUNAT.
+
+URL del servicio por ambiente, credenciales SOL de la empresa, sobre SOAP
+con WS-Security (sendBill, sendSummary, getStatus, getStatusCdr) y verificación de la
+respuesta HTTP. Las usan SunatConnector, CancellationService y el
+despachador concurrente.
+"""
+import logging
+import re
+import time
+from xml.sax.saxutils import escape
+
+import requests
+from django.conf import settings
+from lxml import etree
+
+from operations.services.sunat_circuit import AdaptiveRateLimiter, CircuitBreaker
+from operations.services.sunat_http import get_session
+
+logger = logging.getLogger(__name__)
+
+SERVICE_URLS = {
+    'BETA': 'https://e-beta.sunat.gob.pe/ol-ti-itcpfegem-beta/billService',
+    'PRODUCTION': 'https://e-factura.sunat.gob.pe/ol-ti-itcpfegem/billService',
+}
+
+SOAP_HEADERS = {
+    'Content-Type': 'text/xml; charset=utf-8',
+    'SOAPAction': '""',
+    'Accept': 'text/xml',
+    'Cache-Control': 'no-cache',
+    'Pragma': 'no-cache',
+}
+
+# Servicio de consulta de CDR (getStatusCdr)
+CONSULT_URLS = {
+    'BETA': 'https://e-beta.sunat.gob.pe/ol-it-wsconscpegem-beta/billConsultService',
+    'PRODUCTION': 'https://e-factura.sunat.gob.pe/ol-it-wsconscpegem/billConsultService',
+}
+
+SEND_BILL = 'sendBill'
+SEND_SUMMARY = 'sendSummary'
+GET_STATUS = 'getStatus'
+GET_STATUS_CDR = 'getStatusCdr'
+
+# Documento ya registrado en SUNAT (p. ej. reenvío tras un timeout)
+DUPLICATE_CODES = {'1032', '1033', '2223'}
+DUPLICATE_MESSAGE = re.compile(r'ya (fue|esta|está|ha sido) informad|registrado previamente', re.IGNORECASE)
+
+
+def get_service_url(environment):
+    """
+    URL de billService (sin ?wsdl) del ambiente.
+    SUNAT_SERVICE_URL la reemplaza en todos los ambientes (p. ej. el servidor
+    de pruebas local de sunat_stub_server).
+    """
+    override = getattr(settings, 'SUNAT_SERVICE_URL', '')
+    if override:
+        return override
+    if environment == 'BETA':
+        return SERVICE_URLS['BETA']
+    return SERVICE_URLS['PRODUCTION']
+
+
+def get_consult_url(environment):
+    """URL de billConsultService del ambiente (SUNAT_SERVICE_URL la reemplaza)"""
+    override = getattr(settings, 'SUNAT_SERVICE_URL', '')
+    if override:
+        return override
+    if environment == 'BETA':
+        return CONSULT_URLS['BETA']
+    return CONSULT_URLS['PRODUCTION']
+
+
+def get_credentials(company):
+    """Usuario y clave SOL; en BETA se usan las credenciales de prueba"""
+    if company.environment == 'BETA':
+        return f"{company.ruc}MODDATOS", "moddatos"
+    return f"{company.ruc}{company.sunat_username}", company.sunat_password
+
+
+def build_envelope(operation, username, password, fields):
+    """
+    Construir el sobre SOAP de una operación de billService.
+
+    Args:
+        operation: sendBill, sendSummary o getStatus
+        fields: lista de (nombre, valor) del cuerpo; los valores str se
+            escapan y los bytes (base64 del ZIP) se insertan sin copiarlos
+            a texto
+
+    Returns:
+        Sobre en bytes UTF-8
+    """
+    parts = [(
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" '
+        'xmlns:ser="http://service.sunat.gob.pe" '
+        'xmlns:wsse="http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-secext-1.0.xsd">'
+        '<soapenv:Header><wsse:Security><wsse:UsernameToken>'
+        f'<wsse:Username>{escape(username)}</wsse:Username>'
+        f'<wsse:Password>{escape(password or "")}</wsse:Password>'
+        '</wsse:UsernameToken></wsse:Security></soapenv:Header>'
+        f'<soapenv:Body><ser:{operation}>'
+    ).encode('utf-8')]
+
+    for name, value in fields:
+        parts.append(f'<{name}>'.encode('utf-8'))
+        parts.append(value if isinstance(value, bytes) else escape(str(value)).encode('utf-8'))
+        parts.append(f'</{name}>'.encode('utf-8'))
+
+    parts.append(f'</ser:{operation}></soapenv:Body></soapenv:Envelope>'.encode('utf-8'))
+    return b''.join(parts)
+
+
+class SunatServiceError(Exception):
+    """SUNAT no respondió o falló el servicio (timeouts, 5xx); alimenta el circuito"""
+
+
+class SunatFault(Exception):
+    """SOAP Fault de SUNAT con su código (p. ej. 1033, 0109)"""
+
+    def __init__(self, fault_code, fault_string):
+        self.fault_code = fault_code
+        self.fault_string = fault_string
+        # 'soap-env:Client.1033' -> '1033'; a veces el código viene en faultstring
+        match = re.search(r'(\d{4})$', fault_code or '') or re.fullmatch(r'\s*(\d{4})\s*', fault_string or '')
+        self.code = match.group(1) if match else None
+        super().__init__(f"SOAP Fault - Code: {fault_code}, Message: {fault_string}")
+
+
+def is_duplicate_submission(error):
+    """El error indica que SUNAT ya tiene registrado el documento"""
+    if isinstance(error, SunatFault) and error.code in DUPLICATE_CODES:
+        return True
+    return bool(DUPLICATE_MESSAGE.search(str(error)))
+
+
+class SunatServiceFault(SunatFault, SunatServiceError):
+    """SOAP Fault que indica que el servicio de SUNAT no está disponible"""
+
+
+# Códigos de SOAP Fault de indisponibilidad de SUNAT (no dependen del documento)
+SERVICE_FAULT_CODES = {
+    '0109', '0110', '0111', '0130', '0131', '0132', '0133', '0134', '0135', '0136', '0137', '0138',
+    '0200', '0201', '0202', '0203', '0204',
+}
+
+
+def raise_for_response(status_code, text):
+    """Lanzar una excepción con el SOAP Fault si la respuesta no es HTTP 200"""
+    if status_code == 200:
+        return
+
+    if 'soap' in text.lower() and 'fault' in text.lower():
+        try:
+            fault_tree = etree.fromstring(text.encode('utf-8'))
+        except etree.XMLSyntaxError:
+            fault_tree = None
+
+        if fault_tree is not None:
+            # faultcode/faultstring suelen venir sin namespace
+            fault = SunatFault(
+                fault_tree.findtext('.//{*}faultcode') or 'Unknown',
+                fault_tree.findtext('.//{*}faultstring') or 'Unknown'
+            )
+            if fault.code in SERVICE_FAULT_CODES:
+                raise SunatServiceFault(fault.fault_code, fault.fault_string)
+            raise fault
+
+    if status_code >= 500:
+        raise SunatServiceError(f"Error HTTP {status_code}: {text[:500]}")
+    raise Exception(f"Error HTTP {status_code}: {text[:500]}")
+
+
+def post_envelope(environment, envelope, timeout=60, consult=False):
+    """
+    Enviar un sobre SOAP a billService (o a billConsultService si consult)
+    con la sesión keep-alive del ambiente.
+
+    Pasa por el circuito del ambiente (SunatUnavailable si está abierto) y
+    por el limitador de ritmo adaptativo.
+
+    Returns:
+        Texto de la respuesta (HTTP 200)
+    """
+    breaker = CircuitBreaker(environment)
+    breaker.before_call()
+    limiter = AdaptiveRateLimiter.get(environment)
+    limiter.acquire()
+
+    started = time.monotonic()
+    try:
+        try:
+            response = get_session(environment).post(
+                get_consult_url(environment) if consult else get_service_url(environment),
+                data=envelope,
+                headers=SOAP_HEADERS,
+                timeout=timeout,
+                verify=True
+            )
+        except requests.exceptions.Timeout:
+            raise SunatServiceError("Timeout al conectar con SUNAT")
+        except requests.exceptions.RequestException as e:
+            raise SunatServiceError(f"Error de conexión: {str(e)}")
+
+        logger.info(f"Respuesta HTTP: {response.status_code}")
+
+        raise_for_response(response.status_code, response.text)
+    except SunatServiceError:
+        breaker.record_failure()
+        limiter.record(failure=True)
+        raise
+    except Exception:
+        # Rechazo del documento: SUNAT respondió
+        breaker.record_success()
+        limiter.record(time.monotonic() - started)
+        raise
+
+    breaker.record_success()
+    limiter.record(time.monotonic() - started)
+    return response.text
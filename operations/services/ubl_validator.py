@@ -0,0 +1,144 @@
+# operations/services/ubl_validator.py
+"""
+Validación previa (preflight) de documentos UBL 2.1 contra los XSD.
+
+Los esquemas se compilan una sola vez por proceso y quedan en caché. Un
+documento que no cumple el esquema se marca localmente como INVALID con el
+detalle de los errores, en lugar de viajar a SUNAT para ser rechazado y
+consumir reintentos del demonio.
+
+Los XSD de UBL 2.1 (distribución oficial, carpeta xsd/) deben estar en
+BILLING_UBL_XSD_ROOT; si no existen la validación se omite.
+"""
+import logging
+import os
+import threading
+
+from django.conf import settings
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+# Esquema principal por elemento raíz, relativo a BILLING_UBL_XSD_ROOT
+SCHEMA_FILES = {
+    'Invoice': os.path.join('maindoc', 'UBL-Invoice-2.1.xsd'),
+    'CreditNote': os.path.join('maindoc', 'UBL-CreditNote-2.1.xsd'),
+}
+
+# Máximo de errores que se guardan en la operación
+MAX_REPORTED_ERRORS = 10
+
+
+def is_enabled():
+    """La validación previa es opcional (BILLING_XSD_VALIDATION)"""
+    return getattr(settings, 'BILLING_XSD_VALIDATION', False)
+
+
+def describe_location(error):
+    """Ubicación del error: línea si el XML viene de un archivo, XPath si se generó en memoria"""
+    if error['line']:
+        return f"Línea {error['line']}"
+    return error['path'] or 'Documento'
+
+
+class UBLValidationError(Exception):
+    """El documento no cumple el esquema UBL 2.1"""
+
+    def __init__(self, document_type, errors):
+        self.document_type = document_type
+        # Lista de dicts: line, column, message, path
+        self.errors = errors
+        super().__init__(self.format())
+
+    def format(self, limit=MAX_REPORTED_ERRORS):
+        """Texto legible con los primeros errores"""
+        lines = [f"XML {self.document_type} no cumple el esquema UBL 2.1 ({len(self.errors)} errores)"]
+        for error in self.errors[:limit]:
+            lines.append(f"{describe_location(error)}: {error['message']}")
+        return '\n'.join(lines)
+
+
+class UBLValidator:
+    """Caché de esquemas XSD compilados (uno por tipo de documento y proceso)"""
+
+    _schemas = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_schema(cls, root_element):
+        """
+        Obtener el XMLSchema compilado del tipo de documento.
+        Devuelve None si los XSD no están disponibles (también queda en caché).
+        """
+        if root_element in cls._schemas:
+            return cls._schemas[root_element][0]
+
+        with cls._lock:
+            if root_element not in cls._schemas:
+                # El lock también serializa la validación con este esquema
+                cls._schemas[root_element] = (cls._compile(root_element), threading.Lock())
+            return cls._schemas[root_element][0]
+
+    @classmethod
+    def _compile(cls, root_element):
+        schema_file = SCHEMA_FILES.get(root_element)
+        if schema_file is None:
+            logger.warning(f"Sin esquema XSD para documentos {root_element}")
+            return None
+
+        xsd_root = getattr(settings, 'BILLING_UBL_XSD_ROOT', None)
+        schema_path = os.path.join(xsd_root, schema_file) if xsd_root else None
+        if not schema_path or not os.path.exists(schema_path):
+            logger.warning(f"XSD UBL no encontrado ({schema_path}), se omite la validación de {root_element}")
+            return None
+
+        schema = etree.XMLSchema(etree.parse(schema_path))
+        logger.info(f"Esquema XSD compilado: {schema_path}")
+        return schema
+
+    @classmethod
+    def validate(cls, document):
+        """
+        Validar un árbol UBL (ElementTree o elemento raíz).
+
+        Returns:
+            Lista de errores (vacía si es válido o si no hay esquema)
+        """
+        root = document.getroot() if hasattr(document, 'getroot') else document
+        root_element = etree.QName(root).localname
+
+        schema = cls.get_schema(root_element)
+        if schema is None:
+            return []
+
+        # El log de errores pertenece al esquema: no validar en paralelo con él
+        with cls._schemas[root_element][1]:
+            if schema.validate(root):
+                return []
+            entries = list(schema.error_log)
+
+        errors = []
+        for entry in entries:
+            # Antes de firmar ExtensionContent todavía está vacío
+            if entry.path and entry.path.endswith('ExtensionContent'):
+                continue
+            errors.append({
+                'line': entry.line,
+                'column': entry.column,
+                'message': entry.message,
+                'path': entry.path,
+            })
+        return errors
+
+    @classmethod
+    def check(cls, document):
+        """Validar y lanzar UBLValidationError si el documento no es válido"""
+        errors = cls.validate(document)
+        if errors:
+            root = document.getroot() if hasattr(document, 'getroot') else document
+            raise UBLValidationError(etree.QName(root).localname, errors)
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._schemas.clear()
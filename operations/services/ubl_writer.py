@@ -0,0 +1,150 @@
+# operations/services/ubl_writer.py
+"""
+Escritor de documentos UBL 2.1 sobre lxml.
+
+Los documentos se construyen directamente como árbol de elementos (con los
+mapas de namespaces precompilados), de modo que el costo crece linealmente
+con la cantidad de líneas y el árbol puede pasarse tal cual al firmador sin
+serializar y volver a parsear.
+"""
+import copy
+import threading
+
+from lxml import etree
+
+UBL_NAMESPACES = {
+    'cac': 'urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2',
+    'cbc': 'urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2',
+    'ccts': 'urn:un:unece:uncefact:documentation:2',
+    'ds': 'http://www.w3.org/2000/09/xmldsig#',
+    'ext': 'urn:oasis:names:specification:ubl:schema:xsd:CommonExtensionComponents-2',
+    'qdt': 'urn:oasis:names:specification:ubl:schema:xsd:QualifiedDatatypes-2',
+    'udt': 'urn:un:unece:uncefact:data:specification:UnqualifiedDataTypesSchemaModule:2',
+    'xsi': 'http://www.w3.org/2001/XMLSchema-instance',
+}
+
+DOCUMENT_NAMESPACES = {
+    'Invoice': 'urn:oasis:names:specification:ubl:schema:xsd:Invoice-2',
+    'CreditNote': 'urn:oasis:names:specification:ubl:schema:xsd:CreditNote-2',
+}
+
+# Mapas de namespaces precompilados por tipo de documento raíz
+DOCUMENT_NSMAPS = {
+    root_element: {None: namespace, **UBL_NAMESPACES}
+    for root_element, namespace in DOCUMENT_NAMESPACES.items()
+}
+
+CAC = '{%s}' % UBL_NAMESPACES['cac']
+CBC = '{%s}' % UBL_NAMESPACES['cbc']
+EXT = '{%s}' % UBL_NAMESPACES['ext']
+
+XML_ENCODING = 'ISO-8859-1'
+
+
+def _text(value):
+    """Texto de un nodo: None se escribe vacío"""
+    if value is None:
+        return ''
+    return value if isinstance(value, str) else str(value)
+
+
+def cac(parent, name):
+    """Agregar un elemento agregado (cac:) vacío"""
+    return etree.SubElement(parent, CAC + name)
+
+
+def cbc(parent, name, value=None, attrib=None):
+    """Agregar un elemento básico (cbc:) con texto y atributos opcionales"""
+    element = etree.SubElement(parent, CBC + name, attrib)
+    if value is not None:
+        element.text = _text(value)
+    return element
+
+
+def amount(parent, name, value, currency):
+    """Agregar un importe cbc: con su atributo currencyID"""
+    return cbc(parent, name, value, {'currencyID': _text(currency)})
+
+
+class UBLWriter:
+    """Construcción incremental de un documento UBL (Invoice / CreditNote)"""
+
+    def __init__(self, root_element='Invoice'):
+        nsmap = DOCUMENT_NSMAPS[root_element]
+        self.root = etree.Element('{%s}%s' % (nsmap[None], root_element), nsmap=nsmap)
+        self.document = etree.ElementTree(self.root)
+
+    def add_extension_content(self):
+        """Agregar UBLExtensions con el ExtensionContent vacío donde irá la firma"""
+        extensions = etree.SubElement(self.root, EXT + 'UBLExtensions')
+        extension = etree.SubElement(extensions, EXT + 'UBLExtension')
+        return etree.SubElement(extension, EXT + 'ExtensionContent')
+
+
+def serialize_document(document):
+    """Serializar un documento UBL con la declaración que espera SUNAT"""
+    return etree.tostring(
+        document,
+        encoding=XML_ENCODING,
+        xml_declaration=True,
+        standalone=False,
+        pretty_print=False
+    )
+
+
+class CompanyFragmentCache:
+    """
+    Caché por proceso de fragmentos UBL que solo dependen de la empresa
+    (bloque de firma y datos del emisor).
+
+    La clave es Company.id + updated_at, de modo que un cambio guardado en
+    otro proceso también deja obsoleta la entrada. Company.save invalida la
+    entrada de la empresa en el proceso actual.
+    """
+
+    _fragments = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def append(cls, parent, company, name, builder):
+        """
+        Agregar a parent una copia del fragmento name de la empresa.
+        builder(parent) construye el fragmento la primera vez.
+        """
+        fragment = cls._get(company, name, builder)
+        parent.append(copy.deepcopy(fragment))
+
+    @classmethod
+    def _get(cls, company, name, builder):
+        key = (company.pk, company.updated_at)
+        with cls._lock:
+            entry = cls._fragments.get(company.pk)
+            if entry is not None and entry[0] == key:
+                fragment = entry[1].get(name)
+                if fragment is not None:
+                    return fragment
+
+        # Se construye con los mismos namespaces del documento para que la
+        # copia no arrastre declaraciones propias al insertarse
+        holder = etree.Element(CAC + 'Fragment', nsmap=UBL_NAMESPACES)
+        builder(holder)
+        fragment = holder[0]
+
+        with cls._lock:
+            entry = cls._fragments.get(company.pk)
+            if entry is None or entry[0] != key:
+                entry = (key, {})
+                cls._fragments[company.pk] = entry
+            entry[1][name] = fragment
+        return fragment
+
+    @classmethod
+    def invalidate(cls, company_id):
+        """Descartar los fragmentos de una empresa"""
+        with cls._lock:
+            cls._fragments.pop(company_id, None)
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._fragments.clear()
@@ -3,8 +3,6 @@ from __future__ import absolute_import, unicode_literals
 # 3. TASKS PARA PROCESAMIENTO ASÍNCRONO
 # ================================
 from celery import shared_task
-from django.utils import timezone
-from datetime import timedelta
 import logging
 
 logger = logging.getLogger('operations.tasks')
@@ -20,6 +18,8 @@ def process_electronic_billing_task(self, operation_id):
         # Importar aquí para evitar imports circulares
         from operations.models import Operation
         from operations.services.billing_service import BillingService
+        from operations.services.billing_lease import claim_operation, release
+        from operations.services.billing_state import StaleTransition, transition
 
         # Verificar que la operación existe
         try:
@@ -34,21 +34,59 @@ def process_electronic_billing_task(self, operation_id):
             logger.info(f"Operación {operation_id} ya procesada: {operation.billing_status}")
             return {"status": "skipped", "message": f"Operación ya procesada: {operation.billing_status}"}
 
-        # Actualizar estado a procesando
-        operation.billing_status = 'PROCESSING'
-        operation.save()
+        # Boletas en modo resumen diario: quedan pendientes para el próximo resumen
+        from operations.services.summary_service import BoletaSummaryService
+        if BoletaSummaryService.handles(operation):
+            if operation.billing_status not in BoletaSummaryService.PENDING_STATUSES + ('PROCESSING', 'SENT'):
+                try:
+                    transition(operation, 'PENDING')
+                except StaleTransition as e:
+                    logger.info(str(e))
+            logger.info(f"Boleta {operation} se enviará en el resumen diario")
+            return {"status": "deferred", "message": "La boleta se enviará en el resumen diario"}
+
+        # Con el circuito SUNAT abierto se reprograma sin consumir reintentos
+        from operations.services.sunat_circuit import CircuitBreaker
+        breaker = CircuitBreaker(operation.company.environment)
+        if breaker.is_open():
+            return _defer_billing(operation_id, breaker)
+
+        # Tope de documentos en curso por empresa: se reprograma sin consumir reintentos
+        from operations.services.fair_scheduler import company_slots
+        if company_slots(operation.company_id) == 0:
+            return _defer_company(operation_id, operation.company_id)
+
+        # Reservar la operación: el demonio u otro worker pueden estar facturándola
+        if not claim_operation(operation):
+            logger.info(f"Operación {operation_id} reservada por otro proceso")
+            return {"status": "skipped", "message": "La operación está siendo procesada por otro proceso"}
 
-        # Procesar facturación
-        logger.info(f"Iniciando BillingService para operación {operation_id}")
-        billing_service = BillingService(operation_id)
-        success = billing_service.process_electronic_billing()
+        try:
+            # Actualizar estado a procesando (solo si nadie la cambió desde que se leyó)
+            try:
+                transition(operation, 'PROCESSING')
+            except StaleTransition as e:
+                logger.info(str(e))
+                return {"status": "skipped", "message": "La operación cambió de estado en otro proceso"}
+
+            # Procesar facturación
+            logger.info(f"Iniciando BillingService para operación {operation_id}")
+            billing_service = BillingService(operation_id, operation=operation)
+            success = billing_service.process_electronic_billing()
+
+            if success:
+                logger.info(f"Facturación exitosa para operación {operation_id}")
+                return {"status": "success", "message": f"Facturación procesada exitosamente: {operation_id}"}
+            else:
+                # El circuito se abrió durante el envío: la operación volvió a PENDING
+                operation.refresh_from_db(fields=['billing_status'])
+                if operation.billing_status == 'PENDING' and breaker.is_open():
+                    return _defer_billing(operation_id, breaker)
 
-        if success:
-            logger.info(f"Facturación exitosa para operación {operation_id}")
-            return {"status": "success", "message": f"Facturación procesada exitosamente: {operation_id}"}
-        else:
-            logger.error(f"Error en facturación para operación {operation_id}")
-            raise Exception("Error en procesamiento de facturación")
+                logger.error(f"Error en facturación para operación {operation_id}")
+                raise Exception("Error en procesamiento de facturación")
+        finally:
+            release([operation])
 
     except Exception as e:
         logger.error(f"Error crítico en task {operation_id}: {str(e)}", exc_info=True)
@@ -62,16 +100,94 @@ def process_electronic_billing_task(self, operation_id):
             # Actualizar estado después de agotar reintentos
             try:
                 from operations.models import Operation
+                from operations.services.billing_state import transition
                 operation = Operation.objects.get(id=operation_id)
-                operation.billing_status = 'ERROR'
-                operation.sunat_error_description = f"Error después de {self.max_retries} reintentos: {str(e)}"
-                operation.save()
+                # No pisar un estado final registrado mientras tanto (p. ej. por el demonio)
+                transition(
+                    operation, 'ERROR', expected=('PENDING', 'PROCESSING', 'ERROR'),
+                    sunat_error_description=f"Error después de {self.max_retries} reintentos: {str(e)}"
+                )
             except:
                 pass
 
             return {"status": "error", "message": f"Error final: {str(e)}"}
 
 
+def _defer_billing(operation_id, breaker):
+    """Reprogramar la facturación para cuando el circuito admita una prueba"""
+    countdown = int(breaker.retry_after()) + 1
+    logger.warning(f"SUNAT {breaker.environment} no disponible, operación {operation_id} reprogramada en {countdown}s")
+    process_electronic_billing_task.apply_async((operation_id,), countdown=countdown)
+    return {"status": "deferred", "message": f"SUNAT no disponible, reprogramada en {countdown} segundos"}
+
+
+def _defer_company(operation_id, company_id):
+    """Reprogramar la facturación cuando la empresa tiene el tope de documentos en curso"""
+    from django.conf import settings
+    countdown = getattr(settings, 'BILLING_COMPANY_DEFER_SECONDS', 30)
+    logger.info(f"Empresa {company_id} con el tope de documentos en curso, operación {operation_id} reprogramada en {countdown}s")
+    process_electronic_billing_task.apply_async((operation_id,), countdown=countdown)
+    return {"status": "deferred", "message": f"Empresa con el tope de documentos en curso, reprogramada en {countdown} segundos"}
+
+
+@shared_task(bind=True, name='operations.process_electronic_billing_bulk')
+def process_electronic_billing_bulk_task(self, operation_ids, chunk_size=200):
+    """
+    Task para facturar un lote grande (p. ej. el atraso tras una caída de SUNAT).
+    La firma se reparte entre todos los núcleos con el pool de firma.
+    """
+    from operations.models import Operation
+    from operations.services.billing_lease import available, claim, release
+    from operations.services.billing_service import BillingService
+    from operations.services.fair_scheduler import FairScheduler, in_order
+    from operations.services.summary_service import BoletaSummaryService
+
+    logger.info(f"=======>|| TASK LOTE INICIADO - {len(operation_ids)} operaciones")
+
+    # Omitir las que ya fueron procesadas
+    pending = Operation.objects.filter(
+        id__in=operation_ids
+    ).exclude(
+        billing_status__in=['ACCEPTED', 'CANCELLED']
+    )
+    if BoletaSummaryService.is_enabled():
+        # Las boletas van en el resumen diario
+        pending = pending.exclude(document__code='03')
+    pending_ids = list(pending.values_list('id', flat=True))
+
+    success = 0
+    failed = 0
+    claimed = 0
+    remaining = set(pending_ids)
+    while remaining:
+        # Solo las que no tiene reservadas otro proceso (demonio u otro worker),
+        # repartidas entre empresas y sin pasar el tope de cada una
+        ids = FairScheduler(chunk_size).select(Operation.objects.filter(available(), id__in=remaining))
+        if not ids:
+            # Empresas en su tope: el resto queda pendiente para el demonio
+            break
+        remaining.difference_update(ids)
+        chunk = claim(Operation.objects.filter(id__in=ids), len(ids))
+        if not chunk:
+            continue
+        claimed += len(chunk)
+        try:
+            results = BillingService.process_batch([operation.id for operation in in_order(chunk, ids)])
+        finally:
+            release(chunk)
+        success += len(results['success'])
+        failed += len(results['failed'])
+
+    logger.info(f"Lote completado: {success} exitosas, {failed} fallidas, "
+                f"{len(operation_ids) - claimed} omitidas")
+    return {
+        "status": "success",
+        "success": success,
+        "failed": failed,
+        "skipped": len(operation_ids) - claimed
+    }
+
+
 @shared_task(bind=True, max_retries=3, name='operations.cancel_document')
 def cancel_document_task(self, operation_id, reason_code='01', description='Anulación de la operación'):
     """Task para anular documento en segundo plano"""
@@ -152,13 +268,16 @@ def cancel_document_task(self, operation_id, reason_code='01', description='Anul
 @shared_task(name='operations.retry_failed_billings')
 def retry_failed_billings():
     """Task para reintentar facturaciones fallidas"""
+    from django.conf import settings
     from operations.models import Operation
+    from operations.services.retry_policy import due_after
 
-    # Buscar operaciones que necesitan reintento
+    # Buscar operaciones con el próximo intento vencido (o, si no lo tienen
+    # programado, con BILLING_RETRY_INTERVAL_MINUTES desde el último intento)
     failed_operations = Operation.objects.filter(
+        due_after(getattr(settings, 'BILLING_RETRY_INTERVAL_MINUTES', 30)),
         billing_status__in=['ERROR', 'PENDING'],
-        retry_count__lt=5,
-        last_retry_at__lt=timezone.now() - timedelta(minutes=30)
+        retry_count__lt=getattr(settings, 'BILLING_MAX_RETRIES', 5)
     )
 
     count = 0
@@ -170,6 +289,56 @@ def retry_failed_billings():
     return f"Se reenviaron {count} facturaciones"
 
 
+@shared_task(name='operations.process_boleta_summaries')
+def process_boleta_summaries_task():
+    """Task periódica: enviar las boletas pendientes en resúmenes diarios (BILLING_BOLETA_SUMMARY)"""
+    from django.conf import settings
+    from operations.services.summary_service import BoletaSummaryService
+
+    if not BoletaSummaryService.is_enabled():
+        return {"status": "skipped", "message": "Resumen diario de boletas desactivado"}
+
+    results = BoletaSummaryService.submit_all(max_retries=getattr(settings, 'BILLING_MAX_RETRIES', 5))
+
+    # Consultar cada ticket después de dar tiempo a SUNAT
+    for summary in results['success']:
+        check_boleta_summary_ticket_task.apply_async(
+            (summary['company'].id, summary['ticket']),
+            countdown=getattr(settings, 'BILLING_SUMMARY_POLL_DELAY', 5)
+        )
+
+    return {
+        "status": "success",
+        "summaries": len(results['success']),
+        "boletas": sum(summary['count'] for summary in results['success']),
+        "failed": len(results['failed'])
+    }
+
+
+@shared_task(bind=True, max_retries=10, name='operations.check_boleta_summary_ticket')
+def check_boleta_summary_ticket_task(self, company_id, ticket):
+    """Task para consultar el ticket de un resumen diario de boletas"""
+    from django.conf import settings
+    from operations.services.summary_service import BoletaSummaryService
+    from users.models import Company
+
+    try:
+        company = Company.objects.get(id=company_id)
+        status = BoletaSummaryService(company).check_ticket(ticket)
+    except Exception as e:
+        logger.error(f"Error consultando ticket de resumen {ticket}: {str(e)}")
+        status = None
+
+    if status is None:
+        # SUNAT aún procesa el ticket: volver a consultar más tarde
+        if self.request.retries < self.max_retries:
+            raise self.retry(countdown=getattr(settings, 'BILLING_SUMMARY_POLL_DELAY', 5) * (self.request.retries + 1))
+        # Los tickets sin respuesta los vuelve a consultar el demonio
+        return {"status": "pending", "message": f"Ticket {ticket} sin respuesta"}
+
+    return {"status": "success", "message": f"Ticket {ticket}: {status}"}
+
+
 @shared_task(name='operations.check_cancellation_ticket')
 def check_cancellation_ticket_task(operation_id):
     """Task para consultar estado de ticket de anulación"""
@@ -200,21 +369,34 @@ def check_cancellation_ticket_task(operation_id):
 def health_check_sunat():
     """Task para verificar estado de servicios SUNAT"""
     try:
-        from operations.services.billing_service import BillingConfiguration
+        from operations.services.sunat_circuit import CircuitBreaker
+        from operations.services.sunat_http import get_session
+        from operations.services.sunat_soap import get_service_url
         import requests
 
-        config = BillingConfiguration()
         results = {}
 
         for env in ['BETA', 'PRODUCTION']:
-            endpoint = config.SUNAT_ENDPOINTS[env]['billing']
+            endpoint = f"{get_service_url(env)}?wsdl"
+            # Solo las fallas alimentan el circuito: el WSDL es estático y puede
+            # responder aunque sendBill no esté disponible, así que no cierra un
+            # circuito abierto (eso lo decide la llamada de prueba del envío)
+            breaker = CircuitBreaker(env)
             try:
-                response = requests.get(endpoint, timeout=10)
-                results[env] = f"OK - Status: {response.status_code}"
+                response = get_session(env).get(endpoint, timeout=10)
+                if response.status_code >= 500:
+                    results[env] = f"ERROR - Status: {response.status_code}"
+                    breaker.record_failure()
+                elif response.status_code >= 400:
+                    results[env] = f"WARNING - Status: {response.status_code}"
+                else:
+                    results[env] = f"OK - Status: {response.status_code}"
                 logger.info(f"SUNAT {env}: {response.status_code}")
             except requests.RequestException as e:
                 results[env] = f"ERROR - {str(e)}"
                 logger.warning(f"SUNAT {env} no disponible: {str(e)}")
+                breaker.record_failure()
+            results[f"{env}_circuit"] = breaker.state()
 
         return results
 
@@ -0,0 +1,105 @@
+"""Datos de prueba compartidos por las pruebas de facturación"""
+import base64
+import io
+import itertools
+import os
+import tempfile
+import zipfile
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from operations.models import Document, Operation, Person
+from users.models import Company
+
+_numbers = itertools.count(1)
+
+CDR_TEMPLATE = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<ar:ApplicationResponse xmlns:ar="urn:oasis:names:specification:ubl:schema:xsd:ApplicationResponse-2"'
+    ' xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2"'
+    ' xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2">'
+    '{notes}'
+    '<cac:DocumentResponse>'
+    '<cac:Response><cbc:ReferenceID>F001-1</cbc:ReferenceID>'
+    '<cbc:ResponseCode>{code}</cbc:ResponseCode><cbc:Description>{description}</cbc:Description></cac:Response>'
+    '<cac:DocumentReference><cbc:ID>F001-1</cbc:ID></cac:DocumentReference>'
+    '</cac:DocumentResponse>'
+    '</ar:ApplicationResponse>'
+)
+
+SOAP_TEMPLATE = (
+    '<soap-env:Envelope xmlns:soap-env="http://schemas.xmlsoap.org/soap/envelope/"><soap-env:Body>'
+    '{body}'
+    '</soap-env:Body></soap-env:Envelope>'
+)
+
+
+def cdr_zip(code, description='', notes=()):
+    xml = CDR_TEMPLATE.format(
+        code=code, description=description, notes=''.join(f'<cbc:Note>{note}</cbc:Note>' for note in notes)
+    )
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('R-20100000001-01-F001-1.xml', xml)
+    return buffer.getvalue()
+
+
+def send_bill_response(cdr):
+    content = base64.b64encode(cdr).decode()
+    return SOAP_TEMPLATE.format(
+        body=f'<br:sendBillResponse xmlns:br="http://service.sunat.gob.pe">'
+             f'<applicationResponse>{content}</applicationResponse></br:sendBillResponse>'
+    ).encode()
+
+
+def send_summary_response(ticket):
+    return SOAP_TEMPLATE.format(
+        body=f'<br:sendSummaryResponse xmlns:br="http://service.sunat.gob.pe">'
+             f'<ticket>{ticket}</ticket></br:sendSummaryResponse>'
+    ).encode()
+
+
+def get_status_response(status_code, cdr=None):
+    content = f'<content>{base64.b64encode(cdr).decode()}</content>' if cdr else ''
+    return SOAP_TEMPLATE.format(
+        body=f'<br:getStatusResponse xmlns:br="http://service.sunat.gob.pe"><status>'
+             f'<statusCode>{status_code}</statusCode>{content}</status></br:getStatusResponse>'
+    ).encode()
+
+
+def create_company(ruc, **fields):
+    return Company.objects.create(ruc=ruc, denomination=f'EMPRESA {ruc} SAC', address='AV. LIMA 123', **fields)
+
+
+def create_operation(company, code='01', **fields):
+    number = next(_numbers)
+    document, _ = Document.objects.get_or_create(company=company, code=code, defaults={'description': code})
+    person = Person.objects.create(document=str(10000000 + number), full_name='JUAN PEREZ', person_type='1')
+    fields.setdefault('billing_status', 'PENDING')
+    return Operation.objects.create(
+        document=document, company=company, person=person, operation_type='S',
+        serial='F001' if code != '03' else 'B001', number=number, **fields
+    )
+
+
+class BillingTestCase(TestCase):
+    """Archivos de facturación (carpetas de la empresa, CDR) en un directorio temporal"""
+
+    @classmethod
+    def setUpClass(cls):
+        from operations.services.billing_service import BillingFileManager
+
+        media = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media.name)
+        media_settings.enable()
+        cls.addClassCleanup(media_settings.disable)
+        # BASE_PATH se calcula al importar el módulo: se cambia junto con MEDIA_ROOT
+        for patcher in (
+            mock.patch.object(BillingFileManager, 'BASE_PATH', os.path.join(media.name, 'electronic_billing')),
+            mock.patch.object(BillingFileManager, '_ensured_rucs', set()),
+        ):
+            patcher.start()
+            cls.addClassCleanup(patcher.stop)
+        super().setUpClass()
@@ -0,0 +1,56 @@
+import os
+
+from finances.models import Payment
+from operations.models import Operation, OperationDetail
+from operations.services.billing_checkpoint import input_fingerprint
+from operations.tests.factories import BillingTestCase, create_company, create_operation
+from products.models import Product
+from users.models import Company
+
+
+class CheckpointFingerprintTests(BillingTestCase):
+
+    def setUp(self):
+        from operations.services.billing_service import SigningKeyCache
+
+        self.company = create_company('20100000006')
+        self.operation = create_operation(self.company, total_amount=118)
+        product = Product.objects.create(code='P001', description='PRODUCTO', company=self.company)
+        self.detail = OperationDetail.objects.create(
+            operation=self.operation, product=product, description='PRODUCTO', quantity=1, unit_value=100, unit_price=118
+        )
+        self.payment = Payment.objects.create(
+            operation=self.operation, company=self.company, payment_type='CN', paid_amount=118
+        )
+        self.certificate_paths = SigningKeyCache.get_paths(self.company.ruc, self.company.environment)
+        for path in self.certificate_paths:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write('-----BEGIN-----')
+        self.fingerprint = self.current()
+
+    def current(self):
+        return input_fingerprint(Operation.objects.select_related('company', 'person', 'document').get(
+            pk=self.operation.pk
+        ))
+
+    def test_unchanged_inputs_keep_fingerprint(self):
+        self.assertEqual(self.current(), self.fingerprint)
+
+    def test_detail_change(self):
+        OperationDetail.objects.filter(pk=self.detail.pk).update(quantity=2)
+        self.assertNotEqual(self.current(), self.fingerprint)
+
+    def test_payment_change(self):
+        Payment.objects.filter(pk=self.payment.pk).update(paid_amount=100)
+        self.assertNotEqual(self.current(), self.fingerprint)
+
+    def test_company_change(self):
+        Company.objects.filter(pk=self.company.pk).update(address='AV. AREQUIPA 456')
+        self.assertNotEqual(self.current(), self.fingerprint)
+
+    def test_certificate_change(self):
+        cert_path, _ = self.certificate_paths
+        modified = os.path.getmtime(cert_path) + 60
+        os.utime(cert_path, (modified, modified))
+        self.assertNotEqual(self.current(), self.fingerprint)
@@ -0,0 +1,85 @@
+from datetime import timedelta
+
+from django.utils import timezone
+
+from operations.models import BillingStatusTransition, Operation
+from operations.services.billing_lease import claim, claim_operation, reclaim_expired, release, renew
+from operations.tests.factories import BillingTestCase, create_company, create_operation
+
+
+class LeaseTests(BillingTestCase):
+
+    def setUp(self):
+        self.company = create_company('20100000002')
+        self.operations = [create_operation(self.company) for _ in range(5)]
+        self.queryset = Operation.objects.filter(billing_status='PENDING').order_by('id')
+
+    def test_claims_never_share_operations(self):
+        first = claim(self.queryset, 3, owner='daemon-a')
+        second = claim(self.queryset, 3, owner='daemon-b')
+
+        first_ids = {operation.id for operation in first}
+        second_ids = {operation.id for operation in second}
+        self.assertEqual(len(first_ids), 3)
+        self.assertEqual(len(second_ids), 2)
+        self.assertFalse(first_ids & second_ids)
+        self.assertEqual(claim(self.queryset, 3, owner='daemon-c'), [])
+
+    def test_claim_operation_respects_active_lease(self):
+        operation = self.operations[0]
+        self.assertTrue(claim_operation(operation, owner='daemon-a'))
+        self.assertFalse(claim_operation(Operation.objects.get(pk=operation.pk), owner='worker-b'))
+
+    def test_expired_lease_can_be_claimed_again(self):
+        claim(self.queryset, 5, owner='daemon-a')
+        expired = self.operations[0]
+        Operation.objects.filter(pk=expired.pk).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+        claimed = claim(self.queryset, 5, owner='daemon-b')
+
+        self.assertEqual([operation.id for operation in claimed], [expired.id])
+        self.assertEqual(Operation.objects.get(pk=expired.pk).lease_owner, 'daemon-b')
+
+    def test_batch_longer_than_lease_keeps_only_unclaimed_operations(self):
+        batch = claim(self.queryset, 3, owner='daemon-a')
+        # El lote siguió en cola más que la reserva: otro demonio toma dos operaciones
+        Operation.objects.filter(id__in=[operation.id for operation in batch]).update(
+            lease_expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        taken = claim(Operation.objects.filter(id__in=[batch[1].id, batch[2].id]), 2, owner='daemon-b')
+        self.assertEqual(len(taken), 2)
+
+        renewed = renew(batch, owner='daemon-a')
+
+        self.assertEqual([operation.id for operation in renewed], [batch[0].id])
+        first = Operation.objects.get(pk=batch[0].pk)
+        self.assertEqual(first.lease_owner, 'daemon-a')
+        self.assertGreater(first.lease_expires_at, timezone.now())
+        self.assertEqual(
+            set(Operation.objects.filter(lease_owner='daemon-b').values_list('id', flat=True)),
+            {batch[1].id, batch[2].id}
+        )
+
+    def test_release_only_clears_own_lease(self):
+        claimed = claim(self.queryset, 2, owner='daemon-a')
+
+        self.assertEqual(release(claimed, owner='daemon-b'), 0)
+        self.assertEqual(Operation.objects.filter(lease_owner='daemon-a').count(), 2)
+
+        self.assertEqual(release(claimed, owner='daemon-a'), 2)
+        self.assertFalse(Operation.objects.filter(lease_owner__isnull=False).exists())
+
+    def test_reclaim_expired_requeues_and_logs(self):
+        stuck = self.operations[0]
+        Operation.objects.filter(pk=stuck.pk).update(
+            billing_status='PROCESSING', lease_owner='daemon-a', lease_expires_at=timezone.now() - timedelta(seconds=1)
+        )
+
+        self.assertEqual(reclaim_expired(), 1)
+
+        stuck.refresh_from_db()
+        self.assertEqual(stuck.billing_status, 'ERROR')
+        self.assertIsNone(stuck.lease_owner)
+        self.assertTrue(BillingStatusTransition.objects.filter(
+            operation=stuck, from_status='PROCESSING', to_status='ERROR'
+        ).exists())
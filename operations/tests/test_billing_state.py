@@ -0,0 +1,75 @@
+from datetime import timedelta
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from operations.models import BillingStatusTransition, Operation
+from operations.services.billing_state import StaleTransition, transition, transition_many
+from operations.tests.factories import BillingTestCase, create_company, create_operation
+
+
+class TransitionTests(BillingTestCase):
+
+    def setUp(self):
+        self.company = create_company('20100000001', retry_interval_minutes=10)
+        self.operation = create_operation(self.company)
+
+    def test_stale_transition_when_status_changed(self):
+        Operation.objects.filter(pk=self.operation.pk).update(billing_status='ACCEPTED')
+
+        with self.assertRaises(StaleTransition):
+            transition(self.operation, 'PROCESSING', expected='PENDING')
+
+        self.operation.refresh_from_db()
+        self.assertEqual(self.operation.billing_status, 'ACCEPTED')
+        self.assertFalse(BillingStatusTransition.objects.exists())
+
+    def test_updates_only_named_columns(self):
+        # Cambio en memoria que no se pide guardar
+        self.operation.total_amount = 999
+
+        with CaptureQueriesContext(connection) as queries:
+            transition(self.operation, 'PROCESSING', sunat_error_description='en proceso')
+
+        update = next(query['sql'] for query in queries if query['sql'].startswith('UPDATE'))
+        self.assertIn('"billing_status"', update)
+        self.assertIn('"sunat_error_description"', update)
+        self.assertNotIn('"total_amount"', update)
+
+        self.operation.refresh_from_db()
+        self.assertEqual(self.operation.billing_status, 'PROCESSING')
+        self.assertEqual(self.operation.total_amount, 0)
+
+    def test_retry_status_schedules_next_attempt(self):
+        before = timezone.now()
+        transition(self.operation, 'ERROR', retry_count=1)
+
+        self.operation.refresh_from_db()
+        # 10 minutos +/- 20 %
+        self.assertGreaterEqual(self.operation.next_attempt_at, before + timedelta(minutes=8))
+        self.assertLessEqual(self.operation.next_attempt_at, before + timedelta(minutes=12, seconds=1))
+
+    def test_logs_transition_with_duration(self):
+        Operation.objects.filter(pk=self.operation.pk).update(billing_status_at=timezone.now() - timedelta(seconds=60))
+        self.operation.refresh_from_db()
+
+        transition(self.operation, 'PROCESSING')
+
+        log = BillingStatusTransition.objects.get(operation=self.operation)
+        self.assertEqual((log.from_status, log.to_status), ('PENDING', 'PROCESSING'))
+        self.assertAlmostEqual(log.duration, 60, delta=5)
+
+    def test_transition_many_skips_other_statuses(self):
+        other = create_operation(self.company, billing_status='ACCEPTED')
+
+        moved = transition_many(
+            Operation.objects.filter(id__in=[self.operation.id, other.id]), 'PROCESSING', expected='PENDING'
+        )
+
+        self.assertEqual(moved, [self.operation.id])
+        self.assertEqual(Operation.objects.get(pk=other.pk).billing_status, 'ACCEPTED')
+        self.assertEqual(
+            list(BillingStatusTransition.objects.values_list('operation_id', 'from_status', 'to_status')),
+            [(self.operation.id, 'PENDING', 'PROCESSING')]
+        )
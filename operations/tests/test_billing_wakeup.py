@@ -0,0 +1,134 @@
+import json
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from operations.services import billing_wakeup
+
+
+class FakeRedis:
+    """Listas de Redis en memoria (solo lo que usa billing_wakeup)"""
+
+    def __init__(self):
+        self.lists = {}
+        self.brpop_timeouts = []
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def lpush(self, key, value):
+        self.lists.setdefault(key, []).insert(0, value)
+
+    def ltrim(self, key, start, end):
+        self.lists[key] = self.lists.get(key, [])[start:end + 1]
+
+    def lrange(self, key, start, end):
+        values = self.lists.get(key, [])
+        return values[start:] if end == -1 else values[start:end + 1]
+
+    def delete(self, key):
+        self.lists.pop(key, None)
+
+    def brpop(self, key, timeout):
+        self.brpop_timeouts.append(timeout)
+        values = self.lists.get(key)
+        if not values:
+            return None
+        return key, values.pop()
+
+
+class FakePipeline:
+
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.calls.append((name, args))
+
+    def execute(self):
+        return [getattr(self.client, name)(*args) for name, args in self.calls]
+
+
+@override_settings(BILLING_WAKEUP_ENABLED=True, BILLING_WAKEUP_KEY='test:wakeup')
+class WakeupTests(SimpleTestCase):
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = mock.patch.object(billing_wakeup, '_client', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_wait_returns_every_pending_event_at_once(self):
+        self.assertTrue(billing_wakeup.notify('operation_created', 1))
+        self.assertTrue(billing_wakeup.notify('operation_created', 2))
+        self.assertTrue(billing_wakeup.notify('operation_cancelled', 1))
+
+        events = billing_wakeup.wait(30)
+
+        self.assertEqual([(event['reason'], event['operation_id']) for event in events], [
+            ('operation_created', 1), ('operation_cancelled', 1), ('operation_created', 2)
+        ])
+        self.assertEqual(self.redis.brpop_timeouts, [30])
+        self.assertNotIn('test:wakeup', self.redis.lists)
+
+    def test_wait_times_out_without_events(self):
+        self.assertEqual(billing_wakeup.wait(0.2), [])
+        self.assertEqual(self.redis.brpop_timeouts, [1])
+
+    def test_pending_events_are_capped(self):
+        with mock.patch.object(billing_wakeup, 'MAX_PENDING_EVENTS', 3):
+            for operation_id in range(5):
+                billing_wakeup.notify('operation_created', operation_id)
+
+        self.assertEqual(len(self.redis.lists['test:wakeup']), 3)
+        self.assertEqual(json.loads(self.redis.lists['test:wakeup'][0])['operation_id'], 4)
+
+    def test_invalid_events_are_ignored(self):
+        self.redis.lpush('test:wakeup', 'no-es-json')
+        billing_wakeup.notify('operation_created', 7)
+
+        self.assertEqual([event['operation_id'] for event in billing_wakeup.wait(1)], [7])
+
+    def test_redis_errors_fall_back_to_the_interval(self):
+        self.redis.brpop = mock.Mock(side_effect=ConnectionError('redis'))
+        self.redis.pipeline = mock.Mock(side_effect=ConnectionError('redis'))
+
+        with mock.patch.object(billing_wakeup.time, 'sleep') as sleep, \
+                self.assertLogs('operations.services.billing_wakeup', 'WARNING'):
+            self.assertFalse(billing_wakeup.notify('operation_created', 1))
+            self.assertEqual(billing_wakeup.wait(5), [])
+
+        sleep.assert_called_once_with(5)
+
+    @override_settings(BILLING_WAKEUP_ENABLED=False)
+    def test_disabled_wakeup_only_sleeps(self):
+        with mock.patch.object(billing_wakeup.time, 'sleep') as sleep:
+            self.assertFalse(billing_wakeup.notify('operation_created', 1))
+            self.assertEqual(billing_wakeup.wait(5), [])
+
+        sleep.assert_called_once_with(5)
+        self.assertEqual(self.redis.lists, {})
+
+
+@override_settings(BILLING_WAKEUP_ENABLED=True, BILLING_WAKEUP_KEY='test:wakeup')
+class WakeupOnCommitTests(TestCase):
+
+    def test_notifies_only_after_commit(self):
+        redis = FakeRedis()
+        with mock.patch.object(billing_wakeup, '_client', return_value=redis):
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                billing_wakeup.notify_on_commit('operation_created', 3)
+                self.assertEqual(redis.lists, {})
+
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(json.loads(redis.lists['test:wakeup'][0])['operation_id'], 3)
+
+    def test_no_notification_until_commit(self):
+        redis = FakeRedis()
+        with mock.patch.object(billing_wakeup, '_client', return_value=redis):
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                billing_wakeup.notify_on_commit('operation_created', 3)
+
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(redis.lists, {})
@@ -0,0 +1,111 @@
+import threading
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from operations.services.daemon_pool import PHASE_RATES, PhaseRateLimiter, PhaseWorkerPool, phase_rates
+
+
+class PhaseWorkerPoolTests(SimpleTestCase):
+
+    def setUp(self):
+        self.done = []
+        self.lock = threading.Lock()
+
+    def record(self, name):
+        with self.lock:
+            self.done.append(name)
+
+    def pool(self, workers):
+        pool = PhaseWorkerPool(workers, rates={})
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_phases_take_turns(self):
+        pool = self.pool(1)
+        started, release = threading.Event(), threading.Event()
+
+        def blocker():
+            started.set()
+            release.wait(5)
+
+        pool.submit('pending', blocker)
+        self.assertTrue(started.wait(5))
+        for name in ('p1', 'p2', 'p3'):
+            pool.submit('pending', self.record, name)
+        for name in ('r1', 'r2'):
+            pool.submit('retry', self.record, name)
+        pool.submit('ticket', self.record, 't1')
+        self.assertEqual(pool.size(), 6)
+        self.assertEqual(pool.size('pending'), 3)
+
+        release.set()
+        pool.join()
+
+        self.assertEqual(self.done, ['r1', 't1', 'p1', 'r2', 'p2', 'p3'])
+        self.assertEqual(pool.size(), 0)
+
+    def test_join_waits_for_every_task(self):
+        pool = self.pool(4)
+        for index in range(20):
+            pool.submit('pending' if index % 2 else 'cancellation', self.record, index)
+
+        pool.join()
+
+        self.assertEqual(sorted(self.done), list(range(20)))
+
+    def test_failed_task_does_not_stop_the_worker(self):
+        pool = self.pool(1)
+
+        def fail():
+            raise ValueError('boom')
+
+        with self.assertLogs('operations.services.daemon_pool', 'ERROR'):
+            pool.submit('retry', fail)
+            pool.submit('retry', self.record, 'after')
+            pool.join()
+
+        self.assertEqual(self.done, ['after'])
+
+    def test_close_runs_queued_tasks_and_rejects_new_ones(self):
+        pool = PhaseWorkerPool(2, rates={})
+        for index in range(5):
+            pool.submit('ticket', self.record, index)
+
+        pool.close()
+
+        self.assertEqual(sorted(self.done), list(range(5)))
+        self.assertFalse(any(thread.is_alive() for thread in pool.threads))
+        with self.assertRaises(RuntimeError):
+            pool.submit('ticket', self.record, 'late')
+
+
+class PhaseRateTests(SimpleTestCase):
+
+    def test_default_rates_scale_with_workers(self):
+        rates = phase_rates(workers=4)
+
+        self.assertEqual(rates['pending'], PHASE_RATES['pending'] * 4)
+        self.assertEqual(rates['retry'], PHASE_RATES['retry'] * 4)
+        self.assertIsNone(rates['summary'])
+
+    def test_fixed_rate_applies_to_every_phase(self):
+        self.assertEqual(set(phase_rates(rate=3.0, workers=4).values()), {3.0})
+
+    def test_limiter_spaces_tasks(self):
+        limiter = PhaseRateLimiter(2.0)
+        with mock.patch('operations.services.daemon_pool.time.sleep') as sleep:
+            for _ in range(3):
+                limiter.acquire()
+
+        waits = [call.args[0] for call in sleep.call_args_list]
+        self.assertEqual(len(waits), 2)
+        self.assertAlmostEqual(waits[0], 0.5, delta=0.05)
+        self.assertAlmostEqual(waits[1], 1.0, delta=0.05)
+
+    def test_unlimited_phase_never_waits(self):
+        with mock.patch('operations.services.daemon_pool.time.sleep') as sleep:
+            for _ in range(3):
+                PhaseRateLimiter(None).acquire()
+
+        sleep.assert_not_called()
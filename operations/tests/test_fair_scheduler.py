@@ -0,0 +1,49 @@
+from django.test import override_settings
+
+from operations.models import Operation
+from operations.services.fair_scheduler import claim_fair, company_slots
+from operations.tests.factories import BillingTestCase, create_company, create_operation
+
+
+class FairSchedulerTests(BillingTestCase):
+
+    def setUp(self):
+        self.bulk = create_company('20100000003')
+        self.weighted = create_company('20100000004', billing_weight=2)
+
+    def companies(self, operations):
+        return [operation.company_id for operation in operations]
+
+    def test_interleaves_companies_by_weight(self):
+        for _ in range(6):
+            create_operation(self.bulk)
+        for _ in range(4):
+            create_operation(self.weighted)
+
+        claimed = claim_fair(Operation.objects.filter(billing_status='PENDING'), 6, owner='daemon-a')
+
+        bulk, weighted = self.bulk.id, self.weighted.id
+        self.assertEqual(self.companies(claimed), [bulk, weighted, weighted, bulk, weighted, weighted])
+
+    def test_facturas_before_boletas(self):
+        boleta = create_operation(self.bulk, code='03')
+        factura = create_operation(self.weighted, code='01')
+
+        claimed = claim_fair(Operation.objects.filter(billing_status='PENDING'), 2, owner='daemon-a')
+
+        self.assertEqual([operation.id for operation in claimed], [factura.id, boleta.id])
+
+    @override_settings(BILLING_COMPANY_IN_FLIGHT=2)
+    def test_respects_in_flight_cap(self):
+        for _ in range(5):
+            create_operation(self.bulk)
+        create_operation(self.weighted)
+        queryset = Operation.objects.filter(billing_status='PENDING')
+
+        claimed = claim_fair(queryset, 10, owner='daemon-a')
+
+        self.assertEqual(sorted(self.companies(claimed)), [self.bulk.id, self.bulk.id, self.weighted.id])
+        self.assertEqual(company_slots(self.bulk.id), 0)
+        self.assertEqual(company_slots(self.weighted.id), 1)
+        # Otro proceso tampoco pasa el tope
+        self.assertEqual(claim_fair(queryset, 10, owner='daemon-b'), [])
@@ -0,0 +1,66 @@
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from operations.models import Operation
+from operations.services.retry_policy import due, due_after, next_attempt_at, retry_delay, with_jitter
+from operations.tests.factories import create_company, create_operation
+
+
+@override_settings(BILLING_RETRY_INTERVAL_MINUTES=30, BILLING_RETRY_MAX_MINUTES=240, BILLING_RETRY_JITTER=0.2)
+class RetryPolicyTests(TestCase):
+
+    def test_delay_doubles_with_each_attempt(self):
+        company = SimpleNamespace(retry_interval_minutes=None)
+
+        self.assertEqual([retry_delay(company, count) for count in (1, 2, 3)], [30 * 60, 60 * 60, 120 * 60])
+        self.assertEqual(retry_delay(SimpleNamespace(retry_interval_minutes=5), 2), 10 * 60)
+
+    def test_delay_is_capped(self):
+        company = SimpleNamespace(retry_interval_minutes=None)
+
+        self.assertEqual(retry_delay(company, 4), 240 * 60)
+        self.assertEqual(retry_delay(company, 1000), 240 * 60)
+
+    def test_jitter_stays_within_bounds(self):
+        with mock.patch('operations.services.retry_policy.random.uniform', side_effect=lambda low, high: low):
+            self.assertAlmostEqual(with_jitter(100), 80)
+        with mock.patch('operations.services.retry_policy.random.uniform', side_effect=lambda low, high: high):
+            self.assertAlmostEqual(with_jitter(100), 120)
+        for _ in range(50):
+            self.assertTrue(80 <= with_jitter(100) <= 120)
+
+    def test_next_attempt_uses_company_backoff(self):
+        now = timezone.now()
+        company = SimpleNamespace(retry_interval_minutes=10)
+
+        attempt = next_attempt_at(company, 3, now=now)
+
+        self.assertTrue(now + timedelta(minutes=32) <= attempt <= now + timedelta(minutes=48))
+
+    def test_due_filters_by_next_attempt(self):
+        now = timezone.now()
+        company = create_company('20100000009')
+        past = create_operation(company, next_attempt_at=now - timedelta(minutes=1))
+        unscheduled = create_operation(company)
+        create_operation(company, next_attempt_at=now + timedelta(minutes=1))
+
+        self.assertEqual(
+            set(Operation.objects.filter(due(now)).values_list('id', flat=True)), {past.id, unscheduled.id}
+        )
+
+    def test_due_after_waits_for_unscheduled_operations(self):
+        now = timezone.now()
+        company = create_company('20100000010')
+        past = create_operation(company, next_attempt_at=now - timedelta(minutes=1))
+        old_retry = create_operation(company, last_retry_at=now - timedelta(minutes=31))
+        never_retried = create_operation(company)
+        create_operation(company, last_retry_at=now - timedelta(minutes=5))
+
+        self.assertEqual(
+            set(Operation.objects.filter(due_after(30, now)).values_list('id', flat=True)),
+            {past.id, old_retry.id, never_retried.id}
+        )
@@ -0,0 +1,150 @@
+from datetime import date
+from types import SimpleNamespace
+from unittest import mock
+
+from django.utils import timezone
+
+from operations.models import Operation, SummaryCorrelative
+from operations.services.billing_service import BillingService
+from operations.services.summary_service import BoletaSummaryService, reserve_summary_correlative
+from operations.services.sunat_circuit import SunatUnavailable
+from operations.tests.factories import (
+    BillingTestCase, cdr_zip, create_company, create_operation, get_status_response, send_summary_response
+)
+
+
+class SummaryCorrelativeTests(BillingTestCase):
+
+    def setUp(self):
+        self.company = create_company('20100000007')
+        self.issue_date = date(2026, 10, 17)
+
+    def test_reservations_never_repeat(self):
+        numbers = [reserve_summary_correlative(self.company, self.issue_date) for _ in range(3)]
+
+        self.assertEqual(numbers, [1, 2, 3])
+        self.assertEqual(reserve_summary_correlative(self.company, date(2026, 10, 18)), 1)
+        self.assertEqual(reserve_summary_correlative(create_company('20100000008'), self.issue_date), 1)
+
+    def test_continues_after_numbers_used_by_summaries_and_cancellations(self):
+        create_operation(self.company, '03', summary_date=self.issue_date, summary_number=4)
+        create_operation(self.company, '03', cancellation_date=self.issue_date, low_number=6)
+
+        self.assertEqual(reserve_summary_correlative(self.company, self.issue_date), 7)
+        self.assertEqual(
+            SummaryCorrelative.objects.get(company=self.company, issue_date=self.issue_date).last_number, 7
+        )
+
+
+class SummarySubmitTests(BillingTestCase):
+
+    def setUp(self):
+        self.company = create_company('20100000011', environment='BETA')
+        self.boletas = [create_operation(self.company, '03', total_amount=118) for _ in range(3)]
+        self.ids = [operation.id for operation in self.boletas]
+        self.service = BoletaSummaryService(self.company)
+
+    def signed(self, operation_ids, batch):
+        return [
+            (
+                SimpleNamespace(operation=operation), None,
+                SimpleNamespace(signed_path=f'{operation.serial}-{operation.number}.xml', digest_value='hash'), []
+            )
+            for operation in Operation.objects.filter(id__in=operation_ids)
+        ]
+
+    def submit(self, response=None, error=None):
+        post = mock.Mock(return_value=response, side_effect=error)
+        with mock.patch.object(BillingService, 'resume_batch', side_effect=lambda ids: ([], ids)), \
+                mock.patch.object(BillingService, 'sign_batch', side_effect=self.signed), \
+                mock.patch.object(BoletaSummaryService, '_sign_summary_xml', side_effect=lambda path: path), \
+                mock.patch('operations.services.summary_service.post_envelope', post):
+            return self.service.submit(self.ids, date(2026, 10, 16))
+
+    def statuses(self):
+        return list(Operation.objects.filter(id__in=self.ids).values_list('billing_status', flat=True))
+
+    def test_sent_summary_stores_ticket_on_every_boleta(self):
+        result = self.submit(send_summary_response('1700000000001'))
+
+        self.assertEqual(result['ticket'], '1700000000001')
+        self.assertEqual(result['count'], 3)
+        self.assertEqual(self.statuses(), ['SENT'] * 3)
+        self.assertEqual(Operation.objects.filter(summary_ticket='1700000000001', summary_number=1).count(), 3)
+        self.assertFalse(Operation.objects.filter(lease_owner__isnull=False).exists())
+
+    def test_failed_send_returns_boletas_to_retry(self):
+        with self.assertRaises(ConnectionError):
+            self.submit(error=ConnectionError('timeout'))
+
+        self.assertEqual(self.statuses(), ['ERROR'] * 3)
+        self.assertFalse(Operation.objects.filter(retry_count=0).exists())
+        self.assertFalse(Operation.objects.filter(lease_owner__isnull=False).exists())
+
+    def test_unavailable_sunat_keeps_boletas_pending_without_using_retries(self):
+        with self.assertRaises(SunatUnavailable):
+            self.submit(error=SunatUnavailable('BETA', 30))
+
+        self.assertEqual(self.statuses(), ['PENDING'] * 3)
+        self.assertFalse(Operation.objects.filter(retry_count__gt=0).exists())
+        self.assertFalse(Operation.objects.filter(next_attempt_at__isnull=True).exists())
+
+    def test_boletas_taken_by_another_process_are_skipped(self):
+        Operation.objects.filter(id__in=self.ids).update(billing_status='PROCESSING')
+
+        self.assertIsNone(self.submit(send_summary_response('1700000000001')))
+
+
+class SummaryTicketTests(BillingTestCase):
+
+    def setUp(self):
+        self.company = create_company('20100000012', environment='BETA')
+        self.ticket = '1700000000002'
+        self.boletas = [
+            create_operation(
+                self.company, '03', billing_status='SENT', summary_ticket=self.ticket,
+                summary_date=date(2026, 10, 17), summary_number=1
+            ) for _ in range(3)
+        ]
+        # Boleta de otro resumen: no se toca
+        self.other = create_operation(self.company, '03', billing_status='SENT', summary_ticket='1700000000003')
+
+    def check(self, response):
+        with mock.patch('operations.services.summary_service.post_envelope', return_value=response):
+            return BoletaSummaryService(self.company).check_ticket(self.ticket)
+
+    def boleta_statuses(self):
+        return list(Operation.objects.filter(summary_ticket=self.ticket).values_list('billing_status', flat=True))
+
+    def test_ticket_in_process_changes_nothing(self):
+        self.assertIsNone(self.check(get_status_response('98')))
+
+        self.assertEqual(self.boleta_statuses(), ['SENT'] * 3)
+
+    def test_accepted_summary_accepts_every_boleta(self):
+        status = self.check(get_status_response('0', cdr_zip('0', 'El Resumen diario RC-20261017-1, ha sido aceptado')))
+
+        self.assertEqual(status, 'ACCEPTED')
+        self.assertEqual(self.boleta_statuses(), ['ACCEPTED'] * 3)
+        boleta = Operation.objects.get(pk=self.boletas[0].pk)
+        self.assertEqual(boleta.sunat_response_code, '0')
+        self.assertTrue(boleta.cdr_file_path.endswith('R-20100000012-RC-20261017-00001.zip'))
+        self.assertEqual(Operation.objects.get(pk=self.other.pk).billing_status, 'SENT')
+
+    def test_rejected_summary_schedules_retry(self):
+        status = self.check(get_status_response('99', cdr_zip('2072', 'La version del documento no es la correcta')))
+
+        self.assertEqual(status, 'REJECTED')
+        self.assertEqual(self.boleta_statuses(), ['REJECTED'] * 3)
+        boleta = Operation.objects.get(pk=self.boletas[0].pk)
+        self.assertEqual(boleta.sunat_error_code, '2072')
+        self.assertGreater(boleta.next_attempt_at, timezone.now())
+
+    def test_error_without_cdr_counts_a_retry(self):
+        status = self.check(get_status_response('99'))
+
+        self.assertEqual(status, 'ERROR')
+        self.assertEqual(self.boleta_statuses(), ['ERROR'] * 3)
+        retries = Operation.objects.filter(summary_ticket=self.ticket).values_list('retry_count', flat=True)
+        self.assertEqual(set(retries), {1})
+        self.assertEqual(Operation.objects.get(pk=self.other.pk).billing_status, 'SENT')
@@ -0,0 +1,143 @@
+import time
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import SimpleTestCase, override_settings
+
+from operations.services.sunat_circuit import AdaptiveRateLimiter, CircuitBreaker, SunatUnavailable
+
+
+@override_settings(SUNAT_BREAKER_ENABLED=True, SUNAT_BREAKER_FAILURES=3, SUNAT_BREAKER_COOLDOWN=60)
+class CircuitBreakerTests(SimpleTestCase):
+
+    def setUp(self):
+        caches['billing'].clear()
+        self.breaker = CircuitBreaker('BETA')
+
+    def open_breaker(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+
+    def end_cooldown(self):
+        caches['billing'].set(self.breaker.opened_key, time.time() - 1)
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state(), 'closed')
+        self.breaker.before_call()
+
+        self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.state(), 'open')
+        with self.assertRaises(SunatUnavailable) as raised:
+            self.breaker.before_call()
+        self.assertTrue(0 < raised.exception.retry_after <= 60)
+
+    def test_success_resets_failure_count(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.state(), 'closed')
+
+    def test_half_open_lets_a_single_probe_through(self):
+        self.open_breaker()
+        self.end_cooldown()
+        self.assertEqual(self.breaker.state(), 'half_open')
+        self.assertFalse(self.breaker.is_open())
+
+        self.breaker.before_call()
+
+        # La prueba está en curso: el resto de los procesos espera
+        self.assertTrue(self.breaker.is_open())
+        with self.assertRaises(SunatUnavailable):
+            CircuitBreaker('BETA').before_call()
+
+    def test_successful_probe_closes(self):
+        self.open_breaker()
+        self.end_cooldown()
+        self.breaker.before_call()
+
+        self.breaker.record_success()
+
+        self.assertEqual(self.breaker.state(), 'closed')
+        self.assertIsNone(caches['billing'].get(self.breaker.probe_key))
+        self.breaker.before_call()
+
+    def test_failed_probe_reopens_for_a_new_cooldown(self):
+        self.open_breaker()
+        self.end_cooldown()
+        self.breaker.before_call()
+
+        self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.state(), 'open')
+        self.assertGreater(caches['billing'].get(self.breaker.opened_key), time.time() + 50)
+        self.assertIsNone(caches['billing'].get(self.breaker.probe_key))
+
+    def test_environments_are_independent(self):
+        self.open_breaker()
+
+        self.assertEqual(CircuitBreaker('PRODUCTION').state(), 'closed')
+
+    @override_settings(SUNAT_BREAKER_ENABLED=False)
+    def test_disabled_breaker_stays_closed(self):
+        self.open_breaker()
+
+        self.assertEqual(self.breaker.state(), 'closed')
+        self.breaker.before_call()
+
+    def test_cache_failure_keeps_breaker_closed(self):
+        with mock.patch('operations.services.sunat_circuit._cache', side_effect=ConnectionError('redis')):
+            self.assertEqual(self.breaker.state(), 'closed')
+            self.breaker.before_call()
+            self.breaker.record_failure()
+
+
+@override_settings(
+    SUNAT_RATE_LIMIT_ENABLED=True, SUNAT_RATE_INITIAL=10.0, SUNAT_RATE_MIN=1.0, SUNAT_RATE_MAX=12.0,
+    SUNAT_RATE_INCREASE=1.0, SUNAT_RATE_DECREASE=0.5, SUNAT_RATE_TARGET_LATENCY=5.0
+)
+class AdaptiveRateLimiterTests(SimpleTestCase):
+
+    def setUp(self):
+        caches['billing'].clear()
+        self.limiter = AdaptiveRateLimiter('BETA')
+
+    def test_fast_responses_increase_rate_additively_up_to_max(self):
+        self.limiter.record(latency=1.0)
+        self.assertEqual(self.limiter.rate, 11.0)
+
+        for _ in range(5):
+            self.limiter.record(latency=1.0)
+        self.assertEqual(self.limiter.rate, 12.0)
+
+    def test_failures_and_slow_responses_halve_rate_down_to_min(self):
+        self.limiter.record(failure=True)
+        self.assertEqual(self.limiter.rate, 5.0)
+
+        self.limiter.record(latency=6.0)
+        self.assertEqual(self.limiter.rate, 2.5)
+
+        for _ in range(5):
+            self.limiter.record(failure=True)
+        self.assertEqual(self.limiter.rate, 1.0)
+
+    def test_new_process_starts_with_shared_rate(self):
+        self.limiter.record(failure=True)
+
+        self.assertEqual(AdaptiveRateLimiter('BETA').rate, 5.0)
+        self.assertEqual(AdaptiveRateLimiter('PRODUCTION').rate, 10.0)
+
+    def test_acquire_spaces_calls_by_rate(self):
+        with mock.patch('operations.services.sunat_circuit.time.sleep') as sleep:
+            self.limiter.acquire()
+            self.limiter.acquire()
+            self.limiter.acquire()
+
+        waits = [call.args[0] for call in sleep.call_args_list]
+        self.assertEqual(len(waits), 2)
+        self.assertAlmostEqual(waits[0], 0.1, delta=0.02)
+        self.assertAlmostEqual(waits[1], 0.2, delta=0.02)
@@ -0,0 +1,60 @@
+from operations.services.sunat_response import SunatResponseError, parse_cdr, parse_soap_response
+from operations.tests.factories import (
+    SOAP_TEMPLATE, BillingTestCase, cdr_zip, create_company, create_operation, send_bill_response
+)
+
+
+class SunatResponseTests(BillingTestCase):
+
+    def parse(self, cdr):
+        response = parse_soap_response(send_bill_response(cdr))
+        self.assertFalse(response.is_fault)
+        return parse_cdr(response.cdr_bytes())
+
+    def test_accepted(self):
+        cdr = self.parse(cdr_zip('0', 'La Factura numero F001-1, ha sido aceptada'))
+
+        self.assertTrue(cdr.is_accepted)
+        self.assertEqual(cdr.billing_status, 'ACCEPTED')
+        self.assertEqual(cdr.reference_id, 'F001-1')
+        self.assertEqual(cdr.document_id, 'F001-1')
+
+    def test_observations(self):
+        cdr = self.parse(cdr_zip('4252', 'Aceptada con observaciones', notes=['4252 - El dato ingresado no cumple']))
+
+        self.assertTrue(cdr.is_accepted)
+        self.assertEqual(cdr.billing_status, 'ACCEPTED_WITH_OBSERVATIONS')
+        self.assertEqual(cdr.notes, ['4252 - El dato ingresado no cumple'])
+        self.assertIn('Observaciones', cdr.full_description())
+
+    def test_rejected(self):
+        cdr = self.parse(cdr_zip('2017', 'El numero de documento de identidad del receptor debe ser RUC'))
+
+        self.assertFalse(cdr.is_accepted)
+        self.assertEqual(cdr.billing_status, 'REJECTED')
+
+    def test_fault(self):
+        response = parse_soap_response(SOAP_TEMPLATE.format(
+            body='<soap-env:Fault><faultcode>soap-env:Client.0111</faultcode>'
+                 '<faultstring>No tiene el perfil para enviar comprobantes electronicos</faultstring></soap-env:Fault>'
+        ))
+
+        self.assertTrue(response.is_fault)
+        self.assertEqual(response.faultcode, 'soap-env:Client.0111')
+        self.assertIsNone(response.cdr_bytes())
+
+    def test_missing_application_response(self):
+        from operations.services.billing_service import SunatConnector
+
+        company = create_company('20100000005')
+        operation = create_operation(company)
+        response = SOAP_TEMPLATE.format(body='<br:sendBillResponse xmlns:br="http://service.sunat.gob.pe"/>').encode()
+
+        with self.assertRaises(SunatResponseError):
+            SunatConnector(company)._process_response_manual(response, operation)
+
+    def test_invalid_cdr(self):
+        with self.assertRaises(SunatResponseError):
+            parse_cdr(b'not a zip')
+        with self.assertRaises(SunatResponseError):
+            parse_soap_response(b'<soap-env:Envelope')
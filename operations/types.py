@@ -4,6 +4,7 @@ from graphene_django import DjangoObjectType
 
 from finances.types import PaymentType
 from operations.models import Person, Document, Serial, Operation, OperationDetail
+from operations.services.payment_schedule import PaymentSchedule
 from products.models import Product, Unit
 from products.types import TopProductType
 
@@ -73,7 +74,8 @@ class OperationType(DjangoObjectType):
         return self.operationdetail_set.all()
 
     def resolve_payment_set(self, info):
-        return self.payment_set.all()
+        # Comparte la carga de pagos con el generador de XML
+        return PaymentSchedule.for_operation(self).payments
 
     def resolve_xml_download_url(self, info):
         return self.xml_download_url
@@ -5,6 +5,7 @@ from django.contrib.auth.models import AbstractUser
 from django.db import models
 
 from operations.services.billing_service import BillingFileManager
+from operations.services.ubl_writer import CompanyFragmentCache
 
 PDF_SIZES = [
     ('T', 'Ticket'),
@@ -100,6 +101,7 @@ class Company(models.Model):
     # Configuración adicional
     max_retry_attempts = models.IntegerField('Máximo Intentos', default=5)
     retry_interval_minutes = models.IntegerField('Intervalo Reintentos (min)', default=30)
+    billing_weight = models.IntegerField('Peso en Cola de Facturación', default=1)
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -128,6 +130,8 @@ class Company(models.Model):
             pass
 
         super().save(*args, **kwargs)
+        # Los fragmentos UBL del emisor deben reconstruirse con los datos nuevos
+        CompanyFragmentCache.invalidate(self.pk)
         # Crear estructura de carpetas al guardar
         if self.ruc:
             BillingFileManager.create_company_folders(self.ruc)